@@ -0,0 +1,111 @@
+"""Benchmark the NumPy DSP engine against the equivalent ffmpeg filters.
+
+Usage: python benchmarks/dsp_throughput.py [--seconds 120] [--preset rock]
+
+Reports samples/sec on a single core (BLAS threads pinned to 1, ffmpeg run
+with -threads 1 -filter_threads 1) for:
+  * in-process block processing (EQ, auto-panner, gain)
+  * ffmpeg equalizer/apulsator/volume filters on the same synthetic noise
+  * file-to-file runs of both (WAV in, WAV out)
+"""
+import os
+
+for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(var, '1')
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.dsp import dsp_engine, Gain, EQ_PRESETS, SAMPLE_RATE, CHANNELS, BLOCK_SIZE  # noqa: E402
+from utils.ffmpeg import FFmpegHelper  # noqa: E402
+
+
+def noise_source(seconds):
+    return (f"anoisesrc=d={seconds}:r={SAMPLE_RATE}:a=0.3,"
+            f"aformat=sample_fmts=fltp:channel_layouts=stereo")
+
+
+def ffmpeg_filter_rate(seconds, audio_filter):
+    """Samples/sec of an ffmpeg filter, net of generating the source"""
+    def timed(af):
+        start = time.perf_counter()
+        subprocess.run(['ffmpeg', '-v', 'error', '-threads', '1', '-filter_threads', '1',
+                        '-f', 'lavfi', '-i', noise_source(seconds),
+                        '-af', af, '-f', 'null', '-'], check=True)
+        return time.perf_counter() - start
+
+    elapsed = timed(audio_filter) - timed('anull')
+    return seconds * SAMPLE_RATE * CHANNELS / max(elapsed, 1e-9)
+
+
+def engine_rate(seconds, make_stages):
+    rng = np.random.default_rng(0)
+    block = rng.standard_normal((BLOCK_SIZE, CHANNELS)) * 0.3
+    blocks = int(seconds * SAMPLE_RATE / BLOCK_SIZE)
+    stages = make_stages()
+    start = time.perf_counter()
+    for _ in range(blocks):
+        for stage in stages:
+            stage.process(block)
+    elapsed = time.perf_counter() - start
+    return blocks * BLOCK_SIZE * CHANNELS / elapsed
+
+
+def file_runs(seconds, workdir, preset):
+    source = os.path.join(workdir, 'noise.wav')
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', noise_source(seconds),
+                    source], check=True)
+    output = os.path.join(workdir, 'out.wav')
+
+    start = time.perf_counter()
+    dsp_engine.process_file(source, output, [dsp_engine.equalizer(preset), Gain(-1)])
+    engine = time.perf_counter() - start
+
+    cmd = FFmpegHelper.apply_equalizer(source, output, EQ_PRESETS[preset])
+    cmd[1:1] = ['-v', 'error', '-y', '-threads', '1', '-filter_threads', '1']
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True)
+    ffmpeg = time.perf_counter() - start
+
+    for path in (source, output):
+        os.remove(path)
+    return {"engine_s": round(engine, 3), "ffmpeg_s": round(ffmpeg, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=int, default=120, help="audio length to process")
+    parser.add_argument('--preset', default='rock', choices=sorted(EQ_PRESETS))
+    parser.add_argument('--workdir', default=os.path.join(ROOT, 'temp', 'bench_dsp'))
+    args = parser.parse_args()
+    os.makedirs(args.workdir, exist_ok=True)
+
+    bands = EQ_PRESETS[args.preset]
+    eq_filter = FFmpegHelper.apply_equalizer('-', '-', bands)[4]
+    results = {
+        "preset": args.preset,
+        "bands": len(bands),
+        "samples_per_sec": {
+            "engine_eq": engine_rate(args.seconds, lambda: [dsp_engine.equalizer(args.preset)]),
+            "ffmpeg_eq": ffmpeg_filter_rate(args.seconds, eq_filter),
+            "engine_8d": engine_rate(args.seconds, lambda: [dsp_engine.auto_panner()]),
+            "ffmpeg_8d": ffmpeg_filter_rate(args.seconds, 'apulsator=hz=0.125'),
+            "engine_gain": engine_rate(args.seconds, lambda: [Gain(-3)]),
+            "ffmpeg_gain": ffmpeg_filter_rate(args.seconds, 'volume=-3dB'),
+        },
+        "file_to_file": file_runs(args.seconds, args.workdir, args.preset),
+    }
+    results["samples_per_sec"] = {k: int(v) for k, v in results["samples_per_sec"].items()}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
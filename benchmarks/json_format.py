@@ -0,0 +1,104 @@
+"""Benchmark the streaming JSON formatter against json.load + json.dump.
+
+Usage: python benchmarks/json_format.py [--sizes 50 200 400] [--keep]
+
+Each implementation runs in a fresh child process so peak RSS is measured
+independently.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REPORT = """
+import resource
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+LEGACY = """
+import json, sys
+with open(sys.argv[1], 'r', encoding='utf-8') as f:
+    data = json.load(f)
+with open(sys.argv[2], 'w', encoding='utf-8') as f:
+    json.dump(data, f, indent=4, ensure_ascii=False)
+""" + REPORT
+
+STREAMING = """
+import sys
+sys.path.insert(0, %r)
+from utils.json_stream import json_formatter
+json_formatter.format_file(sys.argv[1], sys.argv[2], indent=4)
+""" % ROOT + REPORT
+
+
+def generate(path, size_mb, seed=42):
+    """Write a minified synthetic JSON export of roughly size_mb megabytes"""
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        i = 0
+        while written < target:
+            record = {
+                "id": i,
+                "name": "user_%d" % rng.randrange(10 ** 6),
+                "score": rng.random() * 1000,
+                "active": rng.random() > 0.5,
+                "tags": ["t%d" % rng.randrange(50) for _ in range(rng.randrange(6))],
+                "profile": {"city": "Zürich", "zip": None, "visits": rng.randrange(10 ** 4)},
+            }
+            chunk = (',' if i else '') + json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+            f.write(chunk)
+            written += len(chunk)
+            i += 1
+        f.write(']')
+
+
+def run(script, input_path, output_path):
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-c', script, input_path, output_path],
+                          stdout=subprocess.PIPE, check=True)
+    wall = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "wall_s": round(wall, 3),
+        "cpu_s": round((after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime), 3),
+        "peak_rss_mb": round(int(proc.stdout.split()[-1]) / 1024, 1),
+        "output_mb": round(os.path.getsize(output_path) / 1024 / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200, 400], help="input sizes in MB")
+    parser.add_argument('--workdir', default=os.path.join(ROOT, 'temp', 'bench_json'))
+    parser.add_argument('--keep', action='store_true', help="keep generated files")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = []
+    for size in args.sizes:
+        input_path = os.path.join(args.workdir, f'input_{size}mb.json')
+        if not os.path.exists(input_path):
+            generate(input_path, size)
+        streaming = run(STREAMING, input_path, os.path.join(args.workdir, 'streaming.json'))
+        legacy = run(LEGACY, input_path, os.path.join(args.workdir, 'legacy.json'))
+        results.append({"size_mb": size, "streaming": streaming, "json_load_dump": legacy})
+        print(json.dumps(results[-1]))
+        if not args.keep:
+            for name in (input_path, 'streaming.json', 'legacy.json'):
+                path = os.path.join(args.workdir, name)
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,570 @@
+"""Load-test the bot's handlers against a local stand-in for Telegram.
+
+Usage: python benchmarks/load.py [--target handlers|bot] [--users 20] [--jobs-per-user 3]
+                                 [--operations video_remove_audio video_screenshot]
+                                 [--concurrency 1 2 4 8] [--latency 0.05] [--bandwidth 20]
+                                 [--flood-rate 0.01] [--flood-seconds 5] [--output load.json]
+
+Each simulated user sends a video, waits --think seconds and presses an
+operation button, --jobs-per-user times. Users start spread over --ramp
+seconds. A job's latency runs from the button press until the handler
+is done with it: the result is uploaded, or the user was told why not.
+
+Targets:
+
+- handlers: the Pyrogram plugins in handlers/video.py, called with
+  StubClient. Running MTProto locally isn't practical, so the stand-in
+  sits at the client method boundary (download_media, stream_media,
+  send_*) and the messages and callback queries handed to the handlers
+  are stand-ins too. Jobs run inline, through admission control, once
+  per --concurrency value (the slot count, i.e. MAX_CONCURRENT_JOBS).
+- bot: bot.py's Application, pointed at BotApiStub, a local aiohttp
+  server speaking enough of the Bot API. Updates go through
+  Application.process_update. The stub runs on its own thread and loop,
+  like a remote server would. Needs python-telegram-bot.
+
+Every Telegram request pays --latency seconds. File transfers also share
+one --bandwidth MB/s link per direction. A --flood-rate fraction of
+requests get a FloodWait of --flood-seconds: the Bot API stub answers
+429, and StubClient sleeps through waits up to Pyrogram's
+sleep_threshold (logging them as Pyrogram does, so metrics count them)
+and raises FloodWait past it.
+
+The handlers keep state in MongoDB: --mongodb (default a local server)
+and --database are used instead of the configured ones. Inputs are
+synthesized as in benchmarks/media.py. Everything runs in --workdir.
+
+For each run the report has throughput, latency percentiles overall and
+per operation, outcomes, the phase percentiles from the job records
+(handlers target), Telegram requests, FloodWaits and bytes, CPU time
+and utilisation, and peak RSS of the bot and its ffmpeg children.
+"recommended" is the smallest concurrency within 5% of the best
+throughput; past it, more slots only add latency.
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.media import PROFILES, synthesize  # noqa: E402
+from utils.tracing import PERCENTILES, tracer  # noqa: E402
+
+MB = 1024 * 1024
+CHUNK = 1024 * 1024
+
+DEFAULT_OPERATIONS = {
+    "handlers": ("video_remove_audio", "video_extract_audio", "video_mute", "video_screenshot"),
+    "bot": ("video_remove_audio", "video_extract_audio", "video_mute"),
+}
+
+# Pyrogram's default Client.sleep_threshold
+SLEEP_THRESHOLD = 10
+
+_ids = itertools.count(1)
+
+
+def latency_stats(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    stats = {"count": len(values)}
+    stats.update({f"p{p}": round(tracer.percentile(values, p), 3) for p in PERCENTILES})
+    stats["max"] = round(values[-1], 3)
+    return stats
+
+
+class Network:
+    """Latency, bandwidth and FloodWaits of the Telegram side"""
+
+    def __init__(self, latency, bandwidth, flood_rate, flood_seconds, seed=0):
+        self.latency = latency
+        self.bandwidth = bandwidth * MB
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.random = random.Random(seed)
+        self.calls = collections.Counter()
+        self.floods = collections.Counter()
+        self.bytes = {"in": 0, "out": 0}
+        # When each direction's link is next free, in loop time
+        self._free = {"in": 0.0, "out": 0.0}
+
+    def flood(self, method):
+        """Seconds to wait if this request is flooded, else 0"""
+        if self.flood_rate and self.random.random() < self.flood_rate:
+            self.floods[method] += 1
+            return self.flood_seconds
+        return 0
+
+    async def request(self, method, size=0, direction=None):
+        """Pay for one request carrying `size` bytes "in" (to the bot) or "out" """
+        self.calls[method] += 1
+        delay = self.latency
+        if size and direction:
+            self.bytes[direction] += size
+            now = asyncio.get_running_loop().time()
+            start = max(now, self._free[direction])
+            self._free[direction] = start + size / self.bandwidth
+            delay += self._free[direction] - now
+        await asyncio.sleep(delay)
+
+    def report(self):
+        return {"requests": dict(self.calls), "flood_waits": dict(self.floods),
+                "bytes_in": self.bytes["in"], "bytes_out": self.bytes["out"]}
+
+
+class StubClient:
+    """Stand-in for pyrogram.Client, with the methods the video handlers use"""
+
+    def __init__(self, network, sleep_threshold=SLEEP_THRESHOLD):
+        self.network = network
+        self.sleep_threshold = sleep_threshold
+        self.name = "loadtest"
+        # file_id -> local source file
+        self.files = {}
+        self.log = logging.getLogger("pyrogram.session.session")
+
+    async def invoke(self, method, size=0, direction=None):
+        """One request, handling FloodWait the way Pyrogram's session does"""
+        from pyrogram.errors import FloodWait
+        seconds = self.network.flood(method)
+        if seconds > self.sleep_threshold:
+            raise FloodWait(value=seconds, rpc_name=method)
+        if seconds:
+            self.log.warning('[%s] Waiting for %s seconds before continuing (required by "%s")',
+                             self.name, seconds, method)
+            await asyncio.sleep(seconds)
+        await self.network.request(method, size, direction)
+
+    def incoming(self, user_id, source, seconds, width, height):
+        """A video message from `user_id`"""
+        file_id = f"loadtest{next(_ids):012d}"
+        self.files[file_id] = source
+        video = SimpleNamespace(file_id=file_id, file_name="video.mp4",
+                                file_size=os.path.getsize(source), mime_type="video/mp4",
+                                duration=seconds, width=width, height=height)
+        return StubMessage(self, user_id, video=video)
+
+    async def download_media(self, file_id, file_name=None, **kwargs):
+        source = self.files[file_id]
+        await self.invoke("upload.GetFile", os.path.getsize(source), "in")
+        shutil.copyfile(source, file_name)
+        return file_name
+
+    async def stream_media(self, file_id, offset=0, limit=0):
+        with open(self.files[file_id], "rb") as f:
+            f.seek(offset * CHUNK)
+            for _ in itertools.count() if not limit else range(limit):
+                chunk = f.read(CHUNK)
+                if not chunk:
+                    break
+                await self.invoke("upload.GetFile", len(chunk), "in")
+                yield chunk
+
+    async def _send(self, chat_id, path):
+        size = os.path.getsize(path) if isinstance(path, str) and os.path.exists(path) else 0
+        await self.invoke("messages.SendMedia", size, "out")
+        return StubMessage(self, chat_id)
+
+    async def send_video(self, chat_id, video, **kwargs):
+        return await self._send(chat_id, video)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        return await self._send(chat_id, document)
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        return await self._send(chat_id, photo)
+
+    async def send_audio(self, chat_id, audio, **kwargs):
+        return await self._send(chat_id, audio)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self.invoke("messages.SendMessage")
+        return StubMessage(self, chat_id, text=text)
+
+    async def get_messages(self, chat_id, message_ids):
+        await self.invoke("messages.GetMessages")
+        return StubMessage(self, chat_id)
+
+
+class StubMessage:
+    """Stand-in for pyrogram.types.Message in a private chat"""
+
+    def __init__(self, client, chat_id, text=None, video=None):
+        self._client = client
+        self.id = next(_ids)
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = SimpleNamespace(id=chat_id)
+        self.text = text
+        self.caption = None
+        self.caption_entities = None
+        self.video = video
+        self.audio = self.document = self.animation = self.photo = self.voice = None
+
+    async def edit_text(self, text, **kwargs):
+        await self._client.invoke("messages.EditMessage")
+        self.text = text
+        return self
+
+    async def reply_text(self, text, **kwargs):
+        return await self._client.send_message(self.chat.id, text)
+
+
+class StubCallbackQuery:
+    """Stand-in for pyrogram.types.CallbackQuery"""
+
+    def __init__(self, client, message, data):
+        self._client = client
+        self.from_user = message.from_user
+        self.message = message
+        self.data = data
+
+    async def answer(self, text=None, show_alert=None, **kwargs):
+        await self._client.invoke("messages.SetBotCallbackAnswer")
+        return True
+
+
+def outcome(text):
+    """A job's outcome from the last thing the user was told"""
+    if text and text.startswith("❌ Can't take this job"):
+        return "rejected"
+    if text and text.startswith("❌"):
+        return "failed"
+    return "ok"
+
+
+class HandlersTarget:
+    """Drives handlers/video.py through StubClient"""
+
+    def __init__(self, network, source, seconds, width, height):
+        from handlers import video
+        self.video = video
+        self.client = StubClient(network)
+        self.source = (source, seconds, width, height)
+
+    async def job(self, user_id, operation, think):
+        message = self.client.incoming(user_id, *self.source)
+        await self.video.handle_video(self.client, message)
+        await asyncio.sleep(think)
+        query = StubCallbackQuery(self.client, StubMessage(self.client, user_id), operation)
+        started = time.perf_counter()
+        try:
+            await self.video.handle_video_callback(self.client, query)
+            result = outcome(query.message.text)
+        except Exception as e:
+            result, query.message.text = "error", f"{type(e).__name__}: {e}"
+        return result, time.perf_counter() - started, query.message.text
+
+
+class BotApiStub:
+    """A local Bot API server with the methods bot.py calls, on its own thread"""
+
+    TOKEN = "123456:loadtest"
+    UPLOADS = ("sendDocument", "sendVideo", "sendAudio", "sendPhoto", "sendAnimation", "sendVoice")
+
+    def __init__(self, network, source):
+        self.network = network
+        self.source = source
+        self.texts = {}
+        self.port = None
+        self.loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._serve, daemon=True).start()
+        self._ready.wait()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def _serve(self):
+        from aiohttp import web
+        asyncio.set_event_loop(self.loop)
+        app = web.Application(client_max_size=2 * 1024 * MB)
+        app.router.add_post("/bot{token}/{method}", self.api)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.file)
+        runner = web.AppRunner(app)
+        self.loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self.loop.run_forever()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    @property
+    def base_file_url(self):
+        return f"http://127.0.0.1:{self.port}/file/bot"
+
+    def message(self, chat_id, text=None, message_id=None):
+        return {"message_id": int(message_id or next(_ids)), "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"}, "text": text}
+
+    async def api(self, request):
+        from aiohttp import web
+        method = request.match_info["method"]
+        upload = method in self.UPLOADS
+        params = await request.post()
+        # getMe only runs at startup, which a 429 would abort
+        seconds = self.network.flood(method) if method != "getMe" else 0
+        if seconds:
+            return web.json_response({"ok": False, "error_code": 429,
+                                      "description": f"Too Many Requests: retry after {seconds}",
+                                      "parameters": {"retry_after": seconds}})
+        await self.network.request(method, (request.content_length or 0) if upload else 0, "out")
+        chat_id = params.get("chat_id", 0)
+        if method == "getMe":
+            result = {"id": 123456, "is_bot": True, "first_name": "Load", "username": "loadtest_bot"}
+        elif method == "getFile":
+            file_id = params["file_id"]
+            result = {"file_id": file_id, "file_unique_id": file_id,
+                      "file_size": os.path.getsize(self.source), "file_path": f"videos/{file_id}.mp4"}
+        elif method in ("sendMessage", "editMessageText"):
+            self.texts[int(chat_id)] = params.get("text")
+            result = self.message(chat_id, params.get("text"), params.get("message_id"))
+        elif upload:
+            result = self.message(chat_id)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def file(self, request):
+        from aiohttp import web
+        await self.network.request("file", os.path.getsize(self.source), "in")
+        return web.FileResponse(self.source)
+
+
+class BotTarget:
+    """Drives bot.py's Application through BotApiStub"""
+
+    def __init__(self, network, source, seconds, width, height):
+        os.environ["BOT_TOKEN"] = BotApiStub.TOKEN
+        import bot
+        self.stub = BotApiStub(network, source)
+        self.stub.start()
+        self.application = bot.build_application(self.stub.base_url, self.stub.base_file_url)
+        self.source = (source, seconds, width, height)
+        self._updates = itertools.count(1)
+
+    async def start(self):
+        await self.application.initialize()
+
+    async def stop(self):
+        await self.application.shutdown()
+        self.stub.stop()
+
+    async def process(self, data):
+        from telegram import Update
+        data["update_id"] = next(self._updates)
+        await self.application.process_update(Update.de_json(data, self.application.bot))
+
+    async def job(self, user_id, operation, think):
+        source, seconds, width, height = self.source
+        user = {"id": user_id, "is_bot": False, "first_name": "Load"}
+        file_id = f"loadtest{next(_ids):012d}"
+        message = self.stub.message(user_id)
+        message.update({"from": user, "video": {
+            "file_id": file_id, "file_unique_id": file_id, "width": width, "height": height,
+            "duration": seconds, "file_size": os.path.getsize(source),
+            "file_name": "video.mp4", "mime_type": "video/mp4"}})
+        await self.process({"message": message})
+        await asyncio.sleep(think)
+        started = time.perf_counter()
+        await self.process({"callback_query": {
+            "id": str(next(_ids)), "from": user, "chat_instance": "loadtest",
+            "data": operation, "message": self.stub.message(user_id)}})
+        text = self.stub.texts.get(user_id)
+        return outcome(text), time.perf_counter() - started, text
+
+
+class Resources:
+    """CPU time and peak RSS of this process and its children while a run lasts"""
+
+    def __init__(self, interval=0.5):
+        import psutil
+        self.psutil = psutil
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak_rss = 0
+        self._stop = threading.Event()
+
+    def _cpu(self):
+        t = self.process.cpu_times()
+        return t.user + t.system + t.children_user + t.children_system
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            rss = 0
+            for process in [self.process] + self.process.children(recursive=True):
+                try:
+                    rss += process.memory_info().rss
+                except self.psutil.Error:
+                    pass
+            self.peak_rss = max(self.peak_rss, rss)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.cpu = self._cpu()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self.thread.join()
+        self.wall = time.perf_counter() - self.started
+        self.cpu = self._cpu() - self.cpu
+
+    def report(self):
+        return {
+            "cpu_s": round(self.cpu, 2),
+            # Share of all cores
+            "cpu_utilisation": round(self.cpu / self.wall / (os.cpu_count() or 1), 3),
+            "peak_rss_mb": round(self.peak_rss / MB, 1),
+            "load_average": round(os.getloadavg()[0], 2),
+        }
+
+
+async def user(target, user_id, args, rng, results):
+    await asyncio.sleep(rng.uniform(0, args.ramp))
+    for _ in range(args.jobs_per_user):
+        operation = rng.choice(args.operations)
+        think = args.think * rng.uniform(0.5, 1.5)
+        result, seconds, text = await target.job(user_id, operation, think)
+        results.append((operation, result, seconds, text))
+
+
+async def run(args, media, concurrency):
+    network = Network(args.latency, args.bandwidth, args.flood_rate, args.flood_seconds, args.seed)
+    profile = PROFILES[args.profile]
+    if args.target == "bot":
+        target = BotTarget(network, media["video"], *profile)
+        await target.start()
+    else:
+        from utils.admission import admission
+        admission.slots = concurrency
+        admission.speed = 1.0
+        target = HandlersTarget(network, media["video"], *profile)
+
+    rng = random.Random(args.seed)
+    results = []
+    since = datetime.now()
+    with Resources() as resources:
+        await asyncio.gather(*(user(target, 900000 + i, args, rng, results)
+                               for i in range(args.users)))
+    if args.target == "bot":
+        await target.stop()
+
+    report = {
+        "concurrency": concurrency,
+        "jobs": len(results),
+        "outcomes": dict(collections.Counter(result for _, result, _, _ in results)),
+        "duration_s": round(resources.wall, 2),
+        "throughput_per_min": round(60 * sum(r == "ok" for _, r, _, _ in results) / resources.wall, 2),
+        "latency_s": latency_stats([s for _, r, s, _ in results if r == "ok"]),
+        "operations": {
+            operation: latency_stats([s for op, r, s, _ in results if op == operation and r == "ok"])
+            for operation in sorted(set(op for op, _, _, _ in results))
+        },
+        "errors": dict(collections.Counter(t for _, r, _, t in results if r != "ok").most_common(5)),
+        "telegram": network.report(),
+        "resources": resources.report(),
+    }
+    if args.target == "handlers":
+        from utils.database import db
+        report["phases"] = tracer.summary(await db.job_traces(since))
+    return report
+
+
+def recommended(runs):
+    ok = [run for run in runs if run["concurrency"] and run["jobs"]]
+    if not ok:
+        return None
+    best = max(run["throughput_per_min"] for run in ok)
+    return min(run["concurrency"] for run in ok if run["throughput_per_min"] >= 0.95 * best)
+
+
+async def run_all(args, media):
+    from utils.metrics import metrics
+    metrics.watch_flood_waits()
+    if args.metrics_port:
+        from health import start_health_server
+        await start_health_server(args.metrics_port)
+    levels = args.concurrency if args.target == "handlers" else [None]
+    runs = [await run(args, media, concurrency) for concurrency in levels]
+    return {
+        "target": args.target,
+        "profile": args.profile,
+        "users": args.users,
+        "jobs_per_user": args.jobs_per_user,
+        "operations": args.operations,
+        "network": {"latency_s": args.latency, "bandwidth_mb_s": args.bandwidth,
+                    "flood_rate": args.flood_rate, "flood_seconds": args.flood_seconds},
+        "cpu_count": os.cpu_count(),
+        "runs": runs,
+        "recommended": recommended(runs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=("handlers", "bot"), default="handlers")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--jobs-per-user', type=int, default=3)
+    parser.add_argument('--operations', nargs='+', help="callback data of the buttons pressed")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[3],
+                        help="job slots to try, one run each (handlers target)")
+    parser.add_argument('--profile', choices=sorted(PROFILES), default="short_360p")
+    parser.add_argument('--think', type=float, default=1.0, help="seconds before pressing a button")
+    parser.add_argument('--ramp', type=float, default=5.0, help="seconds over which users start")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per Telegram request")
+    parser.add_argument('--bandwidth', type=float, default=20.0, help="MB/s per direction")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="fraction of requests flooded")
+    parser.add_argument('--flood-seconds', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mongodb', default="mongodb://localhost:27017")
+    parser.add_argument('--database', default="loadtest")
+    parser.add_argument('--metrics-port', type=int, help="serve /metrics during the run")
+    parser.add_argument('--workdir', default=os.path.join(ROOT, 'temp', 'bench_load'))
+    parser.add_argument('--output', help="write the report to this file as well")
+    args = parser.parse_args()
+    args.operations = args.operations or list(DEFAULT_OPERATIONS[args.target])
+
+    if args.target == "bot":
+        import importlib.util
+        if importlib.util.find_spec("telegram") is None:
+            sys.exit("--target bot needs python-telegram-bot")
+
+    workdir = os.path.abspath(args.workdir)
+    media = synthesize(workdir, args.profile)
+    output = os.path.abspath(args.output) if args.output else None
+    # Read by config.py on import; jobs run inline so admission sees them
+    os.environ.update(MONGODB_URI=args.mongodb, DATABASE_NAME=args.database, JOB_QUEUE="")
+    # The handlers write under ./temp
+    os.makedirs(os.path.join(workdir, 'run'), exist_ok=True)
+    os.chdir(os.path.join(workdir, 'run'))
+
+    report = asyncio.run(run_all(args, media))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+"""Benchmark every FFmpegHelper operation and bot.py processor on synthetic media.
+
+Usage: python benchmarks/media.py [--profiles short_360p medium_720p] [--runs 3]
+                                  [--only ffmpeg.trim_video bot.video.compress_video]
+                                  [--output baseline.json]
+       python benchmarks/media.py --compare baseline.json [--current run.json]
+                                  [--threshold 0.15] [--min-seconds 0.1]
+
+Inputs are generated locally with ffmpeg lavfi sources, and are
+deterministic for a given ffmpeg build. Each profile has an H.264/AAC MP4
+with a mov_text subtitle track, a stereo MP3 of the same length and an
+SRT file. They are cached in --workdir. Nothing touches the network.
+
+Every operation runs --runs times in a fresh output directory. A run
+records wall time, CPU time (user + system, children included) and peak
+RSS from wait4() on the process that ran it. Output size is the total
+size of the files it wrote.
+
+- FFmpegHelper command builders run ffmpeg directly, so RSS is ffmpeg's.
+- Probes and the bot.py processors run in a child interpreter, so their
+  RSS includes Python and the imports. They are skipped when bot.py's
+  dependencies are not installed.
+
+The median run is reported.
+
+--compare checks a run against a baseline. With --current it uses an
+earlier result; without it, it runs the suite with the baseline's
+profiles. It flags a metric that got more than --threshold worse. Wall
+and CPU times below --min-seconds in both runs are not compared, since
+at that scale they are mostly noise. The exit status is 1 when anything
+regressed.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.dsp import EQ_PRESETS  # noqa: E402
+from utils.ffmpeg import FFmpegHelper  # noqa: E402
+
+# name -> (seconds, width, height)
+PROFILES = {
+    "short_360p": (10, 640, 360),
+    "medium_720p": (30, 1280, 720),
+    "long_1080p": (60, 1920, 1080),
+}
+DEFAULT_PROFILES = ("short_360p", "medium_720p")
+
+# Metrics compared against a baseline, and whether a higher value is worse
+METRICS = {"wall_s": True, "cpu_s": True, "peak_rss_mb": True, "output_bytes": True}
+
+CHILD = """
+import importlib, json, sys
+sys.path.insert(0, %r)
+module, owner, method, args = json.loads(sys.argv[1])
+target = getattr(importlib.import_module(module), owner)
+if module == 'bot':
+    target = target()
+getattr(target, method)(*args)
+"""
+
+
+# name -> command for a profile's inputs `m` and an output path maker `o`
+FFMPEG_OPERATIONS = {
+    "remove_audio": lambda m, o: FFmpegHelper.remove_audio(m["video"], o("out.mp4")),
+    "extract_audio": lambda m, o: FFmpegHelper.extract_audio(m["video"], o("out"), "mp3"),
+    "extract_subtitles": lambda m, o: FFmpegHelper.extract_subtitles(m["video"], o("out")),
+    "trim_video": lambda m, o: FFmpegHelper.trim_video(
+        m["video"], o("out.mp4"), "1", str(m["seconds"] / 2)),
+    "merge_videos": lambda m, o: FFmpegHelper.merge_videos([m["video"], m["video"]], o("out.mp4")),
+    "cut_segments": lambda m, o: FFmpegHelper.cut_segments(
+        m["video"], o("out.m4a"), [(0, m["seconds"] / 4), (m["seconds"] / 2, m["seconds"] * 3 / 4)]),
+    "mute_audio": lambda m, o: FFmpegHelper.mute_audio(m["video"], o("out.mp4")),
+    "merge_video_audio": lambda m, o: FFmpegHelper.merge_video_audio(m["video"], m["audio"], o("out.mp4")),
+    "add_subtitles": lambda m, o: FFmpegHelper.add_subtitles(m["video"], m["srt"], o("out.mp4")),
+    "generate_palette": lambda m, o: FFmpegHelper.generate_palette(m["video"], o("palette.png")),
+    "convert_to_gif": lambda m, o: FFmpegHelper.convert_to_gif(m["video"], o("out.gif")),
+    "split_video": lambda m, o: FFmpegHelper.split_video(
+        m["video"], o("part%03d.mp4"), max(1, m["seconds"] // 3)),
+    "multi_output_transcode": lambda m, o: FFmpegHelper.multi_output_transcode(m["video"], [
+        {"path": o("out_240.mp4"), "format": "mp4", "height": 240},
+        {"path": o("out_360.mp4"), "format": "mp4", "height": 360},
+        {"path": o("out.mkv"), "format": "mkv"},
+    ]),
+    "take_screenshot": lambda m, o: FFmpegHelper.take_screenshot(m["video"], o("out.jpg"), "1"),
+    "convert_audio": lambda m, o: FFmpegHelper.convert_audio(m["audio"], o("out.ogg"), "ogg", "128k"),
+    "optimize_video": lambda m, o: FFmpegHelper.optimize_video(m["video"], o("out.mp4")),
+    "change_audio_speed": lambda m, o: FFmpegHelper.change_audio_speed(m["audio"], o("out.mp3"), 1.25),
+    "change_volume": lambda m, o: FFmpegHelper.change_volume(m["audio"], o("out.mp3"), 0.5),
+    "apply_bass_boost": lambda m, o: FFmpegHelper.apply_bass_boost(m["audio"], o("out.mp3"), 10),
+    "apply_treble_boost": lambda m, o: FFmpegHelper.apply_treble_boost(m["audio"], o("out.mp3"), 10),
+    "create_8d_audio": lambda m, o: FFmpegHelper.create_8d_audio(m["audio"], o("out.mp3")),
+    "apply_equalizer": lambda m, o: FFmpegHelper.apply_equalizer(
+        m["audio"], o("out.mp3"), EQ_PRESETS["rock"]),
+    "apply_slow_reverb": lambda m, o: FFmpegHelper.apply_slow_reverb(m["audio"], o("out.mp3")),
+}
+
+# name -> (module, class, method, args) run in a child interpreter; bot.py
+# classes are instantiated first
+PYTHON_OPERATIONS = {
+    "ffmpeg.get_duration": lambda m, o: ("utils.ffmpeg", "FFmpegHelper", "get_duration", [m["video"]]),
+    "ffmpeg.get_media_info": lambda m, o: ("utils.ffmpeg", "FFmpegHelper", "get_media_info", [m["video"]]),
+    "bot.video.remove_audio_subtitles": lambda m, o: (
+        "bot", "VideoProcessor", "remove_audio_subtitles", [m["video"], o("out.mp4")]),
+    "bot.video.extract_audio": lambda m, o: (
+        "bot", "VideoProcessor", "extract_audio", [m["video"], o("out.mp3")]),
+    "bot.video.mute_audio": lambda m, o: ("bot", "VideoProcessor", "mute_audio", [m["video"], o("out.mp4")]),
+    "bot.video.video_to_gif": lambda m, o: (
+        "bot", "VideoProcessor", "video_to_gif", [m["video"], o("out.gif")]),
+    "bot.video.convert_video_format_mp4": lambda m, o: (
+        "bot", "VideoProcessor", "convert_video_format", [m["video"], o("out.mp4"), "mp4"]),
+    "bot.video.convert_video_format_mkv": lambda m, o: (
+        "bot", "VideoProcessor", "convert_video_format", [m["video"], o("out.mkv"), "mkv"]),
+    "bot.video.transcode_outputs": lambda m, o: ("bot", "VideoProcessor", "transcode_outputs", [m["video"], [
+        {"path": o("out_240.mp4"), "format": "mp4", "height": 240},
+        {"path": o("out.mkv"), "format": "mkv"},
+    ]]),
+    "bot.video.compress_video": lambda m, o: (
+        "bot", "VideoProcessor", "compress_video", [m["video"], o("out.mp4"), m["video_bytes"] // 2]),
+    "bot.video.generate_screenshots": lambda m, o: (
+        "bot", "VideoProcessor", "generate_screenshots", [m["video"], o("shot%d.jpg"), 5]),
+    "bot.audio.convert_audio_format": lambda m, o: (
+        "bot", "AudioProcessor", "convert_audio_format", [m["audio"], o("out.ogg"), "ogg"]),
+    "bot.audio.apply_slowed_reverb": lambda m, o: (
+        "bot", "AudioProcessor", "apply_slowed_reverb", [m["audio"], o("out.mp3")]),
+    "bot.audio.apply_8d_audio": lambda m, o: (
+        "bot", "AudioProcessor", "apply_8d_audio", [m["audio"], o("out.mp3")]),
+    "bot.audio.apply_equalizer": lambda m, o: (
+        "bot", "AudioProcessor", "apply_equalizer", [m["audio"], o("out.mp3"), "rock"]),
+    "bot.audio.change_audio_speed": lambda m, o: (
+        "bot", "AudioProcessor", "change_audio_speed", [m["audio"], o("out.mp3"), 125]),
+    "bot.audio.change_volume": lambda m, o: (
+        "bot", "AudioProcessor", "change_volume", [m["audio"], o("out.mp3"), 50]),
+    "bot.audio.compress_audio": lambda m, o: (
+        "bot", "AudioProcessor", "compress_audio", [m["audio"], o("out.mp3"), 64]),
+}
+
+
+def srt_time(seconds):
+    return f"{int(seconds // 3600):02d}:{int(seconds % 3600 // 60):02d}:{int(seconds % 60):02d},{int(seconds * 1000 % 1000):03d}"
+
+
+def synthesize(workdir, profile):
+    """Generate (once) the inputs of a profile"""
+    seconds, width, height = PROFILES[profile]
+    base = os.path.join(workdir, 'inputs', profile)
+    os.makedirs(base, exist_ok=True)
+    media = {"seconds": seconds, "video": f"{base}/video.mp4", "audio": f"{base}/audio.mp3",
+             "srt": f"{base}/subs.srt"}
+    if all(os.path.exists(media[kind]) for kind in ("video", "audio", "srt")):
+        media["video_bytes"] = os.path.getsize(media["video"])
+        return media
+
+    with open(media["srt"], 'w') as f:
+        for i in range(seconds // 2):
+            f.write(f"{i + 1}\n{srt_time(2 * i)} --> {srt_time(2 * i + 1.5)}\nLine {i + 1}\n\n")
+    bitexact = ['-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact']
+    tone = (f"aevalsrc=exprs='0.4*sin(2*PI*220*t)+0.05*random(0)|"
+            f"0.4*sin(2*PI*330*t)+0.05*random(1)':s=44100:d={seconds}")
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y', '-nostdin',
+        '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate=30:duration={seconds}',
+        '-f', 'lavfi', '-i', tone,
+        '-i', media["srt"],
+        '-map', '0:v', '-map', '1:a', '-map', '2:s',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-g', '60', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '128k', '-c:s', 'mov_text',
+        *bitexact, media["video"]
+    ], check=True)
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y', '-nostdin', '-f', 'lavfi', '-i', tone,
+        '-c:a', 'libmp3lame', '-b:a', '192k', *bitexact, media["audio"]
+    ], check=True)
+    return media
+
+
+def measure(argv, cwd):
+    """Wall seconds, CPU seconds, peak RSS bytes and stderr of one process"""
+    with open(os.path.join(cwd, 'stderr.log'), 'w+') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(argv, cwd=cwd, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL, stderr=log)
+        # wait4 reports the process's own rusage, including children it reaped
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        log.seek(0)
+        error = log.read()[-2000:] if process.returncode != 0 else None
+    return wall, usage.ru_utime + usage.ru_stime, usage.ru_maxrss * 1024, error
+
+
+def output_bytes(out):
+    total = 0
+    for dirpath, _, files in os.walk(out):
+        total += sum(os.path.getsize(os.path.join(dirpath, name)) for name in files
+                     if not name.endswith('_list.txt'))
+    return total
+
+
+def run_operation(workdir, argv_for, runs):
+    """Median of `runs` measurements; `argv_for(out)` builds the command for an output dir"""
+    samples = []
+    for i in range(runs):
+        run_dir = os.path.join(workdir, 'runs', str(i))
+        shutil.rmtree(run_dir, ignore_errors=True)
+        out = os.path.join(run_dir, 'out')
+        os.makedirs(out)
+        wall, cpu, rss, error = measure(argv_for(out), run_dir)
+        if error is not None:
+            return {"error": error}
+        samples.append((wall, cpu, rss, output_bytes(out)))
+        shutil.rmtree(run_dir, ignore_errors=True)
+    walls = [s[0] for s in samples]
+    middle = samples[walls.index(statistics.median_low(walls))]
+    return {
+        "wall_s": round(middle[0], 4),
+        "cpu_s": round(middle[1], 4),
+        "peak_rss_mb": round(max(s[2] for s in samples) / 1024 ** 2, 1),
+        "output_bytes": middle[3],
+    }
+
+
+def ffmpeg_version():
+    try:
+        return subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE,
+                              text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def run_suite(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    bot_ready = importlib.util.find_spec('telegram') is not None
+    results = {}
+    for profile in args.profiles:
+        media = synthesize(args.workdir, profile)
+        results[profile] = {}
+        names = ["ffmpeg." + name for name in FFMPEG_OPERATIONS] + list(PYTHON_OPERATIONS)
+        for name in names:
+            if args.only and name not in args.only:
+                continue
+            if name.startswith('bot.') and not bot_ready:
+                results[profile][name] = {"skipped": "python-telegram-bot is not installed"}
+                continue
+            if name in PYTHON_OPERATIONS:
+                def argv_for(out, build=PYTHON_OPERATIONS[name]):
+                    spec = build(media, lambda file: os.path.join(out, file))
+                    return [sys.executable, '-c', CHILD % ROOT, json.dumps(spec)]
+            else:
+                def argv_for(out, build=FFMPEG_OPERATIONS[name[len('ffmpeg.'):]]):
+                    cmd = build(media, lambda file: os.path.join(out, file))
+                    return [cmd[0], '-v', 'error', '-y', '-nostdin'] + cmd[1:]
+            results[profile][name] = run_operation(args.workdir, argv_for, args.runs)
+            print(f"{profile} {name}: {json.dumps(results[profile][name])}", file=sys.stderr)
+    return {
+        "meta": {
+            "ffmpeg": ffmpeg_version(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "runs": args.runs,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold, min_seconds):
+    """(profile, operation, metric, old, new, change) of every regression"""
+    regressions = []
+    for profile, operations in baseline["results"].items():
+        for name, old in operations.items():
+            new = current["results"].get(profile, {}).get(name)
+            if not new or "error" in old or "skipped" in old:
+                continue
+            if "error" in new:
+                regressions.append((profile, name, "error", None, None, new["error"][-200:]))
+                continue
+            for metric, higher_is_worse in METRICS.items():
+                if metric not in old or metric not in new:
+                    continue
+                if metric.endswith('_s') and max(old[metric], new[metric]) < min_seconds:
+                    continue
+                if not old[metric]:
+                    continue
+                change = (new[metric] - old[metric]) / old[metric]
+                if (change if higher_is_worse else -change) > threshold:
+                    regressions.append((profile, name, metric, old[metric], new[metric],
+                                        f"{change:+.0%}"))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', nargs='+', choices=sorted(PROFILES), default=list(DEFAULT_PROFILES))
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--only', nargs='+', help="operation names, e.g. ffmpeg.trim_video")
+    parser.add_argument('--workdir', default=os.path.join(ROOT, 'temp', 'bench_media'))
+    parser.add_argument('--output', help="write the results to this file as well")
+    parser.add_argument('--compare', metavar='BASELINE', help="flag regressions against a baseline")
+    parser.add_argument('--current', help="with --compare, an existing result instead of a new run")
+    parser.add_argument('--threshold', type=float, default=0.15, help="allowed relative change")
+    parser.add_argument('--min-seconds', type=float, default=0.1,
+                        help="times below this in both runs are not compared")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if args.current:
+            with open(args.current) as f:
+                current = json.load(f)
+        else:
+            args.profiles = list(baseline["results"])
+            current = run_suite(args)
+    else:
+        current = run_suite(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    if not args.compare:
+        print(json.dumps(current, indent=2))
+        return
+
+    regressions = compare(baseline, current, args.threshold, args.min_seconds)
+    for profile, name, metric, old, new, change in regressions:
+        print(f"REGRESSION {profile} {name} {metric}: {old} -> {new} ({change})")
+    print(f"{len(regressions)} regression(s) past {args.threshold:.0%}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Measure how long bot.py and main.py take before they can handle an update.
+
+Usage: python benchmarks/startup.py [--targets bot main] [--runs 5] [--top 15]
+                                    [--budget bot=1500 main=1500]
+
+Each run is a fresh interpreter. "ready" is the time from interpreter start
+until the entry point is built and its handlers are registered, i.e. the
+earliest moment the first update could be dispatched; connecting to
+Telegram is not included. Per-module cost comes from `python -X importtime`
+and is reported as self time summed per top-level package. With budgets,
+the exit status is 1 when a target's median ready time exceeds its budget.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+READY = """
+import time
+start = time.perf_counter()
+import sys
+sys.path.insert(0, %r)
+%s
+print(time.perf_counter() - start)
+"""
+
+# What each entry point does before its first update can be dispatched
+TARGETS = {
+    "bot": """
+import bot
+bot.build_application()
+""",
+    "main": """
+import asyncio, importlib, os
+import main
+
+async def load():
+    app = main.build_client()
+    try:
+        app.load_plugins()
+    except AttributeError:
+        for name in sorted(os.listdir(os.path.join(os.path.dirname(main.__file__), 'handlers'))):
+            if name.endswith('.py'):
+                importlib.import_module('handlers.' + name[:-3])
+    await asyncio.sleep(0)
+
+asyncio.run(load())
+""",
+}
+
+
+def ready_time(target):
+    """(seconds from interpreter start to ready, seconds spent inside the script)"""
+    script = READY % (ROOT, TARGETS[target])
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-c', script], cwd=ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"{target} failed to start:\n{proc.stderr}")
+    return wall, float(proc.stdout.split()[-1])
+
+
+def interpreter_time():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    return time.perf_counter() - start
+
+
+def import_costs(target, top):
+    """Self import time in ms per top-level package, largest first"""
+    script = READY % (ROOT, TARGETS[target])
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], cwd=ROOT,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    costs = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        costs[package] = costs.get(package, 0) + int(self_us)
+    ranked = sorted(costs.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {package: round(us / 1000, 1) for package, us in ranked}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--targets', nargs='+', choices=sorted(TARGETS), default=sorted(TARGETS))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help="packages to list by import cost")
+    parser.add_argument('--budget', nargs='*', default=[], metavar='TARGET=MS',
+                        help="fail when the median ready time of TARGET exceeds MS")
+    args = parser.parse_args()
+    budgets = {target: float(ms) for target, ms in (item.split('=') for item in args.budget)}
+
+    baseline = statistics.median(interpreter_time() for _ in range(args.runs))
+    over = []
+    for target in args.targets:
+        runs = [ready_time(target) for _ in range(args.runs)]
+        ready_ms = statistics.median(wall for wall, _ in runs) * 1000
+        result = {
+            "target": target,
+            "ready_ms": round(ready_ms, 1),
+            "script_ms": round(statistics.median(inner for _, inner in runs) * 1000, 1),
+            "interpreter_ms": round(baseline * 1000, 1),
+            "imports_ms": import_costs(target, args.top),
+        }
+        if target in budgets:
+            result["budget_ms"] = budgets[target]
+            if ready_ms > budgets[target]:
+                over.append(target)
+        print(json.dumps(result))
+    if over:
+        print(f"Over startup budget: {', '.join(over)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
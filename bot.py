@@ -1,23 +1,32 @@
 import os
+import re
 import logging
 import random
 import string
 import asyncio
-import aiohttp
-import requests
-import zipfile
-import py7zr
-import json
-import filetype
+import contextlib
 import subprocess
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.helpers import escape_markdown
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, CallbackQueryHandler,
+    Application, BaseRateLimiter, CommandHandler, MessageHandler, CallbackQueryHandler,
     ContextTypes, filters
 )
-from moviepy.editor import VideoFileClip
-from pydub import AudioSegment
-from pydub.effects import speedup
+from utils.dsp import dsp_engine, Gain
+from utils.faststart import faststart
+from utils.ffmpeg import FFmpegHelper, VIDEO_HEIGHTS
+from utils.gateway import gateway
+from utils.gif import gif_engine
+from utils.helpers import helpers
+from utils.json_stream import json_formatter, JSONStreamError
+from utils.lazy import lazy_import
+from utils.splitter import size_splitter, BOT_API_LIMIT
+from utils.thumbnails import thumbnail_service
+
+# Archive support is only needed once a document is processed
+zipfile = lazy_import('zipfile')
+py7zr = lazy_import('py7zr')
 
 # Bot Configuration
 BOT_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
@@ -26,6 +35,9 @@ BOT_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024  # 2GB
 MAX_DOWNLOAD_SIZE = 50 * 1024 * 1024  # 50MB for direct download
 
+# Sent with send_video, thumbnail and duration/width/height attached
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.m4v', '.webm')
+
 # Temporary directory
 TEMP_DIR = "temp"
 os.makedirs(TEMP_DIR, exist_ok=True)
@@ -38,7 +50,8 @@ DEFAULT_SETTINGS = {
     'video_quality': '720p',
     'compress_audio': False,
     'audio_speed': 100,
-    'volume_level': 100
+    'volume_level': 100,
+    'gif_max_size': None
 }
 
 # Set up logging
@@ -49,6 +62,18 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Helper Functions
+def to_markdown_v2(text):
+    """Text using **bold** and `code` (as utils/helpers.py writes it) as MarkdownV2, the rest escaped"""
+    parts = []
+    for part in re.split(r"(\*\*.+?\*\*|`[^`\n]*`)", text):
+        if len(part) > 4 and part.startswith("**") and part.endswith("**"):
+            parts.append("*" + escape_markdown(part[2:-2], version=2) + "*")
+        elif len(part) > 1 and part.startswith("`") and part.endswith("`"):
+            parts.append("`" + escape_markdown(part[1:-1], version=2, entity_type="code") + "`")
+        else:
+            parts.append(escape_markdown(part, version=2))
+    return "".join(parts)
+
 def generate_random_id(length=8):
     """Generate random ID for temp files"""
     return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
@@ -95,7 +120,7 @@ class VideoProcessor:
         cmd = [
             'ffmpeg', '-i', input_path,
             '-c', 'copy', '-an', '-sn',
-            output_path
+            *FFmpegHelper.output(output_path)
         ]
         subprocess.run(cmd, check=True)
         return output_path
@@ -114,26 +139,16 @@ class VideoProcessor:
         """Mute audio in video"""
         cmd = [
             'ffmpeg', '-i', input_path,
-            '-c', 'copy', '-an', output_path
+            '-c', 'copy', '-an',
+            *FFmpegHelper.output(output_path)
         ]
         subprocess.run(cmd, check=True)
         return output_path
 
-    def video_to_gif(self, input_path, output_path, fps=10):
-        """Convert video to GIF"""
-        try:
-            clip = VideoFileClip(input_path)
-            clip.write_gif(output_path, fps=fps)
-            return output_path
-        except Exception as e:
-            # Fallback to ffmpeg if moviepy fails
-            cmd = [
-                'ffmpeg', '-i', input_path,
-                '-vf', 'fps=10,scale=320:-1:flags=lanczos',
-                output_path
-            ]
-            subprocess.run(cmd, check=True)
-            return output_path
+    def video_to_gif(self, input_path, output_path, fps=10, target_size=None):
+        """Convert video to GIF using a cached two-pass palette"""
+        result = gif_engine.convert(input_path, output_path, fps=fps, target_size=target_size)
+        return result["path"]
 
     def convert_video_format(self, input_path, output_path, format_type):
         """Convert video to different format"""
@@ -146,10 +161,16 @@ class VideoProcessor:
         elif format_type == 'avi':
             cmd.extend(['-c:v', 'libx264', '-c:a', 'mp3'])
         
-        cmd.append(output_path)
+        cmd.extend(FFmpegHelper.output(output_path))
         subprocess.run(cmd, check=True)
         return output_path
 
+    def transcode_outputs(self, input_path, outputs):
+        """Write several renditions from a single decode, smallest first"""
+        cmd = FFmpegHelper.multi_output_transcode(input_path, outputs)
+        subprocess.run(cmd, check=True)
+        return sorted((output["path"] for output in outputs), key=os.path.getsize)
+
     def get_video_duration(self, input_path):
         """Get video duration"""
         return get_file_duration(input_path)
@@ -174,7 +195,7 @@ class VideoProcessor:
             '-b:v', f'{target_bitrate}k',
             '-c:a', 'aac',
             '-b:a', '128k',
-            output_path
+            *FFmpegHelper.output(output_path)
         ]
         subprocess.run(cmd, check=True)
         return output_path
@@ -207,56 +228,38 @@ class AudioProcessor:
         self.temp_dir = TEMP_DIR
 
     def get_audio_duration(self, input_path):
-        """Get audio duration"""
-        try:
-            audio = AudioSegment.from_file(input_path)
-            return len(audio) / 1000.0  # Convert to seconds
-        except:
-            return 0
+        """Get audio duration from container header metadata"""
+        return get_file_duration(input_path)
 
     def convert_audio_format(self, input_path, output_path, format_type, quality='128k'):
         """Convert audio to different format"""
-        audio = AudioSegment.from_file(input_path)
-        
-        if format_type == 'mp3':
-            audio.export(output_path, format='mp3', bitrate=quality)
-        elif format_type == 'wav':
-            audio.export(output_path, format='wav')
-        elif format_type == 'flac':
-            audio.export(output_path, format='flac')
-        elif format_type == 'aac':
-            audio.export(output_path, format='ipod', bitrate=quality)
-        elif format_type == 'm4a':
-            audio.export(output_path, format='ipod', bitrate=quality)
-        elif format_type == 'ogg':
-            audio.export(output_path, format='ogg', bitrate=quality)
-            
+        # ffmpeg decodes and encodes in a stream, so memory stays flat
+        # however long the input is
+        cmd = FFmpegHelper.convert_audio(input_path, output_path, format_type, bitrate=quality)
+        subprocess.run(cmd, check=True)
         return output_path
 
     def apply_slowed_reverb(self, input_path, output_path):
         """Apply slowed and reverb effect"""
-        # Slow down
-        audio = AudioSegment.from_file(input_path)
-        slowed = speedup(audio, playback_speed=0.8)
-        
-        # Add reverb
         cmd = [
             'ffmpeg', '-i', input_path,
-            '-af', 'aecho=0.8:0.9:1000:0.3',
+            '-af', 'atempo=0.8,aecho=0.8:0.9:1000:0.3',
             output_path
         ]
         subprocess.run(cmd, check=True)
         return output_path
 
-    def apply_8d_audio(self, input_path, output_path):
-        """Apply 8D audio effect"""
-        cmd = [
-            'ffmpeg', '-i', input_path,
-            '-af', 'apulsator=hz=0.08',
-            output_path
-        ]
-        subprocess.run(cmd, check=True)
-        return output_path
+    def apply_8d_audio(self, input_path, output_path, rate_hz=0.125, depth=1.0):
+        """Apply 8D audio effect (auto-panner rotating at rate_hz)"""
+        return dsp_engine.process_file(
+            input_path, output_path, [dsp_engine.auto_panner(rate_hz, depth)]
+        )
+
+    def apply_equalizer(self, input_path, output_path, preset='flat', gain_db=0.0):
+        """Apply equalizer preset followed by a gain stage"""
+        return dsp_engine.process_file(
+            input_path, output_path, [dsp_engine.equalizer(preset), Gain(gain_db)]
+        )
 
     def change_audio_speed(self, input_path, output_path, speed_percentage):
         """Change audio speed"""
@@ -330,21 +333,44 @@ class FileProcessor:
         
         return [os.path.join(output_dir, f) for f in extracted_files]
 
-    def format_json(self, input_path, output_path, indent=4):
-        """Format JSON file with specified indentation"""
-        with open(input_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=indent, ensure_ascii=False)
-        
-        return output_path
+    def format_json(self, input_path, output_path, indent=4, minify=False):
+        """Format JSON file with specified indentation (streamed, constant memory)"""
+        return json_formatter.format_file(input_path, output_path, indent=indent, minify=minify)
+
+    def validate_json(self, input_path):
+        """Validate JSON file, returning the error (with offset) or None"""
+        return json_formatter.validate_file(input_path)
 
 # Large File Handler Class
 class LargeFileHandler:
     def __init__(self):
         self.temp_dir = TEMP_DIR
 
+    async def send_file(self, file_path, chat_id, context, caption="", filename=None):
+        """Send a file as a document, or a video as a streamable video with its thumbnail"""
+        filename = filename or os.path.basename(file_path)
+        if not file_path.lower().endswith(VIDEO_EXTENSIONS):
+            with open(file_path, 'rb') as f:
+                await context.bot.send_document(
+                    chat_id=chat_id,
+                    document=f,
+                    caption=caption,
+                    filename=filename
+                )
+            return
+        thumb, info = await thumbnail_service.for_upload(file_path)
+        with open(file_path, 'rb') as f, \
+                (open(thumb, 'rb') if thumb else contextlib.nullcontext()) as thumb_file:
+            await context.bot.send_video(
+                chat_id=chat_id,
+                video=f,
+                caption=caption,
+                filename=filename,
+                thumbnail=thumb_file,
+                supports_streaming=True,
+                **info
+            )
+
     async def upload_large_file(self, file_path, chat_id, context, caption=""):
         """Upload large files using chunked method"""
         try:
@@ -352,13 +378,7 @@ class LargeFileHandler:
             
             if file_size <= 50 * 1024 * 1024:  # 50MB Telegram limit
                 # Use normal upload for small files
-                with open(file_path, 'rb') as f:
-                    await context.bot.send_document(
-                        chat_id=chat_id,
-                        document=f,
-                        caption=caption,
-                        filename=os.path.basename(file_path)
-                    )
+                await self.send_file(file_path, chat_id, context, caption)
                 return True
             
             # For files larger than 50MB, we need to split or compress
@@ -373,7 +393,7 @@ class LargeFileHandler:
         file_size = os.path.getsize(file_path)
         
         # Check if it's a video and we can compress it
-        if file_path.lower().endswith(('.mp4', '.avi', '.mkv', '.mov', '.m4v', '.webm')):
+        if file_path.lower().endswith(VIDEO_EXTENSIONS):
             processor = VideoProcessor()
             
             # Try to compress the video
@@ -390,13 +410,11 @@ class LargeFileHandler:
                 compressed_file = processor.compress_video(file_path, compressed_path, target_size)
                 
                 if os.path.exists(compressed_file) and os.path.getsize(compressed_file) <= 50 * 1024 * 1024:
-                    with open(compressed_file, 'rb') as f:
-                        await context.bot.send_document(
-                            chat_id=chat_id,
-                            document=f,
-                            caption=f"📹 Compressed Version\n{caption}",
-                            filename=f"compressed_{os.path.basename(file_path)}"
-                        )
+                    await self.send_file(
+                        compressed_file, chat_id, context,
+                        f"📹 Compressed Version\n{caption}",
+                        filename=f"compressed_{os.path.basename(file_path)}"
+                    )
                     await message.delete()
                     # Clean up compressed file
                     if os.path.exists(compressed_file):
@@ -412,6 +430,8 @@ class LargeFileHandler:
 
     async def split_and_send_file(self, file_path, chat_id, context, caption):
         """Split large file into chunks and send"""
+        if file_path.lower().endswith(VIDEO_EXTENSIONS):
+            return await self.split_and_send_video(file_path, chat_id, context, caption)
         try:
             file_size = os.path.getsize(file_path)
             chunk_size = 45 * 1024 * 1024  # 45MB chunks
@@ -443,7 +463,6 @@ class LargeFileHandler:
                     # Clean up chunk file
                     if os.path.exists(chunk_path):
                         os.remove(chunk_path)
-                    await asyncio.sleep(1)  # Rate limiting
             
             await message.delete()
             return True
@@ -452,6 +471,45 @@ class LargeFileHandler:
             logger.error(f"File splitting failed: {e}")
             return False
 
+    async def split_and_send_video(self, file_path, chat_id, context, caption):
+        """Split a video at keyframes into playable parts, uploading each as it is cut"""
+        message = await context.bot.send_message(
+            chat_id=chat_id,
+            text="📦 Splitting video into playable parts..."
+        )
+        try:
+            async for part_path, part, total in size_splitter.split(file_path, self.temp_dir, BOT_API_LIMIT):
+                try:
+                    await self.send_file(part_path, chat_id, context, f"Part {part}/{total}\n{caption}")
+                finally:
+                    clean_temp_files([part_path])
+            await message.delete()
+            return True
+        except Exception as e:
+            logger.error(f"Video splitting failed: {e}")
+            return False
+
+class GatewayRateLimiter(BaseRateLimiter):
+    """Send the bot's outbound requests through utils.gateway's limits and FloodWait retries."""
+
+    # Bot API methods that send to or change a chat
+    OUTBOUND = ("send", "edit", "forward", "copy", "delete", "answerCallbackQuery")
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(self.OUTBOUND):
+            return await callback(*args, **kwargs)
+        chat_id = data.get("chat_id")
+        key = (chat_id, data.get("message_id")) if endpoint.startswith("edit") else None
+        result = await gateway.call(lambda: callback(*args, **kwargs), chat_id, endpoint, key)
+        # None is a progress edit the gateway dropped
+        return True if result is None else result
+
 # Initialize processors
 video_processor = VideoProcessor()
 audio_processor = AudioProcessor()
@@ -891,7 +949,11 @@ async def handle_video_callback(update: Update, context: ContextTypes.DEFAULT_TY
         elif data == "video_to_gif":
             await query.edit_message_text("🔄 Converting video to GIF...")
             output_path = f"temp/{generate_random_id()}.gif"
-            result_path = video_processor.video_to_gif(current_file, output_path)
+            user_id = query.from_user.id
+            max_size = user_settings.get(user_id, DEFAULT_SETTINGS).get('gif_max_size')
+            result_path = await asyncio.to_thread(
+                video_processor.video_to_gif, current_file, output_path, target_size=max_size
+            )
             await send_result_file(context, query, result_path, "Video converted to GIF")
         
         elif data == "video_convert":
@@ -899,10 +961,26 @@ async def handle_video_callback(update: Update, context: ContextTypes.DEFAULT_TY
             keyboard = [
                 [InlineKeyboardButton("MP4", callback_data="video_convert_mp4")],
                 [InlineKeyboardButton("MKV", callback_data="video_convert_mkv")],
+                [InlineKeyboardButton("MP4 + MKV", callback_data="video_convert_all")],
+                [InlineKeyboardButton("📶 1080p + 720p + 480p", callback_data="video_convert_ladder")],
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             await query.edit_message_text("🎥 Choose output format:", reply_markup=reply_markup)
         
+        elif data in ("video_convert_all", "video_convert_ladder"):
+            # One decode feeds every rendition
+            base = f"temp/{generate_random_id()}"
+            if data == "video_convert_all":
+                outputs = [{"path": f"{base}.{fmt}", "format": fmt} for fmt in ('mp4', 'mkv')]
+            else:
+                outputs = [{"path": f"{base}_{quality}.mp4", "format": "mp4", "height": VIDEO_HEIGHTS[quality]}
+                           for quality in ('1080p', '720p', '480p')]
+            await query.edit_message_text(f"🔄 Transcoding {len(outputs)} versions in one pass...")
+            result_paths = await asyncio.to_thread(video_processor.transcode_outputs, current_file, outputs)
+            for result_path in result_paths:
+                await send_result_file(context, query, result_path, f"Converted: {os.path.basename(result_path)}")
+                clean_temp_files([result_path])
+        
         elif data.startswith("video_convert_"):
             format_type = data.split('_')[-1]
             await query.edit_message_text(f"🔄 Converting video to {format_type.upper()}...")
@@ -927,19 +1005,10 @@ async def handle_video_callback(update: Update, context: ContextTypes.DEFAULT_TY
             await query.edit_message_text("✅ Screenshots generated and sent!")
         
         elif data == "video_info":
-            # Get basic file info
-            file_size = os.path.getsize(current_file)
-            duration = video_processor.get_video_duration(current_file)
-            
-            info_text = f"""
-📊 **Media Information**
-
-📁 File: `{os.path.basename(current_file)}`
-💾 Size: {format_file_size(file_size)}
-⏱️ Duration: {duration:.2f} seconds
-🎬 Type: Video
-            """
-            await query.edit_message_text(info_text, parse_mode='Markdown')
+            info = await asyncio.to_thread(FFmpegHelper.get_media_info, current_file)
+            info_text = helpers.format_media_info(info, os.path.basename(current_file))
+            # ffprobe names (pcm_s16le, mov_text...) would break legacy Markdown
+            await query.edit_message_text(to_markdown_v2(info_text), parse_mode=ParseMode.MARKDOWN_V2)
         
         else:
             await query.edit_message_text("🔄 This feature is coming soon!")
@@ -997,19 +1066,10 @@ async def handle_audio_callback(update: Update, context: ContextTypes.DEFAULT_TY
             await send_result_file(context, query, result_path, "8D audio effect applied")
         
         elif data == "audio_info":
-            # Get basic file info
-            file_size = os.path.getsize(current_file)
-            duration = audio_processor.get_audio_duration(current_file)
-            
-            info_text = f"""
-📊 **Media Information**
-
-📁 File: `{os.path.basename(current_file)}`
-💾 Size: {format_file_size(file_size)}
-⏱️ Duration: {duration:.2f} seconds
-🎵 Type: Audio
-            """
-            await query.edit_message_text(info_text, parse_mode='Markdown')
+            info = await asyncio.to_thread(FFmpegHelper.get_media_info, current_file)
+            info_text = helpers.format_media_info(info, os.path.basename(current_file))
+            # ffprobe names (pcm_s16le, mov_text...) would break legacy Markdown
+            await query.edit_message_text(to_markdown_v2(info_text), parse_mode=ParseMode.MARKDOWN_V2)
         
         else:
             await query.edit_message_text("🔄 This feature is coming soon!")
@@ -1047,14 +1107,15 @@ async def handle_document_callback(update: Update, context: ContextTypes.DEFAULT
             os.makedirs(extract_dir, exist_ok=True)
             extracted_files = file_processor.extract_archive(current_file, extract_dir)
             
-            for file_path in extracted_files:
-                if os.path.isfile(file_path):
-                    with open(file_path, 'rb') as doc:
-                        await context.bot.send_document(
-                            chat_id=query.message.chat_id, 
-                            document=doc,
-                            filename=os.path.basename(file_path)
-                        )
+            with gateway.priority("result"):
+                for file_path in extracted_files:
+                    if os.path.isfile(file_path):
+                        with open(file_path, 'rb') as doc:
+                            await context.bot.send_document(
+                                chat_id=query.message.chat_id, 
+                                document=doc,
+                                filename=os.path.basename(file_path)
+                            )
             
             # Clean up extracted files
             for file_path in extracted_files:
@@ -1065,7 +1126,15 @@ async def handle_document_callback(update: Update, context: ContextTypes.DEFAULT
         elif data == "doc_format_json":
             await query.edit_message_text("🔄 Formatting JSON...")
             output_path = f"temp/{generate_random_id()}.json"
-            result_path = file_processor.format_json(current_file, output_path, indent=4)
+            try:
+                # Run off the event loop; large documents take a while
+                result_path = await asyncio.to_thread(
+                    file_processor.format_json, current_file, output_path, 4
+                )
+            except JSONStreamError as e:
+                clean_temp_files([output_path])
+                await query.edit_message_text(f"❌ Invalid JSON: {e}")
+                return
             await send_result_file(context, query, result_path, "JSON formatted")
         
         else:
@@ -1085,38 +1154,37 @@ async def handle_url_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def send_result_file(context, query, file_path, caption):
     """Helper function to send processed files."""
-    try:
-        chat_id = query.message.chat_id
+    # Uploads go ahead of other queued requests (see utils/gateway.py)
+    with gateway.priority("result"):
+        try:
+            chat_id = query.message.chat_id
         
-        # Check file size
-        file_size = os.path.getsize(file_path)
+            # Put the moov atom first so Telegram clients can play while downloading
+            await asyncio.to_thread(faststart.finalize, file_path)
         
-        if file_size > 50 * 1024 * 1024:  # 50MB limit
-            # Use large file handler for files > 50MB
-            success = await large_file_handler.upload_large_file(
-                file_path, chat_id, context, f"✅ {caption}"
-            )
-        else:
-            # Use normal upload for small files
-            with open(file_path, 'rb') as file:
-                await context.bot.send_document(
-                    chat_id=chat_id,
-                    document=file,
-                    caption=f"✅ {caption}",
-                    filename=os.path.basename(file_path)
+            # Check file size
+            file_size = os.path.getsize(file_path)
+        
+            if file_size > 50 * 1024 * 1024:  # 50MB limit
+                # Use large file handler for files > 50MB
+                success = await large_file_handler.upload_large_file(
+                    file_path, chat_id, context, f"✅ {caption}"
                 )
-            success = True
+            else:
+                # Use normal upload for small files
+                await large_file_handler.send_file(file_path, chat_id, context, f"✅ {caption}")
+                success = True
         
-        if success:
-            await query.edit_message_text(f"✅ {caption} and sent!")
-        else:
-            await query.edit_message_text(f"✅ {caption} but upload failed.")
+            if success:
+                await query.edit_message_text(f"✅ {caption} and sent!")
+            else:
+                await query.edit_message_text(f"✅ {caption} but upload failed.")
             
-    except Exception as e:
-        logger.error(f"Error sending file: {e}")
-        await query.edit_message_text(f"❌ Error sending file: {str(e)}")
-    finally:
-        clean_temp_files([file_path])
+        except Exception as e:
+            logger.error(f"Error sending file: {e}")
+            await query.edit_message_text(f"❌ Error sending file: {str(e)}")
+        finally:
+            clean_temp_files([file_path])
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Log errors and send a message to the user."""
@@ -1131,10 +1199,16 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             pass
 
-def main():
-    """Start the bot."""
-    # Create the Application
-    application = Application.builder().token(BOT_TOKEN).build()
+def build_application(base_url: str = None, base_file_url: str = None):
+    """Create the Application with every handler registered.
+
+    base_url and base_file_url point the bot at another Bot API server
+    (benchmarks/load.py uses a local stand-in).
+    """
+    builder = Application.builder().token(BOT_TOKEN).rate_limiter(GatewayRateLimiter())
+    if base_url:
+        builder = builder.base_url(base_url).base_file_url(base_file_url)
+    application = builder.build()
     
     # Add handlers
     application.add_handler(CommandHandler("start", start))
@@ -1144,6 +1218,11 @@ def main():
     
     # Error handler
     application.add_error_handler(error_handler)
+    return application
+
+def main():
+    """Start the bot."""
+    application = build_application()
     
     # Start the Bot
     print("🤖 Bot is running with improved file handling...")
@@ -31,6 +31,40 @@ class Config:
     # Queue Configuration
     MAX_CONCURRENT_JOBS = 3
     
+    # With JOB_QUEUE set, main.py only enqueues jobs and worker.py processes them
+    JOB_QUEUE = os.getenv("JOB_QUEUE", "").lower() in ("1", "true", "yes")
+    JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+    MAX_JOB_ATTEMPTS = int(os.getenv("MAX_JOB_ATTEMPTS", "3"))
+    WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", str(MAX_CONCURRENT_JOBS)))
+    
+    # Wall-clock limit for a single ffmpeg process, in seconds (0 disables it)
+    FFMPEG_TIMEOUT = int(os.getenv("FFMPEG_TIMEOUT", str(2 * 3600)))
+    
+    # Admission control: free space kept in TEMP_DIR, 1-minute load average
+    # per core above which new jobs wait, and the longest wait offered
+    ADMISSION_DISK_RESERVE_MB = int(os.getenv("ADMISSION_DISK_RESERVE_MB", "1024"))
+    ADMISSION_MAX_LOAD = float(os.getenv("ADMISSION_MAX_LOAD", "1.5"))
+    ADMISSION_MAX_WAIT = int(os.getenv("ADMISSION_MAX_WAIT", "3600"))
+    
+    # Fair share between users: a premium user's share of the job slots
+    # relative to a free user's, and how many jobs one user may have running
+    PREMIUM_WEIGHT = float(os.getenv("PREMIUM_WEIGHT", "3"))
+    USER_MAX_JOBS = int(os.getenv("USER_MAX_JOBS", "2"))
+    PREMIUM_MAX_JOBS = int(os.getenv("PREMIUM_MAX_JOBS", "4"))
+    
+    # Outbound Telegram requests: per second for the bot token and per
+    # private chat, per minute per group, and the longest FloodWait that is
+    # waited out and retried rather than reported as a failure. Each process
+    # enforces them on its own; with JOB_QUEUE, main.py and the workers
+    # split them by the number of live workers (see utils/gateway.py)
+    TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+    TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+    TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", "20"))
+    TELEGRAM_MAX_FLOOD_WAIT = int(os.getenv("TELEGRAM_MAX_FLOOD_WAIT", "300"))
+    
+    # Port of the /health and /metrics server (0 disables it)
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "8080"))
+    
     @classmethod
     def validate(cls):
         required_vars = ["BOT_TOKEN", "API_ID", "API_HASH", "MONGODB_URI"]
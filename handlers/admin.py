@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+from pyrogram import Client, filters
+from pyrogram.types import Message
+from config import Config
+from utils.database import db
+from utils.tracing import tracer, PERCENTILES
+
+# Phases in the order a job goes through them
+PHASE_ORDER = ("wait", "download", "probe", "process", "upload", "total")
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    if seconds < 120:
+        return f"{seconds:.1f}s"
+    return f"{seconds / 60:.1f}m"
+
+def format_summary(summary: dict, hours: float) -> str:
+    lines = [f"📈 **Job timings, last {hours:g}h** (" + "/".join(f"p{p}" for p in PERCENTILES) + ")"]
+    for operation, phases in sorted(summary.items()):
+        lines.append(f"\n**{operation}** — {phases['total']['count']} jobs")
+        for phase in sorted(phases, key=lambda p: PHASE_ORDER.index(p) if p in PHASE_ORDER else 99):
+            stats = phases[phase]
+            values = " / ".join(format_seconds(stats[f"p{p}"]) for p in PERCENTILES)
+            lines.append(f"`{phase:<9}` {values}")
+    return "\n".join(lines)
+
+@Client.on_message(filters.command("perf") & filters.user(Config.ADMINS))
+async def perf_command(client, message: Message):
+    """/perf [hours]: p50/p95/p99 per operation and phase of completed jobs"""
+    try:
+        hours = float(message.command[1]) if len(message.command) > 1 else 24.0
+    except ValueError:
+        await message.reply_text("Usage: /perf [hours]")
+        return
+    traces = await db.job_traces(datetime.now() - timedelta(hours=hours))
+    if not traces:
+        await message.reply_text(f"No traced jobs in the last {hours:g}h.")
+        return
+    text = format_summary(tracer.summary(traces), hours)
+    # Telegram's message limit
+    await message.reply_text(text[:4096])
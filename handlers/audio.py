@@ -0,0 +1,209 @@
+import os
+import time
+import asyncio
+from pyrogram import Client, filters
+from pyrogram.types import Message, CallbackQuery
+from utils.admission import admission, AdmissionRejected
+from utils.database import db
+from utils.dsp import dsp_engine, EQ_PRESETS
+from utils.ffmpeg import ffmpeg_helper
+from utils.gateway import gateway
+from utils.governor import governor
+from utils.segmented import (segmented_processor, slow_reverb_effect,
+                             bass_boost_effect, treble_boost_effect)
+from utils.buttons import buttons
+from utils.helpers import helpers
+from utils.jobs import job_queue
+from utils.metrics import metrics
+from utils.media import LazyMedia
+from utils.passthrough import passthrough
+from utils.silence import silence_analyzer, STREAM_COPY_EXTENSIONS
+
+# Store user sessions
+user_sessions = {}
+
+# Operations that read the whole file; menus and pass-through ones never download it
+DOWNLOAD_OPERATIONS = (
+    "audio_8d", "audio_auto_trim", "audio_slow_reverb", "audio_bass", "audio_treble"
+) + tuple(f"audio_eq_{preset}" for preset in EQ_PRESETS)
+
+# ffmpeg priority per job (see utils/governor.py); anything unlisted is "normal"
+JOB_PRIORITIES = {
+    "audio_slow_reverb": "batch",
+    "audio_bass": "batch",
+    "audio_treble": "batch",
+}
+
+async def auto_trim(input_path: str, output_dir: str):
+    """Cut leading, trailing and long internal silences; None if nothing to cut"""
+    analysis = await asyncio.to_thread(silence_analyzer.analyze, input_path)
+    segments = silence_analyzer.keep_segments(analysis)
+    if not segments or segments == [(0.0, analysis["duration"])]:
+        return None
+
+    info = ffmpeg_helper.get_media_info(input_path)
+    codec = next((stream.get("codec_name") for stream in info.get("streams", [])
+                  if stream.get("codec_type") == "audio"), None)
+    extension = STREAM_COPY_EXTENSIONS.get(codec)
+    output_path = os.path.join(output_dir, f"trimmed.{extension or 'mp3'}")
+    cmd = ffmpeg_helper.cut_segments(input_path, output_path, segments, copy=extension is not None)
+    success = await ffmpeg_helper.run_command(cmd)
+    os.remove(f"{output_path}_list.txt")
+    return output_path if success else None
+
+@Client.on_message(filters.audio)
+async def handle_audio(client, message: Message):
+    user_id = message.from_user.id
+
+    # Only what Telegram already told us; bytes are fetched once an operation needs them
+    user_sessions[user_id] = {"media": LazyMedia.from_message(message), "type": "audio",
+                              "source": passthrough.source(message)}
+
+    # Send options menu
+    await message.reply_text(
+        "🎵 **Audio Processing Options**\nChoose what you want to do:",
+        reply_markup=buttons.get_audio_buttons()
+    )
+
+async def run_audio_job(client, status: Message, user_id: int, media: LazyMedia, data: str,
+                        temp_dir: str = None):
+    """Fetch, process and upload one DOWNLOAD_OPERATIONS operation, reporting on `status`"""
+    temp_dir = temp_dir or f"temp/{user_id}"
+    os.makedirs(temp_dir, exist_ok=True)
+
+    trimmed_input = None
+    with governor.job(JOB_PRIORITIES.get(data, "normal")), metrics.job(data):
+        try:
+            await status.edit_text("⬇️ Downloading audio...")
+            input_path = await media.download(client, temp_dir)
+            await db.update_user_stats(user_id, "audios_processed")
+            settings = await db.get_user_settings(user_id)
+            if settings.get("auto_trim_audio") and data != "audio_auto_trim":
+                trimmed_input = await auto_trim(input_path, temp_dir)
+                input_path = trimmed_input or input_path
+
+            output_path = os.path.join(temp_dir, "processed.mp3")
+            processing = time.perf_counter()
+
+            if data.startswith("audio_eq_") and data[len("audio_eq_"):] in EQ_PRESETS:
+                preset = data[len("audio_eq_"):]
+                # NumPy DSP runs in a worker thread, streaming blocks between ffmpeg pipes
+                await asyncio.to_thread(
+                    dsp_engine.process_file, input_path, output_path,
+                    [dsp_engine.equalizer(preset)]
+                )
+                success = True
+
+            elif data == "audio_8d":
+                await asyncio.to_thread(
+                    dsp_engine.process_file, input_path, output_path,
+                    [dsp_engine.auto_panner()]
+                )
+                success = True
+
+            elif data == "audio_auto_trim":
+                trimmed_path = await auto_trim(input_path, temp_dir)
+                if not trimmed_path:
+                    await status.edit_text("ℹ️ No silence found to trim.")
+                    return
+                output_path = trimmed_path
+                success = True
+
+            elif data == "audio_slow_reverb":
+                success = await segmented_processor.process(
+                    input_path, output_path, slow_reverb_effect()
+                )
+
+            elif data == "audio_bass":
+                success = await segmented_processor.process(
+                    input_path, output_path, bass_boost_effect(10)
+                )
+
+            elif data == "audio_treble":
+                success = await segmented_processor.process(
+                    input_path, output_path, treble_boost_effect(10)
+                )
+
+            else:
+                raise ValueError(f"Not an audio job: {data}")
+
+            metrics.observe_phase("process", time.perf_counter() - processing)
+
+            if success and os.path.exists(output_path):
+                metrics.transfer("out", os.path.getsize(output_path))
+                with metrics.phase("upload"), gateway.priority("result"):
+                    await client.send_audio(
+                        status.chat.id,
+                        output_path,
+                        caption="✅ Processing complete!"
+                    )
+                os.remove(output_path)
+            else:
+                await status.edit_text("❌ Processing failed!")
+        finally:
+            # Cleanup fetched bytes after processing; a later operation fetches them again
+            media.discard()
+            if trimmed_input and os.path.exists(trimmed_input):
+                os.remove(trimmed_input)
+
+@Client.on_callback_query(filters.regex("^audio_"))
+async def handle_audio_callback(client, callback_query: CallbackQuery):
+    user_id = callback_query.from_user.id
+    data = callback_query.data
+
+    # Get user session
+    session = user_sessions.get(user_id)
+    if not session or "media" not in session:
+        await callback_query.answer("❌ No audio found. Please send an audio file first.", show_alert=True)
+        return
+
+    if passthrough.is_passthrough(data):
+        # Works on the Telegram message itself; nothing is downloaded or uploaded
+        await passthrough.start(client, user_id, callback_query.message.chat.id,
+                                session["source"], data)
+        await callback_query.message.edit_text("📝 Send the new caption for this audio.")
+        return
+
+    media = session["media"]
+    temp_dir = f"temp/{user_id}"
+    os.makedirs(temp_dir, exist_ok=True)
+
+    if data == "audio_equalizer":
+        await callback_query.message.edit_text(
+            "🎛️ Select equalizer preset:",
+            reply_markup=buttons.get_equalizer_buttons()
+        )
+        return
+
+    if data == "audio_info":
+        # ffprobe reads only the container headers; the media data is never fetched
+        try:
+            headers_path = await media.headers(client, temp_dir)
+            info = await asyncio.to_thread(ffmpeg_helper.get_media_info, headers_path)
+            await callback_query.message.edit_text(helpers.format_media_info(info, media.file_name))
+        except Exception as e:
+            await callback_query.message.edit_text(f"❌ Error: {str(e)}")
+        media.discard()
+        return
+
+    if data not in DOWNLOAD_OPERATIONS:
+        await callback_query.answer("🚧 Feature coming soon!", show_alert=True)
+        return
+
+    await callback_query.answer("🔄 Starting processing...")
+
+    try:
+        if job_queue.enabled:
+            # Reject up front what can't run, rather than failing after the download
+            decision = await admission.check(data, media.file_size)
+            if decision.action != "reject":
+                await job_queue.submit(user_id, data, media, callback_query.message, decision.cost.seconds)
+            await callback_query.message.edit_text(decision.message)
+        else:
+            async with admission.reserve(data, media.file_size, user_id, callback_query.message) as admitted:
+                await job_queue.run_inline(run_audio_job, client, callback_query.message, user_id, media, data,
+                                           admitted.waited)
+    except AdmissionRejected as e:
+        await callback_query.message.edit_text(e.decision.message)
+    except Exception as e:
+        await callback_query.message.edit_text(f"❌ Error: {str(e)}")
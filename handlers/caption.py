@@ -0,0 +1,14 @@
+from pyrogram import Client, filters
+from pyrogram.types import Message
+from utils.passthrough import passthrough
+
+@Client.on_message(filters.text & filters.private & ~filters.regex(r"^/"))
+async def handle_caption(client, message: Message):
+    user_id = message.from_user.id
+    if user_id not in passthrough.pending:
+        message.continue_propagation()
+    
+    try:
+        await passthrough.finish_caption(client, user_id, message)
+    except Exception as e:
+        await message.reply_text(f"❌ Error: {str(e)}")
@@ -0,0 +1,45 @@
+from pyrogram import Client, filters
+from pyrogram.types import Message, CallbackQuery
+from utils.database import db
+from utils.buttons import buttons
+from utils.passthrough import passthrough
+
+# Store user sessions
+user_sessions = {}
+
+@Client.on_message(filters.document & ~filters.mime_type("video/mp4"))
+async def handle_document(client, message: Message):
+    user_id = message.from_user.id
+    await db.update_user_stats(user_id, "documents_processed")
+    
+    # Nothing is downloaded until an operation needs the bytes
+    user_sessions[user_id] = {"type": "document", "source": passthrough.source(message)}
+    
+    await message.reply_text(
+        "📄 **Document Processing Options**\nChoose what you want to do:",
+        reply_markup=buttons.get_document_buttons()
+    )
+
+@Client.on_callback_query(filters.regex("^doc_"))
+async def handle_document_callback(client, callback_query: CallbackQuery):
+    user_id = callback_query.from_user.id
+    data = callback_query.data
+    
+    session = user_sessions.get(user_id)
+    if not session:
+        await callback_query.answer("❌ No document found. Please send a document first.", show_alert=True)
+        return
+    
+    if not passthrough.is_passthrough(data):
+        await callback_query.answer("🚧 Feature coming soon!", show_alert=True)
+        return
+    
+    try:
+        sent = await passthrough.start(client, user_id, callback_query.message.chat.id,
+                                       session["source"], data)
+        if sent is None:
+            await callback_query.message.edit_text("📝 Send the new caption for this document.")
+        else:
+            await callback_query.message.edit_text("✅ Forward tag removed!")
+    except Exception as e:
+        await callback_query.message.edit_text(f"❌ Error: {str(e)}")
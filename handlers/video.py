@@ -1,29 +1,219 @@
 import os
+import shutil
+import time
 import asyncio
 from pyrogram import Client, filters
 from pyrogram.types import Message, CallbackQuery
+from utils.admission import admission, AdmissionRejected
 from utils.database import db
 from utils.ffmpeg import ffmpeg_helper
-from utils.helpers import helpers
+from utils.gateway import gateway
+from utils.gif import gif_engine
+from utils.keyframes import smart_cutter
+from utils.media import LazyMedia
+from utils.merge import MergeSession
+from utils.passthrough import passthrough
+from utils.faststart import faststart
+from utils.governor import governor
+from utils.splitter import size_splitter, CLIENT_LIMIT
+from utils.thumbnails import thumbnail_service
 from utils.buttons import buttons
+from utils.helpers import helpers
+from utils.jobs import job_queue
+from utils.metrics import metrics
 from utils.progress import ProgressTracker
 
 # Store user sessions
 user_sessions = {}
 
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.webm', '.m4v')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Operations that read the whole video; nothing else downloads it
+DOWNLOAD_OPERATIONS = (
+    "video_remove_audio", "video_extract_audio", "video_trim", "video_merge",
+    "video_mute", "video_split", "video_sample", "video_to_gif", "video_optimize"
+)
+
+# Self-contained operations that can run on any worker (see worker.py)
+JOB_OPERATIONS = tuple(op for op in DOWNLOAD_OPERATIONS if op != "video_merge") + ("video_screenshot",)
+
+# ffmpeg priority per job (see utils/governor.py); anything unlisted is "normal"
+JOB_PRIORITIES = {
+    "video_screenshot": "interactive",
+    "video_to_gif": "batch",
+    "video_optimize": "batch",
+}
+
+async def send_output(client, chat_id: int, path: str, caption: str, settings: dict):
+    """Upload a result, attaching thumbnail and duration/width/height to videos"""
+    metrics.transfer("out", os.path.getsize(path))
+    with metrics.phase("upload"), gateway.priority("result"):
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            await client.send_photo(chat_id, path, caption=caption)
+            return
+        if not path.lower().endswith(VIDEO_EXTENSIONS):
+            await client.send_document(chat_id, path, caption=caption)
+            return
+        # Playback can start before the download finishes only with moov first
+        await asyncio.to_thread(faststart.finalize, path)
+        thumb, info = await thumbnail_service.for_upload(
+            path, client, settings.get("thumbnail")
+        )
+        if settings.get("upload_mode", "video") == "video":
+            await client.send_video(
+                chat_id,
+                path,
+                caption=caption,
+                thumb=thumb,
+                supports_streaming=True,
+                **info
+            )
+        else:
+            await client.send_document(chat_id, path, caption=caption, thumb=thumb)
+
+async def deliver(client, status: Message, user_id: int, output_path: str):
+    """Upload a finished result through Pyrogram, or Telethon past the 2GB limit"""
+    file_size = os.path.getsize(output_path)
+    settings = await db.get_user_settings(user_id)
+    
+    if file_size > 2 * 1024 * 1024 * 1024:  # Larger than 2GB
+        from utils.telethon_client import telethon_client
+        try:
+            await telethon_client.upload_large_file(
+                status.chat.id,
+                output_path,
+                "✅ Processing complete!",
+                custom_thumbnail=settings.get("thumbnail")
+            )
+        except Exception as e:
+            await status.edit_text(
+                f"❌ File too large for Pyrogram and Telethon not configured.\n"
+                f"Error: {str(e)}"
+            )
+    else:
+        # Use Pyrogram for smaller files
+        await send_output(client, status.chat.id, output_path, "✅ Processing complete!", settings)
+    os.remove(output_path)
+
+async def run_video_job(client, status: Message, user_id: int, media: LazyMedia, data: str,
+                        temp_dir: str = None):
+    """Fetch, process and upload one JOB_OPERATIONS operation, reporting on `status`"""
+    temp_dir = temp_dir or f"temp/{user_id}"
+    os.makedirs(temp_dir, exist_ok=True)
+    
+    with governor.job(JOB_PRIORITIES.get(data, "normal")), metrics.job(data):
+        try:
+            if data in DOWNLOAD_OPERATIONS:
+                await status.edit_text("⬇️ Downloading video...")
+                input_path = await media.download(client, temp_dir)
+            await db.update_user_stats(user_id, "videos_processed")
+            processing = time.perf_counter()
+        
+            if data == "video_remove_audio":
+                output_path = os.path.join(temp_dir, "no_audio.mp4")
+                cmd = ffmpeg_helper.remove_audio(input_path, output_path)
+            
+            elif data == "video_extract_audio":
+                output_path = os.path.join(temp_dir, "extracted_audio")
+                cmd = ffmpeg_helper.extract_audio(input_path, output_path, "mp3")
+            
+            elif data == "video_trim":
+                # For demo - in real implementation, ask for start/end times
+                output_path = os.path.join(temp_dir, "trimmed.mp4")
+                # Copies whole GOPs, re-encodes only the partial ones at the cuts
+                await asyncio.to_thread(smart_cutter.trim, input_path, output_path, 10.0, 30.0)
+                cmd = None
+            
+            elif data == "video_mute":
+                output_path = os.path.join(temp_dir, "muted.mp4")
+                cmd = ffmpeg_helper.mute_audio(input_path, output_path)
+            
+            elif data == "video_split":
+                settings = await db.get_user_settings(user_id)
+                max_bytes = settings.get("split_size") or CLIENT_LIMIT
+                # Each part is uploaded while the next one is being cut
+                async for part_path, part, total in size_splitter.split(input_path, temp_dir, max_bytes, ".mp4"):
+                    await send_output(
+                        client,
+                        status.chat.id,
+                        part_path,
+                        f"✅ Part {part}/{total}",
+                        settings
+                    )
+                    os.remove(part_path)
+                return
+            
+            elif data == "video_sample":
+                output_path = os.path.join(temp_dir, "sample.mp4")
+                await asyncio.to_thread(smart_cutter.sample, input_path, output_path)
+                cmd = None
+            
+            elif data == "video_to_gif":
+                output_path = os.path.join(temp_dir, "converted.gif")
+                settings = await db.get_user_settings(user_id)
+                await asyncio.to_thread(
+                    gif_engine.convert, input_path, output_path,
+                    target_size=settings.get("gif_max_size")
+                )
+                cmd = None
+            
+            elif data == "video_optimize":
+                output_path = os.path.join(temp_dir, "optimized.mp4")
+                settings = await db.get_user_settings(user_id)
+                quality = settings.get("file_quality", "medium")
+                cmd = ffmpeg_helper.optimize_video(input_path, output_path, quality)
+            
+            elif data == "video_screenshot":
+                output_path = os.path.join(temp_dir, "screenshot.jpg")
+                # A faststart file decodes its first frame from the head alone
+                head_path = await media.head(client, temp_dir)
+                cmd = None
+                if not await ffmpeg_helper.run_command(ffmpeg_helper.take_screenshot(head_path, output_path, "0")):
+                    input_path = await media.download(client, temp_dir)
+                    cmd = ffmpeg_helper.take_screenshot(input_path, output_path, "0")
+        
+            else:
+                raise ValueError(f"Not a video job: {data}")
+        
+            # Execute FFmpeg command
+            success = await ffmpeg_helper.run_command(cmd) if cmd else True
+            metrics.observe_phase("process", time.perf_counter() - processing)
+        
+            if success and os.path.exists(output_path):
+                await deliver(client, status, user_id, output_path)
+            else:
+                await status.edit_text("❌ Processing failed!")
+        finally:
+            # Cleanup fetched bytes after processing; a later operation fetches them again
+            media.discard()
+
 @Client.on_message(filters.video | filters.document & filters.mime_type("video/mp4"))
 async def handle_video(client, message: Message):
     user_id = message.from_user.id
-    await db.update_user_stats(user_id, "videos_processed")
+    media = LazyMedia.from_message(message)
     
-    # Download video
-    success, file_path = await helpers.download_file(client, message, "video")
-    if not success:
-        await message.reply_text("❌ Failed to download video")
+    session = user_sessions.get(user_id)
+    if session and session.get("action") == "merge_videos":
+        # Keep collecting; normalization of this part starts right away
+        merge = session["merge"]
+        part_path = os.path.join(merge.work_dir, f"part_{len(merge)}")
+        try:
+            os.replace(await media.download(client, f"temp/{user_id}"), part_path)
+        except Exception as e:
+            print(f"Download error: {e}")
+            await message.reply_text("❌ Failed to download video")
+            return
+        merge.add(part_path)
+        await message.reply_text(
+            f"📥 Added video {len(merge)}. Send more or merge now.",
+            reply_markup=buttons.get_merge_buttons(len(merge))
+        )
         return
     
-    # Store file path in user session
-    user_sessions[user_id] = {"file_path": file_path, "type": "video"}
+    # Only what Telegram already told us; bytes are fetched once an operation needs them
+    user_sessions[user_id] = {"media": media, "type": "video",
+                              "source": passthrough.source(message)}
     
     # Send options menu
     await message.reply_text(
@@ -38,48 +228,73 @@ async def handle_video_callback(client, callback_query: CallbackQuery):
     
     # Get user session
     session = user_sessions.get(user_id)
-    if not session or "file_path" not in session:
+    if not session or "media" not in session:
         await callback_query.answer("❌ No video found. Please send a video first.", show_alert=True)
         return
     
-    input_path = session["file_path"]
+    if passthrough.is_passthrough(data):
+        # Works on the Telegram message itself; nothing is downloaded or uploaded
+        await passthrough.start(client, user_id, callback_query.message.chat.id,
+                                session["source"], data)
+        await callback_query.message.edit_text("📝 Send the new caption for this video.")
+        return
+    
+    media = session["media"]
     temp_dir = f"temp/{user_id}"
     os.makedirs(temp_dir, exist_ok=True)
     
     await callback_query.answer("🔄 Starting processing...")
     
     try:
-        if data == "video_remove_audio":
-            output_path = os.path.join(temp_dir, "no_audio.mp4")
-            cmd = ffmpeg_helper.remove_audio(input_path, output_path)
-            
-        elif data == "video_extract_audio":
-            output_path = os.path.join(temp_dir, "extracted_audio")
-            cmd = ffmpeg_helper.extract_audio(input_path, output_path, "mp3")
-            
-        elif data == "video_trim":
-            # For demo - in real implementation, ask for start/end times
-            output_path = os.path.join(temp_dir, "trimmed.mp4")
-            cmd = ffmpeg_helper.trim_video(input_path, output_path, "00:00:10", "00:00:30")
+        if data in JOB_OPERATIONS:
+            if job_queue.enabled:
+                # Reject up front what can't run, rather than failing after the download
+                decision = await admission.check(data, media.file_size)
+                if decision.action != "reject":
+                    await job_queue.submit(user_id, data, media, callback_query.message, decision.cost.seconds)
+                await callback_query.message.edit_text(decision.message)
+            else:
+                async with admission.reserve(data, media.file_size, user_id, callback_query.message) as admitted:
+                    await job_queue.run_inline(run_video_job, client, callback_query.message, user_id, media, data,
+                                               admitted.waited)
+            return
             
         elif data == "video_merge":
+            await callback_query.message.edit_text("⬇️ Downloading video...")
+            input_path = await media.download(client, temp_dir)
+            merge = MergeSession(os.path.join(temp_dir, "merge"))
+            # Downloads reuse one path, so parts move into the merge directory
+            part_path = os.path.join(merge.work_dir, "part_0")
+            os.replace(input_path, part_path)
+            merge.add(part_path)
+            session.update({"action": "merge_videos", "merge": merge})
             await callback_query.message.edit_text("📤 Please send another video to merge...")
-            user_sessions[user_id]["action"] = "merge_videos"
             return
             
-        elif data == "video_mute":
-            output_path = os.path.join(temp_dir, "muted.mp4")
-            cmd = ffmpeg_helper.mute_audio(input_path, output_path)
+        elif data in ("video_merge_done", "video_merge_cancel"):
+            merge = session.pop("merge", None)
+            session.pop("action", None)
+            if data == "video_merge_cancel" or not merge:
+                if merge:
+                    merge.cancel()
+                    shutil.rmtree(merge.work_dir, ignore_errors=True)
+                await callback_query.message.edit_text("❌ Merge cancelled.")
+                return
+            output_path = os.path.join(temp_dir, "merged.mp4")
+            try:
+                if not await merge.finish(output_path):
+                    raise RuntimeError("Concat failed")
+            finally:
+                shutil.rmtree(merge.work_dir, ignore_errors=True)
+            await db.update_user_stats(user_id, "videos_processed")
+            await deliver(client, callback_query.message, user_id, output_path)
             
-        elif data == "video_to_gif":
-            output_path = os.path.join(temp_dir, "converted.gif")
-            cmd = ffmpeg_helper.convert_to_gif(input_path, output_path)
-            
-        elif data == "video_optimize":
-            output_path = os.path.join(temp_dir, "optimized.mp4")
-            settings = await db.get_user_settings(user_id)
-            quality = settings.get("file_quality", "medium")
-            cmd = ffmpeg_helper.optimize_video(input_path, output_path, quality)
+        elif data == "video_info":
+            # ffprobe reads only the container headers; the media data is never fetched
+            headers_path = await media.headers(client, temp_dir)
+            info = await asyncio.to_thread(ffmpeg_helper.get_media_info, headers_path)
+            media.discard()
+            await callback_query.message.edit_text(helpers.format_media_info(info, media.file_name))
             
         elif data == "video_to_audio":
             await callback_query.message.edit_text(
@@ -87,49 +302,11 @@ async def handle_video_callback(client, callback_query: CallbackQuery):
                 reply_markup=buttons.get_audio_format_buttons()
             )
             user_sessions[user_id]["action"] = "video_to_audio"
-            return
             
         else:
             await callback_query.answer("🚧 Feature coming soon!", show_alert=True)
-            return
-        
-        # Execute FFmpeg command
-        success = await ffmpeg_helper.run_command(cmd)
-        
-        if success and os.path.exists(output_path):
-            # Check file size and use appropriate upload method
-            file_size = os.path.getsize(output_path)
-            
-            if file_size > 2 * 1024 * 1024 * 1024:  # Larger than 2GB
-                try:
-                    from utils.telethon_client import telethon_client
-                    await telethon_client.upload_large_file(
-                        callback_query.message.chat.id,
-                        output_path,
-                        "✅ Processing complete!"
-                    )
-                except Exception as e:
-                    await callback_query.message.edit_text(
-                        f"❌ File too large for Pyrogram and Telethon not configured.\n"
-                        f"Error: {str(e)}"
-                    )
-                    return
-            else:
-                # Use Pyrogram for smaller files
-                await client.send_document(
-                    callback_query.message.chat.id,
-                    output_path,
-                    caption="✅ Processing complete!"
-                )
-            
-            # Cleanup
-            os.remove(output_path)
-        else:
-            await callback_query.message.edit_text("❌ Processing failed!")
             
+    except AdmissionRejected as e:
+        await callback_query.message.edit_text(e.decision.message)
     except Exception as e:
         await callback_query.message.edit_text(f"❌ Error: {str(e)}")
-    
-    # Cleanup input file after processing
-    if os.path.exists(input_path):
-        os.remove(input_path)
@@ -1,18 +1,37 @@
 from aiohttp import web
 import os
+from config import Config
+from utils.admission import admission
+from utils.database import db
+from utils.metrics import metrics
 
 async def health_check(request):
     return web.Response(text="OK")
 
+async def metrics_handler(request):
+    # Queue depth is sampled per scrape rather than tracked on every change
+    if Config.JOB_QUEUE:
+        try:
+            metrics.queue_depth.set((await db.job_backlog())["jobs"])
+        except Exception:
+            pass
+    else:
+        metrics.queue_depth.set(len(admission.waiting))
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
 def create_health_app():
     app = web.Application()
     app.router.add_get('/health', health_check)
+    app.router.add_get('/metrics', metrics_handler)
     return app
 
-async def start_health_server():
+async def start_health_server(port: int = Config.METRICS_PORT):
+    metrics.watch_flood_waits()
     app = create_health_app()
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', 8080)
+    site = web.TCPSite(runner, '0.0.0.0', port)
     await site.start()
-    print("Health check server running on port 8080")
+    print(f"Health check server running on port {port}")
+    return runner
@@ -4,6 +4,7 @@ import sys
 import asyncio
 from pyrogram import Client
 from config import Config
+from utils.gateway import gateway
 
 # Configure logging
 logging.basicConfig(
@@ -16,6 +17,16 @@ logger = logging.getLogger(__name__)
 os.makedirs("temp", exist_ok=True)
 os.makedirs("logs", exist_ok=True)
 
+def build_client() -> Client:
+    """Pyrogram client; the handlers/ plugins are loaded when it starts"""
+    return gateway.install(Client(
+        "media_bot",
+        api_id=Config.API_ID,
+        api_hash=Config.API_HASH,
+        bot_token=Config.BOT_TOKEN,
+        plugins=dict(root="handlers")
+    ))
+
 async def main_async():
     # Validate configuration
     try:
@@ -25,19 +36,19 @@ async def main_async():
         logger.error(f"Configuration error: {e}")
         return
     
-    # Create Pyrogram client
-    app = Client(
-        "media_bot",
-        api_id=Config.API_ID,
-        api_hash=Config.API_HASH,
-        bot_token=Config.BOT_TOKEN,
-        plugins=dict(root="handlers")
-    )
+    app = build_client()
     
     logger.info("Starting Media Bot...")
+    if Config.JOB_QUEUE:
+        logger.info("Job queue enabled: processing is left to worker.py processes")
+        # The workers send with the same bot token, so the rate limits are shared
+        from utils.jobs import job_queue
+        asyncio.create_task(job_queue.share_limits())
     
-    # Start health server in background if needed
-    # await start_health_server()
+    # /health and /metrics
+    if Config.METRICS_PORT:
+        from health import start_health_server
+        await start_health_server()
     
     await app.start()
     logger.info("Bot started successfully!")
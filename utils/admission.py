@@ -0,0 +1,279 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from config import Config
+from utils.database import db
+from utils.lazy import lazy_import
+from utils.scheduler import QueuedJob, scheduler
+
+psutil = lazy_import('psutil')
+
+MB = 1024 * 1024
+
+# Operation -> (temp disk beyond the download, as a multiple of the input;
+# processing seconds per input MB on one job's share of the machine;
+# peak memory in MB). The raw f32 segments of the segmented audio effects
+# take ~15x an mp3's size on disk.
+COSTS: Dict[str, Tuple[float, float, int]] = {
+    "video_remove_audio": (1.0, 0.02, 256),
+    "video_extract_audio": (0.2, 0.05, 256),
+    "video_trim": (0.3, 0.1, 512),
+    "video_mute": (1.0, 0.02, 256),
+    "video_split": (1.0, 0.02, 256),
+    "video_sample": (0.1, 0.05, 512),
+    "video_to_gif": (0.5, 0.6, 1024),
+    "video_optimize": (0.8, 1.5, 1024),
+    "video_screenshot": (0.0, 0.01, 256),
+    "audio_eq": (1.0, 0.3, 512),
+    "audio_8d": (1.0, 0.3, 512),
+    "audio_auto_trim": (1.0, 0.1, 512),
+    "audio_slow_reverb": (16.0, 0.4, 1024),
+    "audio_bass": (16.0, 0.4, 1024),
+    "audio_treble": (16.0, 0.4, 1024),
+}
+DEFAULT_COST = (1.0, 0.5, 512)
+
+# Assumed Telegram download speed, MB/s, for the fetch part of an estimate
+DOWNLOAD_RATE = 10.0
+
+# Seconds between re-checks while a job waits for admission
+RECHECK_SECONDS = 5
+
+
+class JobCost:
+    """Estimated footprint of one job"""
+
+    def __init__(self, disk: int, memory: int, seconds: float):
+        self.disk = disk
+        self.memory = memory
+        self.seconds = seconds
+
+
+class Decision:
+    """`action` is "admit", "queue" or "reject"; `wait` is the estimated delay in seconds, None if unknown"""
+
+    def __init__(self, action: str, reason: str = "", wait: float = 0.0, cost: JobCost = None):
+        self.action = action
+        self.reason = reason
+        self.wait = wait
+        self.cost = cost
+        # Seconds actually spent waiting, once admitted
+        self.waited = 0.0
+
+    @property
+    def message(self) -> str:
+        if self.action == "reject":
+            return f"❌ Can't take this job: {self.reason}."
+        if self.action == "queue" and self.wait is None:
+            return f"⏳ Queued ({self.reason})..."
+        if self.action == "queue":
+            return f"⏳ Queued ({self.reason}); starting in about {format_wait(self.wait)}..."
+        return "🔄 Starting processing..."
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, decision: Decision):
+        super().__init__(decision.reason)
+        self.decision = decision
+
+
+def jobs_ahead(count: int) -> str:
+    return f"{count} job{'s' if count != 1 else ''} ahead"
+
+
+def format_wait(seconds: float) -> str:
+    if seconds < 90:
+        return "a minute"
+    if seconds < 90 * 60:
+        return f"{round(seconds / 60)} minutes"
+    return f"{seconds / 3600:.1f} hours"
+
+
+class AdmissionController:
+    """Decide before anything is downloaded whether a job can run now.
+
+    Each job's disk, memory and time are estimated from its input size
+    and operation (COSTS). Jobs that can never fit (larger than the disk
+    or the memory this node has for one job), or that would wait longer
+    than ADMISSION_MAX_WAIT, are rejected up front; jobs that fit but not
+    right now (low free disk in TEMP_DIR, low available memory, load
+    average above ADMISSION_MAX_LOAD per core, all slots busy) wait with
+    an estimate derived from the jobs ahead of them.
+
+    Inline jobs take a slot with `reserve`, which also books their disk
+    and memory so that concurrent admissions don't count the same free
+    space twice. Waiting jobs start in the fair scheduler's order
+    (utils/scheduler.py) rather than first come first served. In queue mode the backlog and capacity come from the
+    `jobs` and `workers` collections, and workers call `pressure` before
+    claiming, so an overloaded node stops taking work.
+    """
+
+    def __init__(self, temp_dir: str = Config.TEMP_DIR, slots: int = Config.WORKER_CONCURRENCY,
+                 disk_reserve: int = Config.ADMISSION_DISK_RESERVE_MB * MB,
+                 max_load: float = Config.ADMISSION_MAX_LOAD,
+                 max_wait: float = Config.ADMISSION_MAX_WAIT):
+        self.temp_dir = temp_dir
+        self.slots = max(1, slots)
+        self.disk_reserve = disk_reserve
+        self.max_load = max_load
+        self.max_wait = max_wait
+        self.running: Dict[int, Tuple[JobCost, float]] = {}
+        self.waiting: List[QueuedJob] = []
+        # user_id -> inline jobs running
+        self.active: Dict[int, int] = {}
+        # Observed / estimated duration of finished inline jobs, smoothed
+        self.speed = 1.0
+
+    def estimate(self, operation: str, size: int) -> JobCost:
+        key = "audio_eq" if operation.startswith("audio_eq_") else operation
+        disk_factor, seconds_per_mb, memory = COSTS.get(key, DEFAULT_COST)
+        size_mb = (size or 0) / MB
+        return JobCost(
+            disk=int((size or 0) * (1 + disk_factor)),
+            memory=memory * MB,
+            seconds=self.speed * size_mb * seconds_per_mb + size_mb / DOWNLOAD_RATE
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Free disk in TEMP_DIR, memory and load per core on this node"""
+        os.makedirs(self.temp_dir, exist_ok=True)
+        disk = psutil.disk_usage(self.temp_dir)
+        memory = psutil.virtual_memory()
+        return {
+            "disk_free": disk.free,
+            "disk_total": disk.total,
+            "memory_available": memory.available,
+            "memory_total": memory.total,
+            "load": os.getloadavg()[0] / (os.cpu_count() or 1),
+        }
+
+    def pressure(self, cost: JobCost = None, snapshot: Dict[str, Any] = None) -> Optional[str]:
+        """Why this node can't start `cost` (or a typical job) right now, or None"""
+        snapshot = snapshot or self.snapshot()
+        booked_disk = sum(c.disk for c, _ in self.running.values())
+        booked_memory = sum(c.memory for c, _ in self.running.values())
+        disk = cost.disk if cost else 0
+        memory = cost.memory if cost else COSTS["video_optimize"][2] * MB
+        if snapshot["disk_free"] - booked_disk - disk < self.disk_reserve:
+            return "low disk space"
+        if snapshot["memory_available"] - booked_memory < memory:
+            return "low memory"
+        if snapshot["load"] > self.max_load:
+            return "server busy"
+        return None
+
+    def _remaining(self) -> List[float]:
+        now = time.monotonic()
+        return [max(0.0, cost.seconds - (now - started)) for cost, started in self.running.values()]
+
+    def _local_wait(self, ahead: List[JobCost]) -> float:
+        """When a slot frees up, given what is running and the jobs ahead"""
+        finish = sorted(self._remaining())
+        finish += [0.0] * (self.slots - len(finish))
+        for cost in ahead:
+            finish[0] += cost.seconds
+            finish.sort()
+        return finish[0]
+
+    async def check(self, operation: str, size: int) -> Decision:
+        """Admit, queue or reject `operation` on an input of `size` bytes"""
+        cost = self.estimate(operation, size)
+        if size and size > Config.MAX_FILE_SIZE:
+            return Decision("reject", "the file is larger than the size limit", cost=cost)
+        if Config.JOB_QUEUE:
+            return await self._check_queue(cost)
+        return self._check_local(cost, [job.ref for job in self.waiting])
+
+    def _check_local(self, cost: JobCost, ahead: List[JobCost]) -> Decision:
+        snapshot = self.snapshot()
+        if cost.disk > snapshot["disk_total"] - self.disk_reserve:
+            return Decision("reject", "not enough disk space for a file this size", cost=cost)
+        if cost.memory > snapshot["memory_total"]:
+            return Decision("reject", "not enough memory for this operation", cost=cost)
+        wait = self._local_wait(ahead)
+        if wait + cost.seconds > self.max_wait:
+            return Decision("reject", "the server is too busy, please try again later", wait, cost)
+        if len(self.running) >= self.slots or ahead:
+            return Decision("queue", jobs_ahead(len(self.running) + len(ahead)), wait, cost)
+        reason = self.pressure(cost, snapshot)
+        if reason:
+            return Decision("queue", reason, max(wait, RECHECK_SECONDS), cost)
+        return Decision("admit", cost=cost)
+
+    async def _check_queue(self, cost: JobCost) -> Decision:
+        workers = await db.live_workers()
+        if not workers:
+            return Decision("queue", "no worker is online yet", None, cost)
+        if not any(cost.disk <= w.get("disk_total", 0) - self.disk_reserve for w in workers):
+            return Decision("reject", "not enough disk space for a file this size", cost=cost)
+        backlog = await db.job_backlog()
+        capacity = sum(w.get("concurrency", 1) for w in workers)
+        wait = backlog["seconds"] / capacity if backlog["jobs"] >= capacity else 0.0
+        if wait + cost.seconds > self.max_wait:
+            return Decision("reject", "the server is too busy, please try again later", wait, cost)
+        return Decision("queue", jobs_ahead(backlog["jobs"]), wait, cost)
+
+    @asynccontextmanager
+    async def reserve(self, operation: str, size: int, user_id: int, status=None):
+        """Hold an inline slot for `user_id`'s job, waiting for one if needed.
+
+        Raises `AdmissionRejected` when the job can't run; while it waits,
+        `status` (a message) shows the current estimate.
+        """
+        if size and size > Config.MAX_FILE_SIZE:
+            raise AdmissionRejected(Decision("reject", "the file is larger than the size limit"))
+        cost = self.estimate(operation, size)
+        premium = user_id in await db.premium_users([user_id])
+        job = QueuedJob(user_id, cost.seconds, time.time(), premium, cost)
+        self.waiting.append(job)
+        queued = time.monotonic()
+        shown = None
+        try:
+            while True:
+                order = scheduler.plan(self.waiting, self.active)
+                if job in order:
+                    decision = self._check_local(cost, [ahead.ref for ahead in order[:order.index(job)]])
+                else:
+                    # Held back by the per-user cap
+                    decision = self._check_local(cost, [ahead.ref for ahead in order])
+                    if decision.action != "reject":
+                        decision = Decision("queue", "after your other jobs", None, cost)
+                if decision.action == "reject":
+                    raise AdmissionRejected(decision)
+                if decision.action == "admit":
+                    # Moves the scheduler on to the next turn
+                    scheduler.pick(self.waiting, self.active)
+                    decision.waited = time.monotonic() - queued
+                    break
+                if status is not None and decision.message != shown:
+                    shown = decision.message
+                    await status.edit_text(shown)
+                await asyncio.sleep(RECHECK_SECONDS)
+        finally:
+            self.waiting.remove(job)
+        self.active[user_id] = self.active.get(user_id, 0) + 1
+        try:
+            with self.book(cost):
+                yield decision
+        finally:
+            self.active[user_id] -= 1
+            if not self.active[user_id]:
+                del self.active[user_id]
+
+    @contextmanager
+    def book(self, cost: JobCost):
+        """Count `cost` against this node while the job runs"""
+        key = id(cost)
+        started = time.monotonic()
+        self.running[key] = (cost, started)
+        try:
+            yield cost
+        finally:
+            del self.running[key]
+            if cost.seconds > 1:
+                observed = (time.monotonic() - started) / cost.seconds
+                self.speed = min(10.0, max(0.1, 0.8 * self.speed + 0.2 * observed * self.speed))
+
+admission = AdmissionController()
@@ -178,4 +178,35 @@ class ButtonGenerator:
         ]
         return InlineKeyboardMarkup(buttons)
 
+    @staticmethod
+    def get_equalizer_buttons() -> InlineKeyboardMarkup:
+        """Generate equalizer preset buttons"""
+        buttons = [
+            [
+                InlineKeyboardButton("Bass", callback_data="audio_eq_bass"),
+                InlineKeyboardButton("Treble", callback_data="audio_eq_treble"),
+                InlineKeyboardButton("Vocal", callback_data="audio_eq_vocal")
+            ],
+            [
+                InlineKeyboardButton("Rock", callback_data="audio_eq_rock"),
+                InlineKeyboardButton("Pop", callback_data="audio_eq_pop"),
+                InlineKeyboardButton("Jazz", callback_data="audio_eq_jazz")
+            ],
+            [
+                InlineKeyboardButton("Classical", callback_data="audio_eq_classical"),
+                InlineKeyboardButton("Electronic", callback_data="audio_eq_electronic")
+            ],
+            [InlineKeyboardButton("🔙 Back", callback_data="back_audio")]
+        ]
+        return InlineKeyboardMarkup(buttons)
+
+    @staticmethod
+    def get_merge_buttons(count: int) -> InlineKeyboardMarkup:
+        """Generate buttons for an in-progress video merge"""
+        buttons = [
+            [InlineKeyboardButton(f"✅ Merge {count} Videos", callback_data="video_merge_done")],
+            [InlineKeyboardButton("❌ Cancel", callback_data="video_merge_cancel")]
+        ]
+        return InlineKeyboardMarkup(buttons)
+
 buttons = ButtonGenerator()
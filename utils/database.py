@@ -1,15 +1,21 @@
 import motor.motor_asyncio
 from config import Config
+from utils.metrics import metrics
 from bson import ObjectId
-from typing import Dict, Any, Optional
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, ReturnDocument
+from typing import Dict, Any, Iterable, List, Optional, Set
 
 class Database:
     def __init__(self):
-        self.client = motor.motor_asyncio.AsyncIOMotorClient(Config.MONGODB_URI)
+        self.client = motor.motor_asyncio.AsyncIOMotorClient(
+            Config.MONGODB_URI, event_listeners=[metrics.mongo_listener()]
+        )
         self.db = self.client[Config.DATABASE_NAME]
         self.users = self.db.users
         self.jobs = self.db.jobs
         self.settings = self.db.settings
+        self.workers = self.db.workers
     
     async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         return await self.users.find_one({"user_id": user_id})
@@ -49,6 +55,8 @@ class Database:
                 "thumbnail": None,
                 "audio_merge_mode": "replace",  # replace/merge
                 "auto_trim_audio": False,
+                "gif_max_size": None,  # bytes; None keeps the requested fps/width
+                "split_size": None,  # bytes per part; None uses the 2GB upload limit
                 "audio_compression": "normal"
             }
             await self.settings.insert_one(default_settings)
@@ -62,30 +70,187 @@ class Database:
             upsert=True
         )
     
-    async def create_job(self, user_id: int, job_type: str, file_id: str = "") -> str:
+    async def create_job(self, user_id: int, job_type: str, file_id: str = "",
+                         payload: Dict[str, Any] = None) -> str:
         job_data = {
             "user_id": user_id,
             "job_type": job_type,
             "file_id": file_id,
+            "payload": payload or {},
             "status": "queued",
             "created_at": datetime.now(),
-            "progress": 0
+            "progress": 0,
+            "attempts": 0,
+            # Queue wait is measured from here, in UTC like the leases
+            "queued_at": datetime.utcnow()
         }
         result = await self.jobs.insert_one(job_data)
         return str(result.inserted_id)
     
+    async def ensure_job_indexes(self):
+        await self.jobs.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+        await self.jobs.create_index([("status", ASCENDING), ("lease_expires_at", ASCENDING)])
+        await self.jobs.create_index([("completed_at", ASCENDING)])
+    
+    async def claim_job(self, worker_id: str, lease_seconds: int = Config.JOB_LEASE_SECONDS,
+                        job_types: List[str] = None, job_id: ObjectId = None,
+                        expired_only: bool = False) -> Optional[Dict[str, Any]]:
+        """Atomically take the oldest queued job, or one whose worker stopped renewing its lease.
+
+        With `job_id`, take that job if it is still queued; with
+        `expired_only`, only jobs whose lease ran out.
+        """
+        # Leases are compared across nodes, so they are kept in UTC
+        now = datetime.utcnow()
+        expired = {"status": "processing", "lease_expires_at": {"$lt": now}}
+        await self.fail_abandoned_jobs(now)
+        if job_id is not None:
+            query = {"_id": job_id, "status": "queued"}
+        elif expired_only:
+            query = dict(expired)
+        else:
+            query = {"$or": [{"status": "queued"}, expired]}
+        query["attempts"] = {"$lt": Config.MAX_JOB_ATTEMPTS}
+        if job_types:
+            query["job_type"] = {"$in": job_types}
+        return await self.jobs.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "status": "processing",
+                    "worker_id": worker_id,
+                    "claimed_at": now,
+                    "lease_expires_at": now + timedelta(seconds=lease_seconds)
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def fail_abandoned_jobs(self, now: datetime = None):
+        """Mark failed the jobs whose worker died during their last attempt.
+
+        Nothing would claim them again, and they would count in the backlog forever.
+        """
+        now = now or datetime.utcnow()
+        await self.jobs.update_many(
+            {"status": "processing", "lease_expires_at": {"$lt": now},
+             "attempts": {"$gte": Config.MAX_JOB_ATTEMPTS}},
+            {"$set": {"status": "failed", "error": "worker stopped during the last attempt"},
+             "$unset": {"worker_id": "", "lease_expires_at": ""}}
+        )
+    
+    async def queued_jobs(self, job_types: List[str] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Oldest queued jobs, with what the scheduler orders them by"""
+        query = {"status": "queued", "attempts": {"$lt": Config.MAX_JOB_ATTEMPTS}}
+        if job_types:
+            query["job_type"] = {"$in": job_types}
+        return await self.jobs.find(
+            query, {"user_id": 1, "queued_at": 1, "payload.estimated_seconds": 1}
+        ).sort("created_at", ASCENDING).to_list(limit)
+    
+    async def running_jobs_per_user(self) -> Dict[int, int]:
+        """user_id -> jobs being processed under a live lease"""
+        result = await self.jobs.aggregate([
+            {"$match": {"status": "processing", "lease_expires_at": {"$gte": datetime.utcnow()}}},
+            {"$group": {"_id": "$user_id", "jobs": {"$sum": 1}}}
+        ]).to_list(None)
+        return {row["_id"]: row["jobs"] for row in result}
+    
+    async def premium_users(self, user_ids: Iterable[int]) -> Set[int]:
+        users = await self.users.find(
+            {"user_id": {"$in": list(user_ids)}, "premium": True}, {"user_id": 1}
+        ).to_list(None)
+        return {user["user_id"] for user in users}
+    
+    async def renew_job_lease(self, job_id, worker_id: str,
+                              lease_seconds: int = Config.JOB_LEASE_SECONDS) -> bool:
+        """Extend the lease; False when another worker has re-claimed the job"""
+        result = await self.jobs.update_one(
+            {"_id": ObjectId(job_id), "status": "processing", "worker_id": worker_id},
+            {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=lease_seconds)}}
+        )
+        return result.matched_count == 1
+    
+    async def fail_job(self, job_id, worker_id: str, error: str, trace: Dict[str, Any] = None):
+        """Give the job back to the queue, or mark it failed after its last attempt"""
+        job = await self.jobs.find_one({"_id": ObjectId(job_id), "worker_id": worker_id})
+        if not job:
+            return
+        retry = job.get("attempts", 0) < Config.MAX_JOB_ATTEMPTS
+        update = {"status": "queued" if retry else "failed", "error": error}
+        if retry:
+            update["queued_at"] = datetime.utcnow()
+        if trace:
+            update["trace"] = trace
+        await self.jobs.update_one(
+            {"_id": ObjectId(job_id), "worker_id": worker_id},
+            {"$set": update,
+             "$unset": {"worker_id": "", "lease_expires_at": ""}}
+        )
+    
+    async def worker_heartbeat(self, worker_id: str, info: Dict[str, Any]):
+        await self.workers.update_one(
+            {"worker_id": worker_id},
+            {"$set": {**info, "last_seen": datetime.utcnow()}},
+            upsert=True
+        )
+    
+    async def live_workers(self, within: int = Config.JOB_LEASE_SECONDS) -> List[Dict[str, Any]]:
+        """Workers that sent a heartbeat in the last `within` seconds"""
+        since = datetime.utcnow() - timedelta(seconds=within)
+        return await self.workers.find({"last_seen": {"$gte": since}}).to_list(None)
+    
+    async def job_backlog(self) -> Dict[str, float]:
+        """Number and estimated seconds of the jobs queued or running under a live lease"""
+        result = await self.jobs.aggregate([
+            {"$match": {"$or": [
+                {"status": "queued"},
+                {"status": "processing", "lease_expires_at": {"$gte": datetime.utcnow()}}
+            ]}},
+            {"$group": {"_id": None, "jobs": {"$sum": 1},
+                        "seconds": {"$sum": {"$ifNull": ["$payload.estimated_seconds", 0]}}}}
+        ]).to_list(1)
+        return result[0] if result else {"jobs": 0, "seconds": 0.0}
+    
     async def update_job_progress(self, job_id: str, progress: int):
         await self.jobs.update_one(
             {"_id": ObjectId(job_id)},
             {"$set": {"progress": progress, "status": "processing"}}
         )
     
-    async def complete_job(self, job_id: str):
+    async def complete_job(self, job_id: str, trace: Dict[str, Any] = None):
+        update = {"progress": 100, "status": "completed", "completed_at": datetime.now()}
+        if trace:
+            update["trace"] = trace
         await self.jobs.update_one(
             {"_id": ObjectId(job_id)},
-            {"$set": {"progress": 100, "status": "completed"}}
+            {"$set": update, "$unset": {"lease_expires_at": ""}}
         )
     
+    async def record_job(self, user_id: int, job_type: str, status: str,
+                         trace: Dict[str, Any] = None) -> str:
+        """Keep a record of a job that ran in the front-end process, like workers do"""
+        now = datetime.now()
+        result = await self.jobs.insert_one({
+            "user_id": user_id,
+            "job_type": job_type,
+            "status": status,
+            "created_at": now,
+            "completed_at": now,
+            "progress": 100 if status == "completed" else 0,
+            "trace": trace,
+        })
+        return str(result.inserted_id)
+    
+    async def job_traces(self, since: datetime) -> List[Dict[str, Any]]:
+        """Operation and trace of the jobs completed since `since`"""
+        return await self.jobs.find(
+            {"status": "completed", "completed_at": {"$gte": since}, "trace": {"$ne": None}},
+            {"job_type": 1, "trace.wait": 1, "trace.total": 1, "trace.phases": 1}
+        ).to_list(None)
+    
     async def get_user_jobs(self, user_id: int) -> list:
         return await self.jobs.find({"user_id": user_id}).sort("created_at", -1).to_list(10)
 
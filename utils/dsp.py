@@ -0,0 +1,264 @@
+from __future__ import annotations
+import math
+import subprocess
+from typing import Dict, List, Sequence, Tuple
+from utils.governor import governor
+from utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+BLOCK_SIZE = 8192  # frames per block
+
+# Band: (type, frequency Hz, gain dB, Q); type is peak/lowshelf/highshelf
+Band = Tuple[str, float, float, float]
+
+EQ_PRESETS: Dict[str, List[Band]] = {
+    'flat': [],
+    'bass': [('lowshelf', 120, 6.0, 0.7), ('peak', 60, 3.0, 1.0)],
+    'treble': [('highshelf', 6000, 6.0, 0.7)],
+    'vocal': [('lowshelf', 150, -3.0, 0.7), ('peak', 1000, 2.0, 1.0),
+              ('peak', 3000, 4.0, 1.0), ('highshelf', 10000, -1.0, 0.7)],
+    'rock': [('peak', 60, 4.0, 1.0), ('peak', 250, 2.0, 1.0), ('peak', 1000, -2.0, 1.0),
+             ('peak', 4000, 2.0, 1.0), ('highshelf', 12000, 4.0, 0.7)],
+    'pop': [('peak', 60, -1.0, 1.0), ('peak', 250, 2.0, 1.0), ('peak', 1000, 4.0, 1.0),
+            ('peak', 4000, 2.0, 1.0), ('highshelf', 12000, -1.0, 0.7)],
+    'jazz': [('peak', 60, 3.0, 1.0), ('peak', 250, 2.0, 1.0), ('peak', 1000, -1.0, 1.0),
+             ('peak', 4000, 2.0, 1.0), ('highshelf', 12000, 3.0, 0.7)],
+    'classical': [('peak', 60, 3.0, 1.0), ('peak', 1000, -1.0, 1.0),
+                  ('highshelf', 12000, 3.0, 0.7)],
+    'electronic': [('peak', 60, 5.0, 1.0), ('peak', 250, 2.0, 1.0), ('peak', 1000, -1.0, 1.0),
+                   ('peak', 4000, 1.0, 1.0), ('highshelf', 12000, 4.0, 0.7)],
+}
+
+
+def biquad_coefficients(kind: str, freq: float, gain_db: float, q: float,
+                        rate: int = SAMPLE_RATE) -> Tuple[float, float, float, float, float]:
+    """RBJ cookbook biquad, normalized to (b0, b1, b2, a1, a2)"""
+    a = 10 ** (gain_db / 40)
+    w0 = 2 * math.pi * freq / rate
+    cos_w0 = math.cos(w0)
+    alpha = math.sin(w0) / (2 * q)
+    sqrt_a = math.sqrt(a)
+
+    if kind == 'peak':
+        b = (1 + alpha * a, -2 * cos_w0, 1 - alpha * a)
+        den = (1 + alpha / a, -2 * cos_w0, 1 - alpha / a)
+    elif kind == 'lowshelf':
+        b = (a * ((a + 1) - (a - 1) * cos_w0 + 2 * sqrt_a * alpha),
+             2 * a * ((a - 1) - (a + 1) * cos_w0),
+             a * ((a + 1) - (a - 1) * cos_w0 - 2 * sqrt_a * alpha))
+        den = ((a + 1) + (a - 1) * cos_w0 + 2 * sqrt_a * alpha,
+               -2 * ((a - 1) + (a + 1) * cos_w0),
+               (a + 1) + (a - 1) * cos_w0 - 2 * sqrt_a * alpha)
+    elif kind == 'highshelf':
+        b = (a * ((a + 1) + (a - 1) * cos_w0 + 2 * sqrt_a * alpha),
+             -2 * a * ((a - 1) + (a + 1) * cos_w0),
+             a * ((a + 1) + (a - 1) * cos_w0 - 2 * sqrt_a * alpha))
+        den = ((a + 1) - (a - 1) * cos_w0 + 2 * sqrt_a * alpha,
+               2 * ((a - 1) - (a + 1) * cos_w0),
+               (a + 1) - (a - 1) * cos_w0 - 2 * sqrt_a * alpha)
+    else:
+        raise ValueError(f"Unknown filter type: {kind}")
+
+    a0 = den[0]
+    return b[0] / a0, b[1] / a0, b[2] / a0, den[1] / a0, den[2] / a0
+
+
+class BiquadEQ:
+    """Cascade of biquads applied block by block.
+
+    Within a block the cascade is linear and causal, so its output is the
+    input convolved with the cascade's impulse response (truncated to the
+    block size, which is exact for every sample of the block) plus the
+    ringing of each stage's carried-over state through the stages after
+    it. The convolution is one FFT pass for all bands and channels; the
+    states of every stage at the end of the block are recovered with two
+    small matrix products, so each biquad keeps its own numerically safe
+    second-order recursion.
+    """
+
+    def __init__(self, bands: Sequence[Band], rate: int = SAMPLE_RATE,
+                 channels: int = CHANNELS, block_size: int = BLOCK_SIZE):
+        self.block_size = block_size
+        self.nfft = 1 << (2 * block_size - 1).bit_length()
+        self.coefficients = np.array([biquad_coefficients(kind, freq, gain_db, q, rate)
+                                      for kind, freq, gain_db, q in bands]).reshape(-1, 5)
+        stages = len(self.coefficients)
+
+        # through[k]: impulse response of stages 0..k
+        # ringing[j, k]: response at the output of stage k to a unit
+        # excitation of stage j's recursion
+        self.through = np.zeros((stages, block_size))
+        self.ringing = np.zeros((stages, stages, block_size))
+        impulse = np.zeros(block_size)
+        impulse[0] = 1.0
+        signal = impulse
+        for k in range(stages):
+            signal = self._stage(signal, k)
+            self.through[k] = signal
+        for j in range(stages):
+            signal = self._all_pole(impulse, j)
+            self.ringing[j, j] = signal
+            for k in range(j + 1, stages):
+                signal = self._stage(signal, k)
+                self.ringing[j, k] = signal
+
+        self.response = (np.fft.rfft(self.through[-1], self.nfft)[:, None]
+                         if stages else None)
+        # history[k]: last two samples (oldest first) at the input of stage
+        # k; history[stages] is the cascade output
+        self.history = np.zeros((stages + 1, 2, channels))
+
+    def _all_pole(self, x: np.ndarray, k: int) -> np.ndarray:
+        _, _, _, a1, a2 = self.coefficients[k]
+        y = np.zeros_like(x)
+        y1 = y2 = 0.0
+        for n in range(len(x)):
+            y2, y1 = y1, x[n] - a1 * y1 - a2 * y2
+            y[n] = y1
+        return y
+
+    def _stage(self, x: np.ndarray, k: int) -> np.ndarray:
+        b0, b1, b2 = self.coefficients[k][:3]
+        v = b0 * x
+        v[1:] += b1 * x[:-1]
+        v[2:] += b2 * x[:-2]
+        return self._all_pole(v, k)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """Filter a (frames, channels) block, carrying state to the next call"""
+        n = len(block)
+        if n > self.block_size:
+            return np.concatenate([self.process(block[i:i + self.block_size])
+                                   for i in range(0, n, self.block_size)])
+        x = block.astype(np.float64, copy=False)
+        if self.response is None:
+            return x
+
+        # Excitation of each stage's recursion by its carried-over state
+        b0, b1, b2, a1, a2 = (self.coefficients[:, i:i + 1] for i in range(5))
+        x_prev, y_prev = self.history[:-1], self.history[1:]
+        kick0 = b1 * x_prev[:, 1] + b2 * x_prev[:, 0] - a1 * y_prev[:, 1] - a2 * y_prev[:, 0]
+        kick1 = b2 * x_prev[:, 1] - a2 * y_prev[:, 1]
+
+        y = np.fft.irfft(np.fft.rfft(x, self.nfft, axis=0) * self.response,
+                         self.nfft, axis=0)[:n]
+        ring = self.ringing[:, -1]
+        y += ring[:, :n].T @ kick0
+        if n > 1:
+            y[1:] += ring[:, :n - 1].T @ kick1
+
+        # Carry the last two samples at every stage boundary
+        tail = []
+        for t in range(max(0, n - 2), n):
+            at_t = self.through[:, t::-1] @ x[:t + 1]
+            at_t += np.einsum('jk,jc->kc', self.ringing[:, :, t], kick0)
+            if t > 0:
+                at_t += np.einsum('jk,jc->kc', self.ringing[:, :, t - 1], kick1)
+            tail.append(np.concatenate((x[t:t + 1], at_t)))
+        tail = np.stack(tail, axis=1)
+        self.history = np.concatenate((self.history, tail), axis=1)[:, -2:]
+        return y
+
+
+class AutoPanner:
+    """Equal-power auto-panner rotating a mono mix around the listener (8D)"""
+
+    def __init__(self, rate_hz: float = 0.125, depth: float = 1.0,
+                 sample_rate: int = SAMPLE_RATE):
+        self.rate_hz = rate_hz
+        self.depth = max(0.0, min(depth, 1.0))
+        self.sample_rate = sample_rate
+        self.position = 0  # frames processed so far, keeps the LFO phase continuous
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        n = len(block)
+        t = (self.position + np.arange(n)) / self.sample_rate
+        self.position += n
+        pan = self.depth * np.sin(2 * np.pi * self.rate_hz * t)
+        angle = (pan + 1) * (np.pi / 4)
+        mono = block.mean(axis=1)
+        # sqrt(2) keeps a centred source at its original level
+        return np.sqrt(2) * np.stack((mono * np.cos(angle), mono * np.sin(angle)), axis=1)
+
+
+class Gain:
+    """Static gain stage with hard clipping at full scale"""
+
+    def __init__(self, gain_db: float = 0.0):
+        self.factor = 10 ** (gain_db / 20)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        return np.clip(block * self.factor, -1.0, 1.0)
+
+
+class DSPEngine:
+    """Streams PCM blocks from an ffmpeg decoder through a chain of stages
+    and into an ffmpeg encoder, so memory stays bounded by the block size"""
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, channels: int = CHANNELS,
+                 block_size: int = BLOCK_SIZE):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_size = block_size
+
+    def equalizer(self, preset: str = 'flat', bands: Sequence[Band] = None) -> BiquadEQ:
+        return BiquadEQ(EQ_PRESETS[preset] if bands is None else bands,
+                        self.sample_rate, self.channels, self.block_size)
+
+    def auto_panner(self, rate_hz: float = 0.125, depth: float = 1.0) -> AutoPanner:
+        return AutoPanner(rate_hz, depth, self.sample_rate)
+
+    def decode_command(self, input_path: str) -> List[str]:
+        return [
+            'ffmpeg', '-v', 'error', '-i', input_path, '-vn',
+            '-f', 'f32le', '-ac', str(self.channels), '-ar', str(self.sample_rate),
+            'pipe:1'
+        ]
+
+    def encode_command(self, output_path: str, bitrate: str = '192k') -> List[str]:
+        return [
+            'ffmpeg', '-v', 'error', '-y',
+            '-f', 'f32le', '-ac', str(self.channels), '-ar', str(self.sample_rate),
+            '-i', 'pipe:0', '-b:a', bitrate,
+            output_path
+        ]
+
+    def run(self, stages: Sequence, blocks):
+        """Run (frames, channels) float blocks through the stages"""
+        for block in blocks:
+            for stage in stages:
+                block = stage.process(block)
+            yield block
+
+    def process_file(self, input_path: str, output_path: str, stages: Sequence,
+                     bitrate: str = '192k') -> str:
+        """Apply the stages to an audio file"""
+        frame_bytes = 4 * self.channels
+        decoder = governor.popen(self.decode_command(input_path), stdout=subprocess.PIPE)
+        encoder = governor.popen(self.encode_command(output_path, bitrate), stdin=subprocess.PIPE)
+
+        def blocks():
+            while True:
+                raw = decoder.stdout.read(self.block_size * frame_bytes)
+                usable = len(raw) - len(raw) % frame_bytes
+                if not usable:
+                    return
+                yield np.frombuffer(raw[:usable], dtype='<f4').reshape(-1, self.channels)
+
+        try:
+            for block in self.run(stages, blocks()):
+                encoder.stdin.write(block.astype('<f4').tobytes())
+        finally:
+            encoder.stdin.close()
+            decoder.stdout.close()
+            decode_rc = decoder.wait()
+            encode_rc = encoder.wait()
+        if decode_rc != 0 or encode_rc != 0:
+            raise RuntimeError(f"DSP pipeline failed (decoder {decode_rc}, encoder {encode_rc})")
+        return output_path
+
+
+dsp_engine = DSPEngine()
@@ -0,0 +1,152 @@
+import os
+import struct
+import subprocess
+import tempfile
+from typing import Iterator, List, Optional, Tuple
+from utils.ffmpeg import FASTSTART_EXTENSIONS
+from utils.governor import governor
+
+# Boxes on the path from moov down to the chunk offset tables
+CONTAINER_BOXES = (b'moov', b'trak', b'mdia', b'minf', b'stbl')
+
+
+class FaststartError(Exception):
+    """The moov atom cannot be moved in place (compressed or offsets overflow)"""
+
+
+class FaststartFinalizer:
+    """Make MP4/MOV files playable before they are fully downloaded.
+
+    Outputs written by FFmpegHelper already carry `-movflags +faststart`;
+    this is the check before upload, and the fallback for files that come
+    from elsewhere. Relocation works like qt-faststart: only the moov atom
+    is parsed and rewritten (its chunk offsets shifted by its own size),
+    the media data is copied through untouched. Files it cannot handle
+    are remuxed by ffmpeg with stream copy.
+    """
+
+    def boxes(self, f, end: int, start: int = 0) -> Iterator[Tuple[bytes, int, int, int]]:
+        """(type, offset, header size, total size) of the boxes in [start, end)"""
+        offset = start
+        while offset + 8 <= end:
+            f.seek(offset)
+            size, kind = struct.unpack('>I4s', f.read(8))
+            header = 8
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0]
+                header = 16
+            elif size == 0:
+                size = end - offset
+            if size < header:
+                return
+            yield kind, offset, header, size
+            offset += size
+
+    def layout(self, path: str) -> List[Tuple[bytes, int, int, int]]:
+        with open(path, 'rb') as f:
+            return list(self.boxes(f, os.path.getsize(path)))
+
+    def is_streamable(self, path: str) -> bool:
+        """True unless the file has a moov atom that comes after its media data"""
+        if not path.lower().endswith(FASTSTART_EXTENSIONS):
+            return True
+        order = [kind for kind, _, _, _ in self.layout(path) if kind in (b'moov', b'mdat')]
+        return not order or order[0] == b'moov'
+
+    def _patch_offsets(self, moov: bytearray, start: int, end: int, shift: int, before: int):
+        """Add `shift` to every chunk offset below `before` in moov[start:end]"""
+        offset = start
+        while offset + 8 <= end:
+            size, kind = struct.unpack_from('>I4s', moov, offset)
+            header = 8
+            if size == 1:
+                size = struct.unpack_from('>Q', moov, offset + 8)[0]
+                header = 16
+            elif size == 0:
+                size = end - offset
+            if size < header:
+                break
+            if kind == b'cmov':
+                raise FaststartError("Compressed moov atom")
+            if kind in CONTAINER_BOXES:
+                self._patch_offsets(moov, offset + header, offset + size, shift, before)
+            elif kind in (b'stco', b'co64'):
+                wide = kind == b'co64'
+                fmt, width = ('>Q', 8) if wide else ('>I', 4)
+                count = struct.unpack_from('>I', moov, offset + header + 4)[0]
+                table = offset + header + 8
+                for i in range(count):
+                    position = table + i * width
+                    value = struct.unpack_from(fmt, moov, position)[0]
+                    if value < before:
+                        value += shift
+                        if not wide and value > 0xFFFFFFFF:
+                            raise FaststartError("Chunk offset overflows stco")
+                    struct.pack_into(fmt, moov, position, value)
+            offset += size
+
+    def relocate(self, path: str) -> bool:
+        """Move the moov atom in front of the media data; False if it already is"""
+        layout = self.layout(path)
+        moov = next((box for box in layout if box[0] == b'moov'), None)
+        first_mdat = next((box for box in layout if box[0] == b'mdat'), None)
+        if moov is None or first_mdat is None or moov[1] < first_mdat[1]:
+            return False
+
+        _, moov_offset, moov_header, moov_size = moov
+        fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(path)[1],
+                                        dir=os.path.dirname(path) or None)
+        try:
+            with open(path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                src.seek(moov_offset)
+                atom = bytearray(src.read(moov_size))
+                # Data between the first mdat and the old moov moves down by moov_size
+                self._patch_offsets(atom, moov_header, moov_size, moov_size, moov_offset)
+                for kind, offset, _, size in layout:
+                    if offset == first_mdat[1]:
+                        dst.write(atom)
+                    if kind == b'moov':
+                        continue
+                    src.seek(offset)
+                    self._copy(src, dst, size)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return True
+
+    def _copy(self, src, dst, size: int, chunk: int = 1024 * 1024):
+        while size > 0:
+            data = src.read(min(chunk, size))
+            if not data:
+                break
+            dst.write(data)
+            size -= len(data)
+
+    def remux(self, path: str) -> bool:
+        """Stream-copy through ffmpeg with +faststart, replacing the file on success"""
+        fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(path)[1],
+                                        dir=os.path.dirname(path) or None)
+        os.close(fd)
+        result = governor.run([
+            'ffmpeg', '-v', 'error', '-y', '-i', path, '-map', '0', '-c', 'copy',
+            '-movflags', '+faststart', tmp_path
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, path)
+        return True
+
+    def finalize(self, path: str) -> Optional[str]:
+        """Ensure `path` streams from its first bytes; returns it, or None if it cannot"""
+        if self.is_streamable(path):
+            return path
+        try:
+            self.relocate(path)
+        except FaststartError:
+            self.remux(path)
+        return path if self.is_streamable(path) else None
+
+
+faststart = FaststartFinalizer()
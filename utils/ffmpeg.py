@@ -1,33 +1,67 @@
-import asyncio
 import os
 import json
 from typing import List, Dict, Any
-import ffmpeg
+from utils.governor import governor
+from utils.lazy import lazy_import
+from utils.metrics import metrics
+
+ffmpeg = lazy_import('ffmpeg')
+
+# Output format -> ffmpeg audio encoder
+AUDIO_CODECS = {
+    'mp3': 'libmp3lame',
+    'wav': 'pcm_s16le',
+    'flac': 'flac',
+    'aac': 'aac',
+    'm4a': 'aac',
+    'opus': 'libopus',
+    'ogg': 'libvorbis'
+}
+
+# Formats whose encoders ignore a target bitrate
+LOSSLESS_AUDIO_FORMATS = ('wav', 'flac')
+
+# Containers whose index (moov atom) can be moved to the front
+FASTSTART_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.m4a')
+
+SLOW_REVERB_FILTER = 'atempo=0.8,aecho=1.0:0.7:20:0.5'
+
+# Resolution ladder rungs by output height
+VIDEO_HEIGHTS = {'1080p': 1080, '720p': 720, '480p': 480, '360p': 360}
+
+# Container -> (muxer, video encoder, audio encoder); no encoders means the
+# streams are copied when no scaling is asked for
+VIDEO_FORMATS = {
+    'mp4': ('mp4', 'libx264', 'aac'),
+    'mkv': ('matroska', None, None),
+    'avi': ('avi', 'libx264', 'libmp3lame'),
+}
 
 class FFmpegHelper:
     @staticmethod
     async def run_command(cmd: List[str]) -> bool:
-        """Run FFmpeg command asynchronously"""
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        """Run FFmpeg command asynchronously, within the current job's resource budget"""
+        returncode, stderr = await governor.run_async(cmd)
         
-        stdout, stderr = await process.communicate()
-        
-        if process.returncode != 0:
+        if returncode != 0:
             print(f"FFmpeg error: {stderr.decode()}")
             return False
         return True
     
+    @staticmethod
+    def output(output_path: str) -> List[str]:
+        """Output arguments, writing the moov atom first for MP4/MOV outputs"""
+        if output_path.lower().endswith(FASTSTART_EXTENSIONS):
+            return ['-movflags', '+faststart', output_path]
+        return [output_path]
+    
     @staticmethod
     def remove_audio(input_path: str, output_path: str) -> List[str]:
         """Remove audio from video"""
         return [
             'ffmpeg', '-i', input_path,
             '-c', 'copy', '-an',
-            output_path
+            *FFmpegHelper.output(output_path)
         ]
     
     @staticmethod
@@ -49,11 +83,16 @@ class FFmpegHelper:
     
     @staticmethod
     def trim_video(input_path: str, output_path: str, start: str, end: str) -> List[str]:
-        """Trim video from start to end time"""
+        """Trim video from start to end time.
+        
+        Seeks on the input, so nothing before `start` is read, but stream copy
+        still starts at the keyframe before it; utils.keyframes.smart_cutter
+        cuts frame-accurately.
+        """
         return [
-            'ffmpeg', '-i', input_path,
-            '-ss', start, '-to', end,
-            '-c', 'copy', output_path
+            'ffmpeg', '-ss', start, '-to', end, '-i', input_path,
+            '-c', 'copy', '-avoid_negative_ts', 'make_zero',
+            *FFmpegHelper.output(output_path)
         ]
     
     @staticmethod
@@ -67,15 +106,32 @@ class FFmpegHelper:
         
         return [
             'ffmpeg', '-f', 'concat', '-safe', '0',
-            '-i', list_file, '-c', 'copy', output_path
+            '-i', list_file, '-c', 'copy',
+            *FFmpegHelper.output(output_path)
         ]
     
+    @staticmethod
+    def cut_segments(input_path: str, output_path: str, segments: List[tuple], copy: bool = True) -> List[str]:
+        """Join (start, end) segments of one input, stream-copied when possible"""
+        list_file = f"{output_path}_list.txt"
+        source = os.path.abspath(input_path)
+        with open(list_file, 'w') as f:
+            for start, end in segments:
+                f.write(f"file '{source}'\ninpoint {start:.3f}\noutpoint {end:.3f}\n")
+        
+        cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_file, '-vn']
+        if copy:
+            cmd.extend(['-c', 'copy'])
+        cmd.append(output_path)
+        return cmd
+    
     @staticmethod
     def mute_audio(input_path: str, output_path: str) -> List[str]:
         """Mute audio in video"""
         return [
             'ffmpeg', '-i', input_path,
-            '-an', '-c:v', 'copy', output_path
+            '-an', '-c:v', 'copy',
+            *FFmpegHelper.output(output_path)
         ]
     
     @staticmethod
@@ -84,7 +140,7 @@ class FFmpegHelper:
         return [
             'ffmpeg', '-i', video_path, '-i', audio_path,
             '-c', 'copy', '-map', '0:v:0', '-map', '1:a:0',
-            output_path
+            *FFmpegHelper.output(output_path)
         ]
     
     @staticmethod
@@ -94,17 +150,53 @@ class FFmpegHelper:
             'ffmpeg', '-i', input_path, '-i', subtitle_path,
             '-c', 'copy', '-c:s', 'mov_text',
             '-metadata:s:s:0', 'language=eng',
-            output_path
+            *FFmpegHelper.output(output_path)
         ]
     
     @staticmethod
-    def convert_to_gif(input_path: str, output_path: str, fps: int = 10) -> List[str]:
-        """Convert video to GIF"""
-        return [
-            'ffmpeg', '-i', input_path,
-            '-vf', f'fps={fps},scale=320:-1:flags=lanczos',
-            '-c:v', 'gif', output_path
-        ]
+    def _window(start: float = 0.0, duration: float = None) -> List[str]:
+        """Input options selecting [start, start + duration) of the next input"""
+        args = ['-ss', f'{start:.3f}'] if start else []
+        if duration:
+            args.extend(['-t', f'{duration:.3f}'])
+        return args
+    
+    @staticmethod
+    def generate_palette(input_path: str, palette_path: str, width: int = 160, fps: float = 2,
+                         max_colors: int = 256, start: float = 0.0, duration: float = None,
+                         keyframes_only: bool = False) -> List[str]:
+        """Compute a GIF palette from a low-rate, downscaled decode"""
+        cmd = ['ffmpeg', '-y', '-v', 'error']
+        if keyframes_only:
+            cmd.extend(['-skip_frame', 'nokey'])
+        cmd.extend(FFmpegHelper._window(start, duration))
+        cmd.extend([
+            '-i', input_path, '-an', '-sn',
+            '-vf', f'fps={fps},scale={width}:-2:flags=fast_bilinear,'
+                   f'palettegen=max_colors={max_colors}:stats_mode=full',
+            '-frames:v', '1', '-update', '1', palette_path
+        ])
+        return cmd
+    
+    @staticmethod
+    def convert_to_gif(input_path: str, output_path: str, fps: int = 10, width: int = 320,
+                       palette_path: str = None, start: float = 0.0,
+                       duration: float = None) -> List[str]:
+        """Convert video to GIF, mapped onto a palette.
+        
+        With `palette_path` the precomputed palette is applied; otherwise it
+        is generated from the same decode in one pass.
+        """
+        scale = f'fps={fps},scale={width}:-2:flags=lanczos'
+        use = 'paletteuse=dither=bayer:bayer_scale=5:diff_mode=rectangle'
+        cmd = ['ffmpeg', '-y'] + FFmpegHelper._window(start, duration) + ['-i', input_path]
+        if palette_path:
+            cmd.extend(['-i', palette_path,
+                        '-lavfi', f'[0:v]{scale}[x];[x][1:v]{use}'])
+        else:
+            cmd.extend(['-lavfi', f'[0:v]{scale},split[a][b];[a]palettegen[p];[b][p]{use}'])
+        cmd.extend(['-an', '-sn', '-loop', '0', output_path])
+        return cmd
     
     @staticmethod
     def split_video(input_path: str, output_pattern: str, segment_time: int) -> List[str]:
@@ -116,6 +208,58 @@ class FFmpegHelper:
             '-f', 'segment', output_pattern
         ]
     
+    @staticmethod
+    def multi_output_transcode(input_path: str, outputs: List[Dict[str, Any]], crf: int = 23) -> List[str]:
+        """Decode once and write several outputs from one process.
+        
+        Each output is a dict with "path", "format" (a VIDEO_FORMATS key) and
+        an optional "height" (never upscaled). Every distinct encode gets its
+        own branch of a split filter; outputs sharing an encode are written
+        through the tee muxer, and unscaled outputs of copy formats are
+        remuxed without encoding.
+        """
+        encodes: Dict[tuple, List[Dict[str, Any]]] = {}
+        copies = []
+        for output in outputs:
+            muxer, video_codec, audio_codec = VIDEO_FORMATS[output["format"]]
+            height = output.get("height")
+            if video_codec is None and height is None:
+                copies.append(output)
+                continue
+            key = (height, video_codec or 'libx264', audio_codec or 'aac')
+            encodes.setdefault(key, []).append(output)
+        
+        cmd = ['ffmpeg', '-y', '-i', input_path]
+        if encodes:
+            branches = [f'[0:v]split={len(encodes)}' + ''.join(f'[s{i}]' for i in range(len(encodes)))]
+            for i, (height, _, _) in enumerate(encodes):
+                scale = f"scale=w=-2:h='min(ih,{height})',setsar=1" if height else 'null'
+                branches.append(f'[s{i}]{scale}[v{i}]')
+            cmd.extend(['-filter_complex', ';'.join(branches)])
+        
+        for i, ((_, video_codec, audio_codec), group) in enumerate(encodes.items()):
+            cmd.extend(['-map', f'[v{i}]', '-map', '0:a?',
+                        '-c:v', video_codec, '-preset', 'veryfast', '-crf', str(crf),
+                        '-c:a', audio_codec])
+            if len(group) == 1:
+                muxer = VIDEO_FORMATS[group[0]["format"]][0]
+                if muxer == 'mp4':
+                    cmd.extend(['-movflags', '+faststart'])
+                cmd.extend(['-f', muxer, group[0]["path"]])
+            else:
+                slaves = []
+                for output in group:
+                    muxer = VIDEO_FORMATS[output["format"]][0]
+                    options = f'f={muxer}' + (':movflags=+faststart' if muxer == 'mp4' else '')
+                    slaves.append(f'[{options}]{output["path"]}')
+                cmd.extend(['-flags:v', '+global_header', '-flags:a', '+global_header',
+                            '-f', 'tee', '|'.join(slaves)])
+        
+        for output in copies:
+            cmd.extend(['-map', '0:v', '-map', '0:a?', '-c', 'copy',
+                        '-f', VIDEO_FORMATS[output["format"]][0], output["path"]])
+        return cmd
+    
     @staticmethod
     def take_screenshot(input_path: str, output_path: str, time: str) -> List[str]:
         """Take screenshot at specific time"""
@@ -126,23 +270,16 @@ class FFmpegHelper:
         ]
     
     @staticmethod
-    def convert_audio(input_path: str, output_path: str, format: str) -> List[str]:
-        """Convert audio to different format"""
-        codec_map = {
-            'mp3': 'libmp3lame',
-            'wav': 'pcm_s16le',
-            'flac': 'flac',
-            'aac': 'aac',
-            'm4a': 'aac',
-            'opus': 'libopus',
-            'ogg': 'libvorbis'
-        }
-        
-        return [
-            'ffmpeg', '-i', input_path,
-            '-c:a', codec_map.get(format, 'libmp3lame'),
-            output_path
+    def convert_audio(input_path: str, output_path: str, format: str, bitrate: str = None) -> List[str]:
+        """Convert audio to different format (streamed, cover art dropped)"""
+        cmd = [
+            'ffmpeg', '-i', input_path, '-vn',
+            '-c:a', AUDIO_CODECS.get(format, 'libmp3lame')
         ]
+        if bitrate and format not in LOSSLESS_AUDIO_FORMATS:
+            cmd.extend(['-b:a', bitrate])
+        cmd.append(output_path)
+        return cmd
     
     @staticmethod
     def optimize_video(input_path: str, output_path: str, quality: str = "medium") -> List[str]:
@@ -155,7 +292,8 @@ class FFmpegHelper:
         
         cmd = ['ffmpeg', '-i', input_path]
         cmd.extend(quality_presets.get(quality, ["-crf", "28"]))
-        cmd.extend(['-c:v', 'libx264', '-preset', 'medium', output_path])
+        cmd.extend(['-c:v', 'libx264', '-preset', 'medium'])
+        cmd.extend(FFmpegHelper.output(output_path))
         return cmd
     
     @staticmethod
@@ -195,11 +333,24 @@ class FFmpegHelper:
         ]
     
     @staticmethod
-    def create_8d_audio(input_path: str, output_path: str) -> List[str]:
+    def create_8d_audio(input_path: str, output_path: str, hz: float = 0.08, amount: float = 1.0) -> List[str]:
         """Create 8D audio effect"""
         return [
             'ffmpeg', '-i', input_path,
-            '-af', 'apulsator=hz=0.08',
+            '-af', f'apulsator=hz={hz}:amount={amount}',
+            output_path
+        ]
+    
+    @staticmethod
+    def apply_equalizer(input_path: str, output_path: str, bands: List[tuple]) -> List[str]:
+        """Apply (type, frequency, gain dB, Q) biquad bands with ffmpeg filters"""
+        filters = []
+        for kind, freq, gain, q in bands:
+            name = {'peak': 'equalizer', 'lowshelf': 'lowshelf', 'highshelf': 'highshelf'}[kind]
+            filters.append(f'{name}=f={freq}:t=q:w={q}:g={gain}')
+        return [
+            'ffmpeg', '-i', input_path,
+            '-af', ','.join(filters) or 'anull',
             output_path
         ]
     
@@ -208,15 +359,25 @@ class FFmpegHelper:
         """Apply slowed + reverb effect"""
         return [
             'ffmpeg', '-i', input_path,
-            '-af', 'atempo=0.8,aecho=1.0:0.7:20:0.5',
+            '-af', SLOW_REVERB_FILTER,
             output_path
         ]
     
+    @staticmethod
+    def get_duration(input_path: str) -> float:
+        """Get duration in seconds from container header metadata"""
+        try:
+            probe = ffmpeg.probe(input_path, show_entries='format=duration')
+            return float(probe['format']['duration'])
+        except Exception:
+            return 0.0
+    
     @staticmethod
     def get_media_info(input_path: str) -> Dict[str, Any]:
         """Get media information using ffprobe"""
         try:
-            probe = ffmpeg.probe(input_path)
+            with metrics.phase("probe"):
+                probe = ffmpeg.probe(input_path)
             return probe
         except Exception as e:
             return {"error": str(e)}
@@ -0,0 +1,266 @@
+import asyncio
+import contextvars
+import itertools
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from config import Config
+from utils.metrics import metrics
+
+# Lower goes first: finished results, then replies and status edits, then progress bars
+PRIORITIES = {"result": 0, "message": 1, "progress": 2}
+
+# Messages a chat may send at once before its rate applies
+CHAT_BURST = 3
+
+# Chat buckets kept before idle ones are dropped
+MAX_CHATS = 10000
+
+# Raw MTProto methods that send to or change a chat; everything else
+# (downloads, lookups) bypasses the gateway
+OUTBOUND_PREFIXES = ("Send", "Edit", "Forward")
+OUTBOUND_METHODS = ("SetBotCallbackAnswer", "DeleteMessages")
+
+_priority: contextvars.ContextVar = contextvars.ContextVar('telegram_priority', default="message")
+
+
+def flood_wait(error: Exception) -> Optional[float]:
+    """Seconds a FloodWait from Pyrogram, Telethon or python-telegram-bot asks for, else None"""
+    name = type(error).__name__
+    if name in ("FloodWait", "SlowmodeWait"):
+        value = error.value
+    elif name in ("FloodWaitError", "SlowModeWaitError"):
+        value = error.seconds
+    elif name == "RetryAfter":
+        value = error.retry_after
+    else:
+        return None
+    if isinstance(value, timedelta):
+        value = value.total_seconds()
+    return float(value)
+
+
+def peer_id(query) -> Optional[int]:
+    """Chat a raw Pyrogram request goes to, as a Bot API style id"""
+    peer = getattr(query, "peer", None) or getattr(query, "to_peer", None)
+    if hasattr(peer, "user_id"):
+        return peer.user_id
+    if hasattr(peer, "channel_id"):
+        return -1000000000000 - peer.channel_id
+    if hasattr(peer, "chat_id"):
+        return -peer.chat_id
+    return None
+
+
+class TokenBucket:
+    """`rate` requests a second with bursts of `burst`; a FloodWait pauses it"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Seconds until a request may go"""
+        paused = max(0.0, self.paused_until - now)
+        if self.rate <= 0:
+            return paused
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(paused, (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0)
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        return self.delay(now) <= 0 and self.tokens >= self.burst
+
+
+class Gateway:
+    """Every outbound Telegram request, in one queue per process.
+
+    Requests wait for a token from the bot-wide bucket
+    (TELEGRAM_GLOBAL_RATE a second) and from their chat's bucket
+    (TELEGRAM_CHAT_RATE a second in private chats, TELEGRAM_GROUP_RATE a
+    minute in groups). Waiting requests go in PRIORITIES order, then
+    first come first served; one chat running out of tokens doesn't hold
+    up the others. The priority comes from `priority()`, bound for
+    everything a block awaits, like the governor's budgets.
+
+    A FloodWait pauses the chat it came from (the whole bot when the
+    request had no chat) and the request is retried once the wait is
+    over, up to TELEGRAM_MAX_FLOOD_WAIT seconds and `retries` times.
+    Progress edits are best-effort: a newer edit of the same message
+    replaces a queued one, and none are sent into a paused chat.
+
+    Pyrogram clients are routed through it with `install`; bot.py plugs
+    it in as python-telegram-bot's rate limiter.
+
+    The limits are Telegram's, per bot token, while the buckets live in
+    one process. With the job queue, main.py and every worker send with
+    the same token, so they call `share` with the number of such
+    processes: each gets that fraction of the global rate. At most the
+    front-end and the workers running one user's jobs (PREMIUM_MAX_JOBS)
+    send to the same chat, so chat rates are split that many ways at most.
+    """
+
+    def __init__(self, global_rate: float = Config.TELEGRAM_GLOBAL_RATE,
+                 chat_rate: float = Config.TELEGRAM_CHAT_RATE,
+                 group_rate: float = Config.TELEGRAM_GROUP_RATE,
+                 max_flood_wait: float = Config.TELEGRAM_MAX_FLOOD_WAIT, retries: int = 3):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate / 60
+        self.processes = 1
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.max_flood_wait = max_flood_wait
+        self.retries = retries
+        self.chats: Dict[Any, TokenBucket] = {}
+        # [priority, sequence, chat, key, future]
+        self._pending: List[list] = []
+        self._sequence = itertools.count()
+        self._changed: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    @contextmanager
+    def priority(self, name: str):
+        """Send the requests made in this block at priority `name`"""
+        token = _priority.set(name)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+
+    def share(self, processes: int):
+        """Take this process's part of the limits when `processes` send with the bot token"""
+        self.processes = max(1, processes)
+        self.global_bucket.rate = self.global_rate / self.processes
+        self.global_bucket.burst = max(1.0, self.global_bucket.rate)
+        for chat, bucket in self.chats.items():
+            bucket.rate = self._chat_rate(chat)
+
+    def _chat_rate(self, chat) -> float:
+        # Groups have negative ids; channels may be addressed by @username
+        group = isinstance(chat, str) or chat < 0
+        senders = min(self.processes, 1 + Config.PREMIUM_MAX_JOBS)
+        return (self.group_rate if group else self.chat_rate) / senders
+
+    def bucket(self, chat) -> TokenBucket:
+        bucket = self.chats.get(chat)
+        if bucket is None:
+            if len(self.chats) >= MAX_CHATS:
+                now = time.monotonic()
+                for idle in [c for c, b in self.chats.items() if b.idle(now)]:
+                    del self.chats[idle]
+            bucket = self.chats[chat] = TokenBucket(self._chat_rate(chat), CHAT_BURST)
+        return bucket
+
+    def _delay(self, chat, now: float) -> float:
+        delay = self.global_bucket.delay(now)
+        if chat is not None:
+            delay = max(delay, self.bucket(chat).delay(now))
+        return delay
+
+    def paused(self, chat) -> bool:
+        now = time.monotonic()
+        if self.global_bucket.paused_until > now:
+            return True
+        return chat is not None and self.bucket(chat).paused_until > now
+
+    def pause(self, chat, seconds: float):
+        (self.global_bucket if chat is None else self.bucket(chat)).pause(seconds)
+
+    async def _acquire(self, chat, key, priority: str) -> bool:
+        """Wait for the request's turn; False if it is dropped instead"""
+        if priority == "progress":
+            if self.paused(chat):
+                return False
+            if key is not None:
+                for entry in self._pending:
+                    if entry[0] == PRIORITIES["progress"] and entry[3] == key and not entry[4].done():
+                        entry[4].set_result(False)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append([PRIORITIES[priority], next(self._sequence), chat, key, future])
+        if self._dispatcher is None or self._dispatcher.done():
+            self._changed = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        else:
+            self._changed.set()
+        return await future
+
+    async def _dispatch(self):
+        """Hand out tokens to waiting requests until none are left"""
+        while True:
+            self._pending = [entry for entry in self._pending if not entry[4].done()]
+            if not self._pending:
+                return
+            self._pending.sort(key=lambda entry: entry[:2])
+            now = time.monotonic()
+            wait = None
+            # A chat that has to wait keeps its later requests behind the first one
+            blocked = set()
+            for _, _, chat, _, future in self._pending:
+                if chat in blocked:
+                    continue
+                delay = self._delay(chat, now)
+                if delay <= 0:
+                    self.global_bucket.take()
+                    if chat is not None:
+                        self.bucket(chat).take()
+                    future.set_result(True)
+                else:
+                    blocked.add(chat)
+                    wait = delay if wait is None else min(wait, delay)
+            self._changed.clear()
+            if wait is not None:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def call(self, request: Callable[[], Awaitable], chat=None, method: str = "", key=None):
+        """Run `request()` once the global and `chat` limits allow, retrying through FloodWaits.
+
+        `key` identifies the message a progress edit is for. Returns None
+        without running the request when it is a dropped progress edit.
+        """
+        priority = _priority.get()
+        for attempt in itertools.count():
+            if not await self._acquire(chat, key, priority):
+                return None
+            try:
+                return await request()
+            except Exception as e:
+                seconds = flood_wait(e)
+                if seconds is None or seconds > self.max_flood_wait or attempt >= self.retries:
+                    raise
+                self.pause(chat, seconds)
+                metrics.flood_wait(method, seconds)
+
+    def install(self, client):
+        """Route a Pyrogram client's sends, edits and callback answers through the gateway.
+
+        Pyrogram still sleeps through FloodWaits up to its sleep_threshold
+        itself; longer ones reach the gateway.
+        """
+        invoke = client.invoke
+
+        async def gated(query, *args, **kwargs):
+            method = type(query).__name__
+            if not (method.startswith(OUTBOUND_PREFIXES) or method in OUTBOUND_METHODS):
+                return await invoke(query, *args, **kwargs)
+            chat = peer_id(query)
+            key = (chat, query.id) if method == "EditMessage" else None
+            return await self.call(lambda: invoke(query, *args, **kwargs), chat, method, key)
+
+        client.invoke = gated
+        return client
+
+
+gateway = Gateway()
@@ -0,0 +1,130 @@
+import hashlib
+import math
+import os
+import subprocess
+from typing import Any, Dict, List, Optional
+from utils.ffmpeg import FFmpegHelper
+from utils.metrics import metrics
+from utils.governor import governor
+
+GIF_MIN_FPS = 5
+GIF_MIN_WIDTH = 120
+# Windows longer than this take their palette from keyframes only
+KEYFRAME_PALETTE_AFTER = 30.0
+
+
+class GIFEngine:
+    """Two-pass palette GIF encoder.
+
+    The palette comes from a cheap decode (low frame rate, small frame,
+    keyframes only for long windows) and is cached on disk per input and
+    window, so re-rendering at another size reuses it. With a target size
+    the GIF is re-rendered with fewer frames, a narrower frame and, as a
+    last resort, a shorter clip until it fits.
+    """
+
+    def __init__(self, cache_dir: str = os.path.join('temp', 'gif_palettes'),
+                 palette_width: int = 160, palette_fps: float = 2,
+                 max_colors: int = 256, max_cached: int = 64):
+        self.cache_dir = cache_dir
+        self.palette_width = palette_width
+        self.palette_fps = palette_fps
+        self.max_colors = max_colors
+        self.max_cached = max_cached
+
+    def _run(self, cmd: List[str]):
+        result = governor.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(f"FFmpeg error: {result.stderr.decode(errors='replace')}")
+
+    def palette_key(self, input_path: str, start: float = 0.0, duration: float = None) -> str:
+        stat = os.stat(input_path)
+        identity = (f"{os.path.abspath(input_path)}:{stat.st_size}:{stat.st_mtime_ns}:"
+                    f"{start:.3f}:{duration or 0:.3f}:{self.max_colors}")
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    def palette(self, input_path: str, start: float = 0.0, duration: float = None) -> str:
+        """Path of the palette for this input and window, computing it once"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        palette_path = os.path.join(self.cache_dir, f"{self.palette_key(input_path, start, duration)}.png")
+        metrics.cache_lookup("gif_palettes", os.path.exists(palette_path))
+        if os.path.exists(palette_path):
+            os.utime(palette_path)  # keep recently used palettes out of eviction
+            return palette_path
+
+        partial = f"{palette_path}.{os.getpid()}.png"
+        self._run(FFmpegHelper.generate_palette(
+            input_path, partial, self.palette_width, self.palette_fps, self.max_colors,
+            start, duration,
+            keyframes_only=not duration or duration > KEYFRAME_PALETTE_AFTER
+        ))
+        os.replace(partial, palette_path)
+        self._evict()
+        return palette_path
+
+    def _evict(self):
+        entries = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                   if name.endswith('.png')]
+        if len(entries) <= self.max_cached:
+            return
+        entries.sort(key=os.path.getmtime)
+        for path in entries[:len(entries) - self.max_cached]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def render(self, input_path: str, output_path: str, fps: float, width: int,
+               start: float = 0.0, duration: float = None, palette_path: str = None) -> int:
+        """Encode one GIF with the cached palette and return its size in bytes"""
+        palette_path = palette_path or self.palette(input_path, start, duration)
+        self._run(FFmpegHelper.convert_to_gif(input_path, output_path, fps, width,
+                                              palette_path, start, duration))
+        return os.path.getsize(output_path)
+
+    @staticmethod
+    def shrink(fps: float, width: int, duration: Optional[float], ratio: float,
+               full_duration: float):
+        """Scale fps, width and duration so the frames x pixels budget falls by `ratio`.
+
+        GIF size grows roughly with fps * width^2 * duration. Frame rate and
+        width each take an equal share of the cut down to their floors; the
+        clip is shortened only for what remains.
+        """
+        share = ratio ** (1 / 3)
+        new_fps = max(GIF_MIN_FPS, min(fps, round(fps * share, 2)))
+        remaining = ratio / (new_fps / fps)
+        new_width = max(GIF_MIN_WIDTH, min(width, int(width * math.sqrt(remaining)) // 2 * 2))
+        remaining /= (new_width / width) ** 2
+        if remaining < 1:
+            duration = (duration or full_duration) * remaining
+        return new_fps, new_width, duration
+
+    def convert(self, input_path: str, output_path: str, fps: float = 10, width: int = 320,
+                start: float = 0.0, duration: float = None, target_size: int = None,
+                max_attempts: int = 4) -> Dict[str, Any]:
+        """Convert a video (window) to GIF, fitting under `target_size` bytes if given"""
+        # The palette of the requested window also covers any shorter clip
+        palette_path = self.palette(input_path, start, duration)
+        size = self.render(input_path, output_path, fps, width, start, duration, palette_path)
+        full_duration = None
+        attempts = 1
+        while target_size and size > target_size and attempts < max_attempts:
+            if full_duration is None:
+                full_duration = duration or max(FFmpegHelper.get_duration(input_path) - start, 1.0)
+            # Aim a little under the target; the size model is approximate
+            fps, width, duration = self.shrink(fps, width, duration, 0.9 * target_size / size,
+                                               full_duration)
+            size = self.render(input_path, output_path, fps, width, start, duration, palette_path)
+            attempts += 1
+        return {
+            "path": output_path,
+            "size": size,
+            "fps": fps,
+            "width": width,
+            "duration": duration,
+            "fits": not target_size or size <= target_size,
+        }
+
+
+gif_engine = GIFEngine()
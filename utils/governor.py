@@ -0,0 +1,188 @@
+import asyncio
+import contextvars
+import os
+import subprocess
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from config import Config
+from utils.lazy import lazy_import
+
+psutil = lazy_import('psutil')
+
+# Priority -> (nice increment, ionice class, ionice level); the classes are
+# Linux ioprio values: 2 best-effort (level 0 highest .. 7), 3 idle
+PRIORITIES: Dict[str, Tuple[int, int, int]] = {
+    "interactive": (0, 2, 2),
+    "normal": (5, 2, 4),
+    "batch": (10, 2, 7),
+}
+
+# Seconds between SIGTERM and SIGKILL when a timeout hits
+KILL_GRACE = 5.0
+
+MIN_MEMORY = 1024 * 1024 * 1024
+
+
+class JobBudget:
+    """What one job's ffmpeg children may use"""
+
+    def __init__(self, threads: int, priority: str, memory: Optional[int], timeout: Optional[float]):
+        self.threads = threads
+        self.priority = priority
+        self.memory = memory
+        self.timeout = timeout
+
+    def __repr__(self):
+        return (f"JobBudget(threads={self.threads}, priority={self.priority!r}, "
+                f"memory={self.memory}, timeout={self.timeout})")
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar('job_budget', default=None)
+
+
+class ResourceGovernor:
+    """Keep concurrent jobs' ffmpeg processes within a fair share of the machine.
+
+    The machine is split into `slots` equal shares (one per concurrent
+    job): each job gets cores / slots encoder and filter threads and
+    (memory * share) / slots of data segment (RLIMIT_DATA, so the virtual
+    reservations of codec libraries and thread stacks don't count).
+    Niceness and I/O class follow the job's priority, and every child is
+    stopped after `timeout` seconds, SIGTERM first so ffmpeg can close its
+    output, then SIGKILL.
+
+    The limits are applied to the started child through psutil rather
+    than a preexec_fn, which isn't safe in a process running threads.
+
+    The budget is bound to the running job with `job()`; it is held in a
+    context variable, so it follows the job into `asyncio.to_thread` and
+    tasks it creates, and concurrent jobs never see each other's budget.
+    A job that fans out into concurrent children divides its budget
+    between them with `split()`.
+    """
+
+    def __init__(self, slots: int = Config.WORKER_CONCURRENCY, cores: int = None,
+                 memory_share: float = 0.75, timeout: float = Config.FFMPEG_TIMEOUT):
+        self.slots = max(1, slots)
+        self.cores = cores or os.cpu_count() or 1
+        self.memory_share = memory_share
+        self.timeout = timeout or None
+
+    def budget(self, priority: str = "normal", timeout: float = None) -> JobBudget:
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        try:
+            memory = max(MIN_MEMORY, int(psutil.virtual_memory().total * self.memory_share / self.slots))
+        except Exception:
+            memory = None
+        return JobBudget(max(1, self.cores // self.slots), priority, memory, timeout or self.timeout)
+
+    @contextmanager
+    def job(self, priority: str = "normal", timeout: float = None) -> Iterator[JobBudget]:
+        """Bind a budget to everything the current job runs"""
+        token = _current.set(self.budget(priority, timeout))
+        try:
+            yield _current.get()
+        finally:
+            _current.reset(token)
+
+    @contextmanager
+    def split(self, parts: int) -> Iterator[JobBudget]:
+        """Divide the current budget's threads and memory between `parts` children run at once"""
+        budget = self.current()
+        parts = max(1, parts)
+        token = _current.set(JobBudget(
+            max(1, budget.threads // parts), budget.priority,
+            budget.memory // parts if budget.memory else None, budget.timeout
+        ))
+        try:
+            yield _current.get()
+        finally:
+            _current.reset(token)
+
+    def current(self) -> JobBudget:
+        return _current.get() or self.budget()
+
+    def command(self, cmd: List[str], budget: JobBudget = None) -> List[str]:
+        """`cmd` with the budget's thread limits, for ffmpeg commands"""
+        if not cmd or os.path.basename(cmd[0]) != 'ffmpeg' or '-threads' in cmd:
+            return cmd
+        threads = str((budget or self.current()).threads)
+        # Global filter options first; -threads before the last output
+        return ([cmd[0], '-filter_threads', threads, '-filter_complex_threads', threads]
+                + cmd[1:-1] + ['-threads', threads, cmd[-1]])
+
+    def limit(self, pid: int, budget: JobBudget = None):
+        """Apply niceness, the memory ceiling and the I/O class to a started child"""
+        budget = budget or self.current()
+        nice, io_class, io_level = PRIORITIES[budget.priority]
+        try:
+            process = psutil.Process(pid)
+            if nice:
+                # The child starts at our niceness; the increment is relative to it
+                process.nice(min(19, process.nice() + nice))
+            if budget.memory and hasattr(process, 'rlimit'):
+                process.rlimit(psutil.RLIMIT_DATA, (budget.memory, budget.memory))
+            if hasattr(process, 'ionice'):
+                process.ionice(io_class, io_level if io_class == 2 else None)
+        except Exception:
+            # The child may already have exited, or a limit is unsupported here
+            pass
+
+    def _watchdog(self, process: subprocess.Popen, timeout: float):
+        def watch():
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                process.terminate()
+                try:
+                    process.wait(KILL_GRACE)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+        threading.Thread(target=watch, daemon=True).start()
+
+    def popen(self, cmd: List[str], **kwargs) -> subprocess.Popen:
+        """Start a governed child; it is stopped once the job's timeout passes"""
+        budget = self.current()
+        process = subprocess.Popen(self.command(cmd, budget), **kwargs)
+        self.limit(process.pid, budget)
+        if budget.timeout:
+            self._watchdog(process, budget.timeout)
+        return process
+
+    def run(self, cmd: List[str], **kwargs) -> subprocess.CompletedProcess:
+        """subprocess.run for a governed child; a timed-out child returns its kill status"""
+        with self.popen(cmd, **kwargs) as process:
+            stdout, stderr = process.communicate()
+        return subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+
+    async def run_async(self, cmd: List[str]) -> Tuple[int, bytes]:
+        """(return code, stderr) of a governed child run from the event loop"""
+        budget = self.current()
+        process = await asyncio.create_subprocess_exec(
+            *self.command(cmd, budget),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        self.limit(process.pid, budget)
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), budget.timeout)
+        except asyncio.TimeoutError:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), KILL_GRACE)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+            return process.returncode, f"Timed out after {budget.timeout:.0f}s".encode()
+        except asyncio.CancelledError:
+            # Nobody wants the output any more; don't leave ffmpeg running
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        return process.returncode, stderr
+
+
+governor = ResourceGovernor()
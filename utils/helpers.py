@@ -1,14 +1,18 @@
 import os
 import re
-import aiofiles
-import aiohttp
 import mimetypes
-from typing import Optional, Tuple
-from pyrogram.types import Message
+from typing import TYPE_CHECKING, Optional, Tuple
+from utils.lazy import lazy_import
+
+if TYPE_CHECKING:
+    from pyrogram.types import Message
+
+aiofiles = lazy_import('aiofiles')
+aiohttp = lazy_import('aiohttp')
 
 class Helpers:
     @staticmethod
-    async def download_file(client, message: Message, file_type: str = "video") -> Tuple[bool, str]:
+    async def download_file(client, message: "Message", file_type: str = "video") -> Tuple[bool, str]:
         """Download file from Telegram"""
         try:
             user_id = message.from_user.id
@@ -97,6 +101,55 @@ class Helpers:
         seconds = seconds % 60
         return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
     
+    @staticmethod
+    def format_media_info(info: dict, file_name: str = None) -> str:
+        """Describe ffprobe output: container, duration, bitrate and every stream"""
+        if "error" in info:
+            return f"❌ Could not read media info: {info['error']}"
+        fmt = info.get("format", {})
+        lines = ["📊 **Media Information**", ""]
+        if file_name:
+            lines.append(f"📁 File: `{file_name}`")
+        if fmt.get("size"):
+            lines.append(f"💾 Size: {Helpers.format_file_size(int(fmt['size']))}")
+        if fmt.get("duration"):
+            lines.append(f"⏱️ Duration: {Helpers.format_duration(int(float(fmt['duration'])))}")
+        if fmt.get("format_long_name") or fmt.get("format_name"):
+            lines.append(f"📦 Container: {fmt.get('format_long_name') or fmt['format_name']}")
+        if fmt.get("bit_rate"):
+            lines.append(f"🚀 Bitrate: {int(fmt['bit_rate']) // 1000} kbps")
+        
+        for stream in info.get("streams", []):
+            kind = stream.get("codec_type")
+            details = [stream.get("codec_name", "unknown")]
+            if stream.get("profile"):
+                details[0] += f" ({stream['profile']})"
+            if kind == "video":
+                icon = "🖼️ Cover" if stream.get("disposition", {}).get("attached_pic") else "🎬 Video"
+                details.append(f"{stream.get('width')}x{stream.get('height')}")
+                num, _, den = stream.get("avg_frame_rate", "0/0").partition("/")
+                if den and int(den):
+                    details.append(f"{int(num) / int(den):.2f}".rstrip("0").rstrip(".") + " fps")
+                if stream.get("pix_fmt"):
+                    details.append(stream["pix_fmt"])
+            elif kind == "audio":
+                icon = "🎵 Audio"
+                if stream.get("sample_rate"):
+                    details.append(f"{stream['sample_rate']} Hz")
+                if stream.get("channel_layout") or stream.get("channels"):
+                    details.append(str(stream.get("channel_layout") or f"{stream['channels']} ch"))
+            elif kind == "subtitle":
+                icon = "📜 Subtitle"
+            else:
+                icon = f"📎 {(kind or 'data').capitalize()}"
+            if stream.get("bit_rate"):
+                details.append(f"{int(stream['bit_rate']) // 1000} kbps")
+            language = stream.get("tags", {}).get("language")
+            if language and language != "und":
+                details.append(f"[{language}]")
+            lines.append(f"{icon}: {', '.join(details)}")
+        return "\n".join(lines)
+    
     @staticmethod
     async def download_url(url: str, output_path: str) -> bool:
         """Download file from URL"""
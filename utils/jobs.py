@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from pyrogram.types import Message
+from config import Config
+from utils.database import db
+from utils.gateway import gateway
+from utils.media import LazyMedia
+from utils.scheduler import QueuedJob, scheduler
+from utils.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Claims to try when other workers take the scheduler's pick first
+CLAIM_ATTEMPTS = 3
+
+
+class JobQueue:
+    """Operations handed from the update front-end to worker processes.
+
+    A job carries everything a stateless worker on any node needs: the
+    Telegram file_id and metadata of the input (workers download it
+    themselves) and the chat and status message to report on. Jobs live
+    in the `jobs` collection; workers claim them with an atomic
+    find-and-modify and hold a lease that they keep renewing, so a job
+    whose worker died is claimed again once its lease runs out.
+    """
+
+    def __init__(self, enabled: bool = Config.JOB_QUEUE):
+        self.enabled = enabled
+
+    async def submit(self, user_id: int, operation: str, media: LazyMedia, status: Message,
+                     estimated_seconds: float = 0.0) -> str:
+        return await db.create_job(user_id, operation, media.file_id, payload={
+            "media": media.metadata,
+            "chat_id": status.chat.id,
+            "status_message_id": status.id,
+            "estimated_seconds": estimated_seconds,
+        })
+
+    async def run_inline(self, runner, client, status: Message, user_id: int, media: LazyMedia,
+                         operation: str, queue_wait: float = 0.0):
+        """Run a job in this process, keeping a record of it and its trace"""
+        with tracer.job(operation, media.duration, queue_wait) as trace:
+            outcome = "failed"
+            try:
+                await runner(client, status, user_id, media, operation)
+                outcome = "completed"
+            finally:
+                # A failed write must not replace the job's own outcome or error
+                try:
+                    await db.record_job(user_id, operation, outcome, trace.document())
+                except Exception as e:
+                    logger.warning(f"Could not record {operation} job for {user_id}: {e}")
+
+    async def claim(self, worker_id: str, job_types: List[str] = None) -> Optional[Dict[str, Any]]:
+        """Take the next job for a worker slot.
+
+        Jobs whose worker died come first, as they have waited longest.
+        Otherwise the fair scheduler chooses among the queued jobs, with
+        the jobs each user is running on any worker and their plan. Each
+        worker keeps its own turns and deficits.
+        """
+        job = await db.claim_job(worker_id, job_types=job_types, expired_only=True)
+        if job is not None:
+            return job
+        queued = await db.queued_jobs(job_types)
+        if not queued:
+            return None
+        running = await db.running_jobs_per_user()
+        premium = await db.premium_users({job["user_id"] for job in queued})
+        now, utcnow = time.time(), datetime.utcnow()
+        candidates = [
+            QueuedJob(job["user_id"], job.get("payload", {}).get("estimated_seconds", 0),
+                      now - (utcnow - job.get("queued_at", utcnow)).total_seconds(),
+                      job["user_id"] in premium, job["_id"])
+            for job in queued
+        ]
+        for _ in range(CLAIM_ATTEMPTS):
+            pick = scheduler.pick(candidates, running)
+            if pick is None:
+                return None
+            job = await db.claim_job(worker_id, job_types=job_types, job_id=pick.ref)
+            if job is not None:
+                return job
+            scheduler.refund(pick)
+            candidates.remove(pick)
+        return None
+
+    async def share_limits(self):
+        """Keep this process's share of the Telegram rate limits in step with the live workers"""
+        while True:
+            try:
+                # The workers, plus main.py as the front-end
+                gateway.share(len(await db.live_workers()) + 1)
+            except Exception as e:
+                logger.warning(f"Could not count live workers: {e}")
+            await asyncio.sleep(Config.JOB_LEASE_SECONDS / 3)
+
+    @staticmethod
+    def media(job: Dict[str, Any]) -> LazyMedia:
+        return LazyMedia(job["file_id"], **job["payload"]["media"])
+
+    @staticmethod
+    async def status(client, job: Dict[str, Any]) -> Message:
+        """The message the front-end left for progress and errors"""
+        payload = job["payload"]
+        return await client.get_messages(payload["chat_id"], payload["status_message_id"])
+
+
+job_queue = JobQueue()
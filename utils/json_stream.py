@@ -0,0 +1,252 @@
+import re
+from typing import Optional
+
+# Whitespace followed by one complete JSON token
+_TOKEN_RE = re.compile(
+    r'[ \t\n\r]*(?:'
+    r'("(?:[^"\\\x00-\x1f]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*")'
+    r'|([{}\[\],:])'
+    r'|(-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?)'
+    r'|(true|false|null)'
+    r')'
+)
+_WS_RE = re.compile(r'[ \t\n\r]*')
+# Longest valid prefix of a string token, used to locate string errors
+_STRING_PREFIX_RE = re.compile(r'"(?:[^"\\\x00-\x1f]+|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*')
+# Valid string contents, to resume scanning a string cut at a chunk boundary
+_STRING_BODY_RE = re.compile(r'(?:[^"\\\x00-\x1f]+|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*')
+# What a cut string may end with: nothing yet, or the start of an escape
+_PARTIAL_ESCAPE_RE = re.compile(r'(?:\\(?:u[0-9a-fA-F]{0,3})?)?')
+# What a cut number or literal may end with (an empty tail is whitespace)
+_PARTIAL_SCALAR_RE = re.compile(
+    r'-?[0-9]*(?:\.[0-9]*)?(?:[eE][-+]?[0-9]*)?|t(?:ru?)?|f(?:a(?:ls?)?)?|n(?:ul?)?'
+)
+
+# Parser states
+_VALUE = 0            # expecting a value
+_VALUE_OR_CLOSE = 1   # just after '['
+_KEY_OR_CLOSE = 2     # just after '{'
+_KEY = 3              # after ',' inside an object
+_COLON = 4            # after an object key
+_COMMA_OR_CLOSE = 5   # after a value inside a container
+_DONE = 6             # top-level value complete
+
+_EXPECTING = {
+    _VALUE: "Expecting value",
+    _VALUE_OR_CLOSE: "Expecting value",
+    _KEY_OR_CLOSE: "Expecting property name enclosed in double quotes",
+    _KEY: "Expecting property name enclosed in double quotes",
+    _COLON: "Expecting ':' delimiter",
+    _COMMA_OR_CLOSE: "Expecting ',' delimiter",
+    _DONE: "Extra data",
+}
+
+
+class JSONStreamError(ValueError):
+    """Invalid JSON, with the character offset of the first bad character"""
+
+    def __init__(self, msg: str, pos: int, lineno: int, colno: int):
+        super().__init__(f"{msg}: line {lineno} column {colno} (char {pos})")
+        self.msg = msg
+        self.pos = pos
+        self.lineno = lineno
+        self.colno = colno
+
+
+class JSONStreamFormatter:
+    """Re-indent, minify or validate JSON files in constant memory.
+
+    The input is scanned token by token from fixed-size chunks and the
+    output is written as it is produced, so memory use is bounded by the
+    chunk size plus the longest single token instead of the document size.
+    Tokens are copied verbatim; only the whitespace between them changes.
+    More input is read only while the unmatched tail can still become a
+    token, so invalid input fails at the first bad character, and a long
+    string is scanned once rather than from its quote on every chunk.
+    """
+
+    def __init__(self, chunk_size: int = 1024 * 1024, flush_size: int = 4096):
+        self.chunk_size = chunk_size
+        self.flush_size = flush_size
+
+    def format_file(self, input_path: str, output_path: str, indent: int = 4,
+                    minify: bool = False) -> str:
+        """Reformat a JSON file, pretty-printed or minified"""
+        with open(input_path, 'r', encoding='utf-8') as src, \
+                open(output_path, 'w', encoding='utf-8') as dst:
+            self._scan(src, dst, None if minify else indent)
+        return output_path
+
+    def minify_file(self, input_path: str, output_path: str) -> str:
+        """Strip all insignificant whitespace from a JSON file"""
+        return self.format_file(input_path, output_path, minify=True)
+
+    def validate_file(self, input_path: str) -> Optional[JSONStreamError]:
+        """Validate a JSON file, returning the error or None if it is valid"""
+        try:
+            with open(input_path, 'r', encoding='utf-8') as src:
+                self._scan(src, None, None)
+        except JSONStreamError as e:
+            return e
+        return None
+
+    def _scan(self, src, dst, indent: Optional[int]):
+        read = src.read
+        chunk_size = self.chunk_size
+        flush_size = self.flush_size
+        match_token = _TOKEN_RE.match
+
+        buf = read(chunk_size)
+        eof = not buf
+        pos = 0
+        base = 0        # absolute offset of buf[0]
+        base_line = 1   # line number at buf[0]
+        base_line_start = 0  # absolute offset where that line starts
+
+        out = []
+        write = out.append
+        stack = []
+        state = _VALUE
+        fresh = False   # container just opened, nothing written inside yet
+        newlines = ['\n']
+        resume = 0      # where scanning goes on in a string cut at the chunk end
+
+        def error(msg, at):
+            head = buf[:at]
+            lineno = base_line + head.count('\n')
+            nl = head.rfind('\n')
+            line_start = base + nl + 1 if nl >= 0 else base_line_start
+            raise JSONStreamError(msg, base + at, lineno, base + at - line_start + 1)
+
+        while True:
+            m = None
+            closed = False
+            if resume:
+                resume = _STRING_BODY_RE.match(buf, resume).end()
+                closed = buf.startswith('"', resume)
+            else:
+                m = match_token(buf, pos)
+            # Keep two characters of lookahead so a number cut at the chunk
+            # boundary ("1." / "1e+") is never taken for a complete token
+            if not closed and (m is None or (not eof and m.end() + 2 >= len(buf))):
+                more = not eof
+                if more and m is None:
+                    # Only a cut token is worth reading on for; anything
+                    # else is an error here, not after the rest of the file
+                    if resume:
+                        more = _PARTIAL_ESCAPE_RE.fullmatch(buf, resume) is not None
+                    else:
+                        at = _WS_RE.match(buf, pos).end()
+                        if buf.startswith('"', at):
+                            end = _STRING_PREFIX_RE.match(buf, at).end()
+                            more = _PARTIAL_ESCAPE_RE.fullmatch(buf, end) is not None
+                            if more:
+                                resume = end
+                        else:
+                            more = _PARTIAL_SCALAR_RE.fullmatch(buf, at) is not None
+                if more:
+                    # Drop consumed text and pull in the next chunk
+                    consumed = buf[:pos]
+                    nl_count = consumed.count('\n')
+                    if nl_count:
+                        base_line += nl_count
+                        base_line_start = base + consumed.rfind('\n') + 1
+                    base += pos
+                    chunk = read(chunk_size)
+                    eof = not chunk
+                    buf = buf[pos:] + chunk
+                    if resume:
+                        resume -= pos
+                    pos = 0
+                    continue
+
+                at = _WS_RE.match(buf, pos).end()
+                if at == len(buf):
+                    if state == _DONE:
+                        break
+                    error(_EXPECTING[state], at)
+                if state == _DONE:
+                    error("Extra data", at)
+                if buf[at] == '"':
+                    end = _STRING_PREFIX_RE.match(buf, at).end()
+                    if end == len(buf):
+                        error("Unterminated string starting at", at)
+                    if buf[end] == '\\':
+                        if buf[end + 1:end + 2] == 'u':
+                            error("Invalid \\uXXXX escape", end + 1)
+                        error("Invalid \\escape", end)
+                    error("Invalid control character at", end)
+                error(_EXPECTING[state], at)
+
+            if closed:
+                # The cut string ends here; take it without rescanning from its quote
+                start = _WS_RE.match(buf, pos).end()
+                pos, resume = resume + 1, 0
+                string, punct, number, literal = buf[start:pos], None, None, None
+            else:
+                pos = m.end()
+                string, punct, number, literal = m.groups()
+
+            if punct is None:
+                # Scalar value or object key
+                token = string or number or literal
+                if state == _KEY_OR_CLOSE or state == _KEY:
+                    if string is None:
+                        error(_EXPECTING[state], pos - len(token))
+                    next_state = _COLON
+                elif state == _VALUE or state == _VALUE_OR_CLOSE:
+                    next_state = _COMMA_OR_CLOSE if stack else _DONE
+                else:
+                    error(_EXPECTING[state], pos - len(token))
+                if fresh:
+                    write(newlines[len(stack)])
+                    fresh = False
+                write(token)
+                state = next_state
+            else:
+                at = pos - 1
+                if punct == '{' or punct == '[':
+                    if state != _VALUE and state != _VALUE_OR_CLOSE:
+                        error(_EXPECTING[state], at)
+                    if fresh:
+                        write(newlines[len(stack)])
+                    stack.append(punct)
+                    write(punct)
+                    state = _KEY_OR_CLOSE if punct == '{' else _VALUE_OR_CLOSE
+                    if indent is not None:
+                        fresh = True
+                        if len(newlines) <= len(stack):
+                            newlines.append('\n' + ' ' * (indent * len(stack)))
+                elif punct == '}' or punct == ']':
+                    opener = '{' if punct == '}' else '['
+                    if not stack or stack[-1] != opener or state not in (
+                            _COMMA_OR_CLOSE, _KEY_OR_CLOSE if opener == '{' else _VALUE_OR_CLOSE):
+                        error(_EXPECTING[state], at)
+                    stack.pop()
+                    if fresh:
+                        fresh = False
+                    elif indent is not None:
+                        write(newlines[len(stack)])
+                    write(punct)
+                    state = _COMMA_OR_CLOSE if stack else _DONE
+                elif punct == ',':
+                    if state != _COMMA_OR_CLOSE:
+                        error(_EXPECTING[state], at)
+                    write(',' if indent is None else ',' + newlines[len(stack)])
+                    state = _KEY if stack[-1] == '{' else _VALUE
+                else:
+                    if state != _COLON:
+                        error(_EXPECTING[state], at)
+                    write(':' if indent is None else ': ')
+                    state = _VALUE
+
+            if len(out) >= flush_size:
+                if dst is not None:
+                    dst.write(''.join(out))
+                out.clear()
+
+        if dst is not None and out:
+            dst.write(''.join(out))
+
+
+json_formatter = JSONStreamFormatter()
@@ -0,0 +1,265 @@
+import bisect
+import os
+import shutil
+import subprocess
+import tempfile
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from utils.ffmpeg import FFmpegHelper
+from utils.metrics import metrics
+from utils.governor import governor
+
+# Source codec -> encoder producing a stream that can be concatenated with it
+SMART_CUT_ENCODERS = {
+    'h264': 'libx264',
+    'hevc': 'libx265',
+}
+
+# ffprobe prints times with 6 decimals; seek a hair past a keyframe so
+# rounding never lands on the previous one
+SEEK_EPSILON = 1e-5
+
+
+class KeyframeIndex:
+    """Keyframe times of a video's first stream, with the bytes (all streams)
+    and video frames in each GOP. `gop_sizes[i]` and `gop_frames[i]` cover
+    [times[i], times[i + 1])."""
+
+    def __init__(self, times: List[float], gop_sizes: List[int], gop_frames: List[int],
+                 duration: float):
+        self.times = times
+        self.gop_sizes = gop_sizes
+        self.gop_frames = gop_frames
+        self.duration = duration
+
+    def at_or_before(self, t: float) -> Optional[float]:
+        i = bisect.bisect_right(self.times, t + SEEK_EPSILON) - 1
+        return self.times[i] if i >= 0 else None
+
+    def at_or_after(self, t: float) -> Optional[float]:
+        i = bisect.bisect_left(self.times, t - SEEK_EPSILON)
+        return self.times[i] if i < len(self.times) else None
+
+    def frames_between(self, start: float, end: float) -> int:
+        """Video frames in the whole GOPs from keyframe `start` up to keyframe `end`"""
+        first = bisect.bisect_left(self.times, start - SEEK_EPSILON)
+        last = bisect.bisect_left(self.times, end - SEEK_EPSILON)
+        return sum(self.gop_frames[first:last])
+
+    def gops(self) -> List[Tuple[float, float, int]]:
+        """(start, end, bytes) of every GOP"""
+        ends = self.times[1:] + [self.duration]
+        return list(zip(self.times, ends, self.gop_sizes))
+
+    def split_points(self, segment_time: float) -> List[float]:
+        """Keyframes closest to every multiple of `segment_time`"""
+        points = []
+        target = segment_time
+        while target < self.duration:
+            i = bisect.bisect_left(self.times, target)
+            candidates = self.times[max(0, i - 1):i + 1]
+            point = min(candidates, key=lambda k: abs(k - target)) if candidates else None
+            if point and (not points or point > points[-1]):
+                points.append(point)
+            target += segment_time
+        return points
+
+
+class KeyframeIndexer:
+    """Builds keyframe indexes from ffprobe packet data, once per input.
+
+    Only packet headers are read (no decoding), streamed line by line, and
+    the result is cached keyed by the input's path, size and mtime so every
+    trim, sample and split of the same upload shares one probe.
+    """
+
+    def __init__(self, max_cached: int = 32):
+        self.max_cached = max_cached
+        self._cache: "OrderedDict[tuple, KeyframeIndex]" = OrderedDict()
+
+    def probe_command(self, input_path: str) -> List[str]:
+        return [
+            'ffprobe', '-v', 'error',
+            '-show_entries', 'packet=codec_type,stream_index,pts_time,dts_time,duration_time,size,flags',
+            '-of', 'compact=p=0', input_path
+        ]
+
+    def build(self, input_path: str) -> KeyframeIndex:
+        times: List[float] = []
+        gop_sizes: List[int] = [0]
+        gop_frames: List[int] = [0]
+        video_stream = None
+        duration = 0.0
+
+        process = subprocess.Popen(self.probe_command(input_path), stdout=subprocess.PIPE, text=True)
+        try:
+            for line in process.stdout:
+                packet: Dict[str, str] = dict(
+                    field.split('=', 1) for field in line.strip().split('|') if '=' in field
+                )
+                t = packet.get('pts_time', 'N/A')
+                if t == 'N/A':
+                    t = packet.get('dts_time', 'N/A')
+                if t == 'N/A':
+                    continue
+                t = float(t)
+                size = int(packet.get('size', 0) or 0)
+                length = packet.get('duration_time', 'N/A')
+                duration = max(duration, t + (float(length) if length != 'N/A' else 0.0))
+
+                if packet.get('codec_type') == 'video':
+                    if video_stream is None:
+                        video_stream = packet.get('stream_index')
+                    if (packet.get('stream_index') == video_stream
+                            and packet.get('flags', '').startswith('K')
+                            and (not times or t > times[-1])):
+                        if times:
+                            gop_sizes.append(0)
+                            gop_frames.append(0)
+                        times.append(t)
+                # Packets are roughly in time order; reordered ones go back
+                # to the GOP they belong to
+                gop = bisect.bisect_right(times, t) - 1 if times and t < times[-1] else len(gop_sizes) - 1
+                gop_sizes[max(gop, 0)] += size
+                if packet.get('stream_index') == video_stream:
+                    gop_frames[max(gop, 0)] += 1
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            raise RuntimeError(f"Keyframe probe failed for {input_path}")
+        count = len(times)
+        return KeyframeIndex(times, gop_sizes[:count], gop_frames[:count], duration)
+
+    def get(self, input_path: str) -> KeyframeIndex:
+        stat = os.stat(input_path)
+        key = (os.path.abspath(input_path), stat.st_size, stat.st_mtime_ns)
+        index = self._cache.get(key)
+        metrics.cache_lookup("keyframes", index is not None)
+        if index is None:
+            with metrics.phase("probe"):
+                index = self.build(input_path)
+            self._cache[key] = index
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return index
+
+
+keyframe_indexer = KeyframeIndexer()
+
+
+class SmartCutter:
+    """Frame-accurate trims that re-encode only the partial GOPs at each end.
+
+    Whole GOPs between the first keyframe at or after the start and the
+    last keyframe at or before the end are stream-copied; the head and tail
+    are re-encoded with an encoder matching the source codec. The copied
+    run is cut by frame count, since a closed GOP's frames all precede the
+    next keyframe in decode order while a time limit would let reordered
+    frames through. The concat demuxer joins the pieces, moving each one's
+    parameter sets in-band, and the audio of the range is stream-copied
+    alongside.
+    """
+
+    def __init__(self, indexer: KeyframeIndexer = keyframe_indexer,
+                 crf: int = 18, preset: str = 'veryfast'):
+        self.indexer = indexer
+        self.crf = crf
+        self.preset = preset
+
+    def _run(self, cmd: List[str]):
+        result = governor.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(f"FFmpeg error: {result.stderr.decode(errors='replace')}")
+
+    @staticmethod
+    def plan(index: KeyframeIndex, start: float, end: float) -> List[Tuple[float, float, bool]]:
+        """(start, end, copy) pieces covering [start, end)"""
+        first = index.at_or_after(start)
+        # Up to the end of the file the last GOP is whole too
+        last = index.duration if end >= index.duration - SEEK_EPSILON else index.at_or_before(end)
+        if first is None or last is None or first >= last:
+            return [(start, end, False)]
+        pieces = []
+        if first - start > SEEK_EPSILON:
+            pieces.append((start, first, False))
+        pieces.append((first, last, True))
+        if end - last > SEEK_EPSILON:
+            pieces.append((last, end, False))
+        return pieces
+
+    def piece_command(self, input_path: str, output_path: str, start: float, end: float,
+                      copy: bool, video: Dict, index: KeyframeIndex) -> List[str]:
+        if copy:
+            cmd = ['ffmpeg', '-v', 'error', '-y',
+                   '-ss', f'{start + SEEK_EPSILON:.6f}', '-i', input_path,
+                   '-map', '0:v:0', '-frames:v', str(index.frames_between(start, end)),
+                   '-c:v', 'copy']
+        else:
+            cmd = ['ffmpeg', '-v', 'error', '-y',
+                   '-ss', f'{start:.6f}', '-i', input_path, '-t', f'{end - start:.6f}',
+                   '-map', '0:v:0', '-c:v', SMART_CUT_ENCODERS[video['codec_name']],
+                   '-preset', self.preset, '-crf', str(self.crf)]
+            if video.get('pix_fmt'):
+                cmd.extend(['-pix_fmt', video['pix_fmt']])
+        cmd.extend(['-an', '-sn', '-dn', '-f', 'matroska', output_path])
+        return cmd
+
+    def trim(self, input_path: str, output_path: str, start: float, end: float) -> str:
+        """Cut [start, end) seconds, frame-accurately"""
+        info = FFmpegHelper.get_media_info(input_path)
+        video = next((stream for stream in info.get("streams", [])
+                      if stream.get("codec_type") == "video"), None)
+        index = self.indexer.get(input_path) if video else None
+        if not video or video.get('codec_name') not in SMART_CUT_ENCODERS or not index.times:
+            # Nothing to stream-copy safely; re-encode the range
+            self._run(['ffmpeg', '-v', 'error', '-y', '-ss', f'{start:.6f}', '-i', input_path,
+                       '-t', f'{end - start:.6f}', '-map', '0:v:0?', '-map', '0:a?',
+                       *FFmpegHelper.output(output_path)])
+            return output_path
+
+        work_dir = tempfile.mkdtemp(prefix='smartcut_', dir=os.path.dirname(output_path) or None)
+        try:
+            list_file = os.path.join(work_dir, 'list.txt')
+            with open(list_file, 'w') as f:
+                for i, (piece_start, piece_end, copy) in enumerate(self.plan(index, start, end)):
+                    piece = os.path.join(work_dir, f'{i}.mkv')
+                    self._run(self.piece_command(input_path, piece, piece_start, piece_end,
+                                                 copy, video, index))
+                    f.write(f"file '{os.path.abspath(piece)}'\n")
+            self._run([
+                'ffmpeg', '-v', 'error', '-y',
+                '-f', 'concat', '-safe', '0', '-i', list_file,
+                '-ss', f'{start:.6f}', '-t', f'{end - start:.6f}', '-i', input_path,
+                '-map', '0:v', '-map', '1:a?', '-c', 'copy',
+                '-movflags', '+faststart', output_path
+            ])
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return output_path
+
+    def sample(self, input_path: str, output_path: str, length: float = 30.0,
+               position: float = 0.3) -> str:
+        """Stream-copy a clip of about `length` seconds from `position` into the video.
+
+        A sample has no exact bounds, so both ends snap to keyframes and
+        nothing is re-encoded.
+        """
+        index = self.indexer.get(input_path)
+        if not index.times:
+            raise RuntimeError("No keyframes found; is this a video?")
+        start = index.at_or_before(max(0.0, index.duration - length) * position) or index.times[0]
+        end = index.at_or_after(start + length) or index.duration
+        self._run([
+            'ffmpeg', '-v', 'error', '-y',
+            '-ss', f'{start + SEEK_EPSILON:.6f}', '-i', input_path,
+            '-t', f'{end - start:.6f}', '-map', '0:v:0', '-map', '0:a?',
+            '-c', 'copy', '-avoid_negative_ts', 'make_zero',
+            '-movflags', '+faststart', output_path
+        ])
+        return output_path
+
+
+smart_cutter = SmartCutter()
@@ -0,0 +1,146 @@
+import os
+import struct
+from typing import Any, Dict, Optional, Set
+from pyrogram.types import Message
+from utils.metrics import metrics
+from utils.passthrough import MEDIA_TYPES
+
+# Pyrogram streams files in chunks of this size
+STREAM_CHUNK = 1024 * 1024
+
+
+class LazyMedia:
+    """A received media file whose bytes stay on Telegram until needed.
+
+    Ingestion keeps only what the message already says about the file
+    (file_id, size, mime type, duration, dimensions). `download` fetches
+    the whole file once and reuses it; `head` fetches only the first
+    chunks, which is enough for container headers and the first frames
+    of a faststart file.
+    """
+
+    def __init__(self, file_id: str, file_name: str = None, file_size: int = 0,
+                 mime_type: str = None, duration: int = 0, width: int = 0, height: int = 0):
+        self.file_id = file_id
+        self.file_name = file_name
+        self.file_size = file_size or 0
+        self.mime_type = mime_type
+        self.duration = duration or 0
+        self.width = width or 0
+        self.height = height or 0
+        self.path: Optional[str] = None
+        self.head_path: Optional[str] = None
+        self.headers_path: Optional[str] = None
+
+    @classmethod
+    def from_message(cls, message: Message) -> "LazyMedia":
+        media = next((getattr(message, kind) for kind in MEDIA_TYPES if getattr(message, kind, None)), None)
+        return cls(media.file_id, **{key: getattr(media, key, None) for key in
+                                     ("file_name", "file_size", "mime_type", "duration", "width", "height")})
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "file_name": self.file_name,
+            "file_size": self.file_size,
+            "mime_type": self.mime_type,
+            "duration": self.duration,
+            "width": self.width,
+            "height": self.height,
+        }
+
+    def _target(self, dest_dir: str, prefix: str) -> str:
+        os.makedirs(dest_dir, exist_ok=True)
+        ext = os.path.splitext(self.file_name or "")[1]
+        return os.path.join(dest_dir, f"{prefix}_{self.file_id[-16:]}{ext}")
+
+    async def download(self, client, dest_dir: str) -> str:
+        """Local path of the whole file, downloading it on first use"""
+        if self.path and os.path.exists(self.path):
+            return self.path
+        with metrics.phase("download"):
+            self.path = await client.download_media(self.file_id, file_name=self._target(dest_dir, "input"))
+            metrics.transfer("in", os.path.getsize(self.path))
+        return self.path
+
+    async def head(self, client, dest_dir: str, size: int = 4 * STREAM_CHUNK) -> str:
+        """Local path of the first `size` bytes (the whole file when it is smaller)"""
+        if self.path and os.path.exists(self.path):
+            return self.path
+        if self.file_size and self.file_size <= size:
+            return await self.download(client, dest_dir)
+        if self.head_path and os.path.exists(self.head_path):
+            return self.head_path
+        path = self._target(dest_dir, "head")
+        with metrics.phase("download"), open(path, "wb") as f:
+            async for chunk in client.stream_media(self.file_id, limit=-(-size // STREAM_CHUNK)):
+                f.write(chunk)
+                metrics.transfer("in", len(chunk))
+        self.head_path = path
+        return path
+
+    async def _fetch(self, client, f, start: int, end: int, fetched: Set[int]):
+        """Write bytes [start, end) into `f` at their own offsets, whole chunks at a time"""
+        first = start // STREAM_CHUNK
+        last = min(-(-end // STREAM_CHUNK), -(-self.file_size // STREAM_CHUNK))
+        index = first
+        while index < last:
+            if index in fetched:
+                index += 1
+                continue
+            # One request for the run of missing chunks
+            run = index
+            while run < last and run not in fetched:
+                run += 1
+            f.seek(index * STREAM_CHUNK)
+            async for chunk in client.stream_media(self.file_id, offset=index, limit=run - index):
+                f.write(chunk)
+                metrics.transfer("in", len(chunk))
+            fetched.update(range(index, run))
+            index = run
+
+    async def headers(self, client, dest_dir: str, size: int = 2 * STREAM_CHUNK) -> str:
+        """Sparse local copy holding only the container headers, enough for ffprobe.
+
+        That is the first `size` bytes; for MP4/MOV the top-level boxes are
+        followed past the media data, so a trailing moov atom is fetched
+        too. Everything else reads as zeros.
+        """
+        if self.path and os.path.exists(self.path):
+            return self.path
+        if self.headers_path and os.path.exists(self.headers_path):
+            return self.headers_path
+        if not self.file_size or self.file_size <= 2 * size:
+            return await self.download(client, dest_dir)
+
+        path = self._target(dest_dir, "headers")
+        fetched: Set[int] = set()
+        with metrics.phase("download"), open(path, "w+b") as f:
+            f.truncate(self.file_size)
+            await self._fetch(client, f, 0, size, fetched)
+            f.seek(4)
+            if f.read(4) == b"ftyp":
+                offset = 0
+                while offset + 16 <= self.file_size:
+                    await self._fetch(client, f, offset, offset + 16, fetched)
+                    f.seek(offset)
+                    box_size, kind = struct.unpack(">I4s", f.read(8))
+                    if box_size == 1:
+                        box_size = struct.unpack(">Q", f.read(8))[0]
+                    elif box_size == 0:
+                        box_size = self.file_size - offset
+                    if box_size < 8:
+                        break
+                    if kind == b"moov":
+                        await self._fetch(client, f, offset, offset + box_size, fetched)
+                        break
+                    offset += box_size
+        self.headers_path = path
+        return path
+
+    def discard(self):
+        """Remove whatever has been fetched"""
+        for path in (self.path, self.head_path, self.headers_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        self.path = self.head_path = self.headers_path = None
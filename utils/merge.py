@@ -0,0 +1,161 @@
+import asyncio
+import os
+from fractions import Fraction
+from typing import Any, Dict, List, Optional, Tuple
+from utils.ffmpeg import FFmpegHelper
+from utils.governor import governor
+
+# Codecs the merge target may use, with the encoder that reproduces them
+VIDEO_ENCODERS = {
+    'h264': 'libx264',
+    'hevc': 'libx265',
+}
+AUDIO_ENCODERS = {
+    'aac': 'aac',
+    'mp3': 'libmp3lame',
+    'opus': 'libopus',
+}
+
+
+def stream_signature(info: Dict[str, Any]) -> Dict[str, Optional[Tuple]]:
+    """What has to match for two inputs to be joined by stream copy.
+
+    Profiles may differ: the concat demuxer moves each file's parameter
+    sets in-band.
+    """
+    streams = info.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"
+                  and not s.get("disposition", {}).get("attached_pic")), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    return {
+        "video": (video.get("codec_name"), video.get("width"), video.get("height"),
+                  video.get("pix_fmt"), video.get("r_frame_rate"),
+                  video.get("time_base")) if video else None,
+        "audio": (audio.get("codec_name"), audio.get("sample_rate"),
+                  audio.get("channels")) if audio else None,
+    }
+
+
+class MergeSession:
+    """Collects videos to merge, normalizing each one as it arrives.
+
+    The first video fixes the target format. Every later video is probed
+    on arrival: if its streams match the target it is joined by stream
+    copy, otherwise a re-encode to the target starts in the background
+    right away, with up to `workers` running at once (half the job's
+    thread budget by default), dividing the budget between them. `finish`
+    waits for the outstanding work and joins everything with a lossless
+    concat.
+    """
+
+    def __init__(self, work_dir: str, workers: int = None):
+        self.work_dir = work_dir
+        self.workers = workers or max(1, governor.current().threads // 2)
+        self.semaphore = asyncio.Semaphore(self.workers)
+        self.target: Optional[Dict[str, Optional[Tuple]]] = None
+        self.parts: List[asyncio.Future] = []
+        os.makedirs(work_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self.parts)
+
+    def _choose_target(self, info: Dict[str, Any]):
+        signature = stream_signature(info)
+        video, audio = signature["video"], signature["audio"]
+        if video is None:
+            raise ValueError("The first file has no video stream")
+        if video[0] not in VIDEO_ENCODERS:
+            # Can't reproduce this codec for the other inputs; merge as H.264
+            video = ('h264',) + video[1:5] + (None,)
+        if audio is not None and audio[0] not in AUDIO_ENCODERS:
+            audio = ('aac',) + audio[1:]
+        self.target = {"video": video, "audio": audio}
+
+    def needs_normalizing(self, info: Dict[str, Any]) -> bool:
+        signature = stream_signature(info)
+        target_video, video = self.target["video"], signature["video"]
+        if video is None or video[:5] != target_video[:5]:
+            return True
+        # An unset time base (re-encoded target) follows the encoder default
+        if target_video[5] is not None and video[5] != target_video[5]:
+            return True
+        return signature["audio"] != self.target["audio"]
+
+    def normalize_command(self, input_path: str, output_path: str, info: Dict[str, Any]) -> List[str]:
+        codec, width, height, pix_fmt, frame_rate, time_base = self.target["video"]
+        audio = self.target["audio"]
+        has_audio = stream_signature(info)["audio"] is not None
+
+        cmd = ['ffmpeg', '-v', 'error', '-y', '-i', input_path]
+        if audio and not has_audio:
+            # Silent track so every part carries the same streams
+            cmd.extend(['-f', 'lavfi', '-i',
+                        f'anullsrc=r={audio[1]}:cl={"mono" if audio[2] == 1 else "stereo"}'])
+        cmd.extend([
+            '-map', '0:v:0',
+            '-vf', (f'scale={width}:{height}:force_original_aspect_ratio=decrease,'
+                    f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={frame_rate}'),
+            '-c:v', VIDEO_ENCODERS[codec], '-preset', 'veryfast', '-crf', '20',
+            '-pix_fmt', pix_fmt,
+        ])
+        if time_base:
+            cmd.extend(['-video_track_timescale', str(Fraction(time_base).denominator)])
+        if audio:
+            cmd.extend(['-map', '0:a:0' if has_audio else '1:a:0',
+                        '-c:a', AUDIO_ENCODERS[audio[0]],
+                        '-ar', str(audio[1]), '-ac', str(audio[2])])
+            if not has_audio:
+                cmd.append('-shortest')
+        cmd.extend(['-sn', '-dn', output_path])
+        return cmd
+
+    async def _prepare(self, input_path: str, index: int) -> str:
+        info = await asyncio.to_thread(FFmpegHelper.get_media_info, input_path)
+        if "error" in info:
+            raise RuntimeError(f"Could not read video {index + 1}: {info['error']}")
+        if self.target is None:
+            self._choose_target(info)
+        if not self.needs_normalizing(info):
+            return input_path
+
+        output_path = os.path.join(self.work_dir, f"normalized_{index}.mp4")
+        async with self.semaphore:
+            with governor.split(self.workers):
+                success = await FFmpegHelper.run_command(
+                    self.normalize_command(input_path, output_path, info)
+                )
+        if not success:
+            raise RuntimeError(f"Could not convert video {index + 1}")
+        return output_path
+
+    def add(self, input_path: str):
+        """Queue a video; its probe and any re-encode start immediately"""
+        index = len(self.parts)
+        if index == 0:
+            task = asyncio.ensure_future(self._prepare(input_path, index))
+        else:
+            # Later inputs are compared against the target the first one sets
+            first = self.parts[0]
+
+            async def after_first():
+                await asyncio.shield(first)
+                return await self._prepare(input_path, index)
+            task = asyncio.ensure_future(after_first())
+        self.parts.append(task)
+
+    async def finish(self, output_path: str) -> bool:
+        """Wait for every input and concat them without re-encoding"""
+        paths = await asyncio.gather(*self.parts)
+        list_file = os.path.join(self.work_dir, "merge_list.txt")
+        with open(list_file, 'w') as f:
+            for path in paths:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+        return await FFmpegHelper.run_command([
+            'ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_file,
+            '-map', '0:v', '-map', '0:a?', '-c', 'copy',
+            '-movflags', '+faststart', output_path
+        ])
+
+    def cancel(self):
+        for task in self.parts:
+            task.cancel()
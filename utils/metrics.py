@@ -0,0 +1,217 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+from pymongo import monitoring
+from utils.tracing import tracer
+
+# Seconds; phases run from sub-second probes to hour-long encodes
+PHASE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+MONGO_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+_operation: contextvars.ContextVar = contextvars.ContextVar('metrics_operation', default="other")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """Monotonic count per label set"""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # Unlabelled series are reported from the start, as 0
+        self._values: Dict[Tuple[str, ...], float] = {} if self.labels else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_labels(self.labels, labels)} {value}"
+
+
+class Gauge(Counter):
+    """Current value per label set"""
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    """Bucketed observations per label set, with their sum and count"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = PHASE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self) -> Iterator[str]:
+        for labels, counts in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {counts[-1]}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+
+class MongoListener(monitoring.CommandListener):
+    """Times every MongoDB command through pymongo's command monitoring"""
+
+    def __init__(self, metrics: "Metrics"):
+        self.metrics = metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.metrics.mongo_seconds.observe(event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event):
+        self.metrics.mongo_seconds.observe(event.duration_micros / 1e6, event.command_name)
+        self.metrics.mongo_failures.inc(event.command_name)
+
+
+class FloodWaitLog(logging.Handler):
+    """Counts the FloodWaits Pyrogram sleeps through, which it only logs"""
+
+    def __init__(self, metrics: "Metrics"):
+        super().__init__(logging.WARNING)
+        self.metrics = metrics
+
+    def emit(self, record):
+        if (isinstance(record.msg, str) and record.msg.startswith('[%s] Waiting for')
+                and len(record.args) == 3):
+            _, seconds, method = record.args
+            self.metrics.flood_wait(method, seconds)
+
+
+class Metrics:
+    """Process-wide instruments, exposed in Prometheus text format by health.py.
+
+    Recording is a dict update under a lock (and a bisect for histograms),
+    so it is safe to call from handler code and from ffmpeg worker threads
+    alike. The operation a measurement belongs to comes from `job()`,
+    which binds it for everything the job awaits or runs in threads.
+    """
+
+    def __init__(self):
+        self.jobs_in_flight = Gauge("bot_jobs_in_flight", "Jobs being processed by this process")
+        self.queue_depth = Gauge("bot_queue_depth", "Jobs waiting to start")
+        self.jobs = Counter("bot_jobs_total", "Finished jobs", ("operation", "outcome"))
+        self.phase_seconds = Histogram("bot_phase_seconds", "Time spent per job phase",
+                                       ("operation", "phase"))
+        self.bytes = Counter("bot_bytes_total", "Media bytes fetched from and sent to Telegram",
+                             ("direction",))
+        self.cache = Counter("bot_cache_requests_total", "Cache lookups", ("cache", "result"))
+        self.mongo_seconds = Histogram("bot_mongo_command_seconds", "MongoDB command latency",
+                                       ("command",), MONGO_BUCKETS)
+        self.mongo_failures = Counter("bot_mongo_command_failures_total", "Failed MongoDB commands",
+                                      ("command",))
+        self.flood_waits = Counter("bot_flood_waits_total", "FloodWait errors from Telegram",
+                                   ("method",))
+        self.flood_wait_seconds = Counter("bot_flood_wait_seconds_total",
+                                          "Seconds Telegram asked us to wait", ("method",))
+        self.instruments = [
+            self.jobs_in_flight, self.queue_depth, self.jobs, self.phase_seconds, self.bytes,
+            self.cache, self.mongo_seconds, self.mongo_failures, self.flood_waits,
+            self.flood_wait_seconds,
+        ]
+
+    @contextmanager
+    def job(self, operation: str):
+        """Count a job in flight and its outcome; its phases are labelled `operation`"""
+        token = _operation.set(operation)
+        self.jobs_in_flight.inc()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                outcome = "cancelled"
+            raise
+        finally:
+            self.jobs_in_flight.dec()
+            self.jobs.inc(operation, outcome)
+            _operation.reset(token)
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a download, probe, process or upload phase of the current job"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(name, time.perf_counter() - start, start)
+
+    def observe_phase(self, name: str, seconds: float, start: float = None):
+        """Record a phase in the histograms and on the job's trace"""
+        self.phase_seconds.observe(seconds, _operation.get(), name)
+        tracer.span(name, time.perf_counter() - seconds if start is None else start, seconds)
+
+    def transfer(self, direction: str, amount: int):
+        """Count media bytes "in" from or "out" to Telegram"""
+        self.bytes.inc(direction, amount=amount)
+        tracer.transfer(direction, amount)
+
+    def cache_lookup(self, cache: str, hit: bool):
+        self.cache.inc(cache, "hit" if hit else "miss")
+
+    def flood_wait(self, method: str, seconds: float):
+        self.flood_waits.inc(method)
+        self.flood_wait_seconds.inc(method, amount=seconds)
+
+    def mongo_listener(self) -> MongoListener:
+        return MongoListener(self)
+
+    def watch_flood_waits(self):
+        logging.getLogger("pyrogram.session.session").addHandler(FloodWaitLog(self))
+
+    def render(self) -> str:
+        lines = []
+        for instrument in self.instruments:
+            lines.append(f"# HELP {instrument.name} {instrument.help}")
+            lines.append(f"# TYPE {instrument.name} {instrument.kind}")
+            lines.extend(instrument.samples())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,83 @@
+from typing import Any, Dict, List, Optional
+from pyrogram.types import Message, MessageEntity
+from utils.gateway import gateway
+
+# Operations that only touch the message, never the media bytes
+CAPTION_OPERATIONS = ("video_edit_caption", "audio_edit_caption", "doc_edit_caption")
+PASSTHROUGH_OPERATIONS = CAPTION_OPERATIONS + ("doc_remove_forward",)
+
+MEDIA_TYPES = ("video", "audio", "document", "animation", "photo", "voice")
+
+
+class PassthroughOperations:
+    """Caption edits and forward removal done by re-sending the same file.
+
+    Telegram keeps the file server-side, so `copy_message` (or sending the
+    `file_id` again) produces a new message without any download or
+    upload; a copy never carries a forward header. The request takes as
+    long as one API call whatever the file size.
+    """
+
+    def __init__(self):
+        # user_id -> source of the media waiting for its new caption
+        self.pending: Dict[int, Dict[str, Any]] = {}
+
+    @staticmethod
+    def source(message: Message) -> Dict[str, Any]:
+        """What a pass-through operation needs to know about an incoming media message"""
+        media = next((getattr(message, kind) for kind in MEDIA_TYPES if getattr(message, kind, None)), None)
+        return {
+            "chat_id": message.chat.id,
+            "message_id": message.id,
+            "file_id": getattr(media, "file_id", None),
+            "caption": message.caption,
+            "caption_entities": message.caption_entities,
+        }
+
+    def is_passthrough(self, operation: str) -> bool:
+        return operation in PASSTHROUGH_OPERATIONS
+
+    async def start(self, client, user_id: int, chat_id: int, source: Dict[str, Any],
+                    operation: str) -> Optional[Message]:
+        """Run `operation`, or remember `source` until its new caption arrives"""
+        if operation in CAPTION_OPERATIONS:
+            self.pending[user_id] = source
+            return None
+        # Keeping the caption as it is: the copy just loses the forward header
+        return await self.resend(client, chat_id, source)
+
+    async def finish_caption(self, client, user_id: int, message: Message) -> Optional[Message]:
+        """Re-send the pending media of `user_id` with `message` as its caption"""
+        source = self.pending.pop(user_id, None)
+        if source is None:
+            return None
+        return await self.resend(client, message.chat.id, source,
+                                 caption=message.text, caption_entities=message.entities)
+
+    async def resend(self, client, chat_id: int, source: Dict[str, Any], caption: str = None,
+                     caption_entities: List[MessageEntity] = None) -> Message:
+        """Copy the source message; fall back to sending its file_id"""
+        with gateway.priority("result"):
+            try:
+                return await client.copy_message(
+                    chat_id,
+                    source["chat_id"],
+                    source["message_id"],
+                    caption=caption,
+                    caption_entities=caption_entities
+                )
+            except Exception:
+                # The original may be gone; the file_id stays valid for this bot
+                if not source.get("file_id"):
+                    raise
+                if caption is None:
+                    caption, caption_entities = source.get("caption"), source.get("caption_entities")
+                return await client.send_cached_media(
+                    chat_id,
+                    source["file_id"],
+                    caption=caption or "",
+                    caption_entities=caption_entities
+                )
+
+
+passthrough = PassthroughOperations()
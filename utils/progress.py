@@ -1,6 +1,7 @@
 import asyncio
 from pyrogram.types import Message
 from typing import Callable
+from utils.gateway import gateway
 
 class ProgressTracker:
     def __init__(self, client, chat_id: int, message_id: int, total: int):
@@ -22,11 +23,13 @@ class ProgressTracker:
             text = f"🔄 Processing...\n{progress_bar} {percentage:.1f}%"
             
             try:
-                await self.client.edit_message_text(
-                    self.chat_id,
-                    self.message_id,
-                    text
-                )
+                # Queued behind results and dropped while the chat is in a FloodWait
+                with gateway.priority("progress"):
+                    await self.client.edit_message_text(
+                        self.chat_id,
+                        self.message_id,
+                        text
+                    )
                 self.last_update = percentage
             except Exception:
                 pass
@@ -0,0 +1,126 @@
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from config import Config
+
+# Seconds of estimated work one turn gives a user of weight 1
+QUANTUM = 60.0
+
+# A job's cost counts half after waiting this long, a third after twice as long...
+AGING_SECONDS = 600.0
+
+
+class QueuedJob:
+    """A job waiting to start, as the scheduler sees it.
+
+    `seconds` is the estimate from utils/admission.py (input size times
+    the operation's cost), `queued_at` a time.time() and `ref` whatever
+    the caller needs to start the job.
+    """
+
+    def __init__(self, user_id: int, seconds: float, queued_at: float,
+                 premium: bool = False, ref: Any = None):
+        self.user_id = user_id
+        self.seconds = seconds or 0.0
+        self.queued_at = queued_at
+        self.premium = premium
+        self.ref = ref
+        # Deficit `pick` took for it, given back by `refund`
+        self.charged = 0.0
+
+
+class FairScheduler:
+    """Which waiting job starts next: deficit round-robin over per-user queues.
+
+    Users take turns in user id order. A turn adds QUANTUM seconds times
+    the user's weight (PREMIUM_WEIGHT for premium users, 1 otherwise) to
+    their deficit, and they may start their next job once its estimated
+    seconds fit in it. One user with fifty videos then gets the same
+    share of the slots as one with a single video, instead of all of
+    them. Each user's own queue is shortest job first, and a short job
+    fits on the first turn, so quick tasks aren't held up by long
+    transcodes. Waiting lowers a job's cost (AGING_SECONDS), so long
+    jobs still start. A user already running USER_MAX_JOBS jobs
+    (PREMIUM_MAX_JOBS for premium) is skipped.
+
+    The state is the deficits and whose turn it is; `pick` advances it,
+    `refund` undoes a pick that couldn't be started, and `plan` only
+    looks ahead.
+    """
+
+    def __init__(self, premium_weight: float = Config.PREMIUM_WEIGHT,
+                 user_max_jobs: int = Config.USER_MAX_JOBS,
+                 premium_max_jobs: int = Config.PREMIUM_MAX_JOBS, quantum: float = QUANTUM):
+        self.premium_weight = premium_weight
+        self.user_max_jobs = user_max_jobs
+        self.premium_max_jobs = premium_max_jobs
+        self.quantum = quantum
+        self.deficits: Dict[int, float] = {}
+        self.turn: Optional[int] = None
+
+    def weight(self, premium: bool) -> float:
+        return self.premium_weight if premium else 1.0
+
+    def cap(self, premium: bool) -> int:
+        return self.premium_max_jobs if premium else self.user_max_jobs
+
+    def cost(self, job: QueuedJob, now: float) -> float:
+        return job.seconds / (1 + max(0.0, now - job.queued_at) / AGING_SECONDS)
+
+    def _next(self, jobs: List[QueuedJob], running: Dict[int, int], deficits: Dict[int, float],
+              turn: Optional[int], now: float) -> Tuple[Optional[QueuedJob], Dict[int, float], Optional[int]]:
+        queues: Dict[int, List[QueuedJob]] = {}
+        for job in jobs:
+            if running.get(job.user_id, 0) < self.cap(job.premium):
+                queues.setdefault(job.user_id, []).append(job)
+        # Deficits don't carry over a time with nothing queued
+        deficits = {user: deficit for user, deficit in deficits.items() if user in queues}
+        if not queues:
+            return None, deficits, turn
+        users = sorted(queues)
+        # The user whose turn it is goes on while their deficit lasts
+        index = next((i for i, user in enumerate(users) if turn is None or user >= turn), 0)
+        # Whose turn it was may have dropped out (capped) and lost their deficit since
+        fresh = users[index] != turn or turn not in deficits
+        while True:
+            user = users[index]
+            queue = queues[user]
+            head = min(queue, key=lambda job: (self.cost(job, now), job.queued_at))
+            if fresh:
+                deficits[user] = deficits.get(user, 0.0) + self.quantum * self.weight(head.premium)
+            cost = self.cost(head, now)
+            if cost <= deficits[user]:
+                deficits[user] -= cost
+                return head, deficits, user
+            index = (index + 1) % len(users)
+            fresh = True
+
+    def pick(self, jobs: List[QueuedJob], running: Dict[int, int]) -> Optional[QueuedJob]:
+        """The job to start next, given jobs running per user; None if every user is at their cap"""
+        now = time.time()
+        job, self.deficits, self.turn = self._next(jobs, running, self.deficits, self.turn, now)
+        if job is not None:
+            job.charged = self.cost(job, now)
+        return job
+
+    def refund(self, job: QueuedJob):
+        """Give back what `pick` charged for a job that another worker started first"""
+        if job.user_id in self.deficits:
+            self.deficits[job.user_id] += job.charged
+        job.charged = 0.0
+
+    def plan(self, jobs: List[QueuedJob], running: Dict[int, int]) -> List[QueuedJob]:
+        """The order `jobs` would start in if nothing else changed; jobs held back by a cap are left out"""
+        now = time.time()
+        jobs, running = list(jobs), dict(running)
+        deficits, turn = self.deficits, self.turn
+        order = []
+        while True:
+            job, deficits, turn = self._next(jobs, running, deficits, turn, now)
+            if job is None:
+                return order
+            order.append(job)
+            jobs.remove(job)
+            running[job.user_id] = running.get(job.user_id, 0) + 1
+
+
+scheduler = FairScheduler()
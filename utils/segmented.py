@@ -0,0 +1,155 @@
+import asyncio
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Callable, List, Tuple
+from utils.ffmpeg import FFmpegHelper, SLOW_REVERB_FILTER
+from utils.governor import governor
+from utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+
+class SegmentEffect:
+    """An ffmpeg audio filter chain that can be rendered segment by segment.
+
+    `build(start)` returns the filter for a stream whose first sample is at
+    `start` seconds of the input, so time-dependent filters (LFOs) can be
+    phase-aligned. `warmup` is how much earlier input the filter needs to
+    reach the state it would have in a single pass (echo delay, IIR
+    settling), and `tempo` is the output/input speed ratio.
+    """
+
+    def __init__(self, build: Callable[[float], str], warmup: float = 0.5, tempo: float = 1.0):
+        self.build = build
+        self.warmup = warmup
+        self.tempo = tempo
+
+
+def slow_reverb_effect() -> SegmentEffect:
+    # atempo's overlap-add window and the 20ms echo both settle within a second
+    return SegmentEffect(lambda start: SLOW_REVERB_FILTER, warmup=1.0, tempo=0.8)
+
+
+def bass_boost_effect(level: int) -> SegmentEffect:
+    return SegmentEffect(lambda start: f'bass=g={level}', warmup=0.5)
+
+
+def treble_boost_effect(level: int) -> SegmentEffect:
+    return SegmentEffect(lambda start: f'treble=g={level}', warmup=0.5)
+
+
+class SegmentedAudioProcessor:
+    """Render an audio effect over long inputs on the job's cores.
+
+    The input is cut into N contiguous segments, N at most the job's
+    thread budget, which the segments share along with its memory. Each is decoded from
+    `warmup` seconds before its start, so stateful filters are in the same
+    state at the cut as in a single pass, and runs `crossfade` seconds past
+    its end. The warmup output is trimmed, the segments render concurrently
+    as single-threaded ffmpeg children into raw float PCM, and consecutive
+    segments are joined with a linear crossfade over the shared region so
+    residual differences at the seams are inaudible. The join streams
+    memory-mapped segments into a single encoder.
+    """
+
+    def __init__(self, workers: int = None, min_segment: float = 120.0, crossfade: float = 0.1):
+        self.workers = workers  # None: the current job's thread budget
+        self.min_segment = min_segment
+        self.crossfade = crossfade
+
+    def plan(self, duration: float, workers: int = None) -> List[Tuple[float, float]]:
+        """Split [0, duration) into at most `workers` segments of min_segment or more"""
+        workers = workers or self.workers or governor.current().threads
+        count = max(1, min(workers, int(duration // self.min_segment)))
+        bounds = [duration * i / count for i in range(count + 1)]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def segment_command(self, input_path: str, output_path: str, effect: SegmentEffect,
+                        start: float, end: float, rate: int, last: bool) -> List[str]:
+        decode_start = max(0.0, start - effect.warmup)
+        # Trim in output samples so tempo-changing chains cannot drift
+        skip = round((start - decode_start) / effect.tempo * rate)
+        trim = f'atrim=start_sample={skip}'
+        if not last:
+            length = round((end - start + self.crossfade) / effect.tempo * rate)
+            trim += f':end_sample={skip + length}'
+        audio_filter = f'{effect.build(decode_start)},{trim},asetpts=PTS-STARTPTS'
+
+        cmd = ['ffmpeg', '-v', 'error', '-y', '-threads', '1', '-filter_threads', '1',
+               '-ss', f'{decode_start:.6f}']
+        if not last:
+            # A little extra input so filters with lookahead can fill the trim
+            cmd.extend(['-t', f'{end + self.crossfade + 1.0 - decode_start:.6f}'])
+        cmd.extend(['-i', input_path, '-vn', '-af', audio_filter, '-f', 'f32le', output_path])
+        return cmd
+
+    def stitch(self, segment_paths: List[str], output_path: str, tempo: float,
+               rate: int, channels: int, chunk: int = 1 << 16):
+        """Crossfade consecutive raw segments into one encoded output"""
+        overlap = round(self.crossfade / tempo * rate)
+        fade_in = ((np.arange(overlap) + 0.5) / overlap)[:, None].astype(np.float32)
+        encoder = governor.popen([
+            'ffmpeg', '-v', 'error', '-y',
+            '-f', 'f32le', '-ar', str(rate), '-ac', str(channels), '-i', 'pipe:0',
+            output_path
+        ], stdin=subprocess.PIPE)
+        try:
+            tail = None
+            for i, path in enumerate(segment_paths):
+                data = np.memmap(path, dtype='<f4', mode='r').reshape(-1, channels)
+                start = 0
+                if tail is not None:
+                    head = data[:overlap]
+                    encoder.stdin.write((tail * (1 - fade_in) + head * fade_in).tobytes())
+                    start = overlap
+                end = len(data) if i == len(segment_paths) - 1 else len(data) - overlap
+                for offset in range(start, end, chunk):
+                    encoder.stdin.write(data[offset:min(offset + chunk, end)].tobytes())
+                tail = np.array(data[end:])
+                del data
+        finally:
+            encoder.stdin.close()
+            returncode = encoder.wait()
+        return returncode == 0
+
+    async def process(self, input_path: str, output_path: str, effect: SegmentEffect) -> bool:
+        """Apply the effect, in parallel when the input is long enough"""
+        info = FFmpegHelper.get_media_info(input_path)
+        audio = next((stream for stream in info.get("streams", [])
+                      if stream.get("codec_type") == "audio"), None)
+        duration = float(info.get("format", {}).get("duration", 0))
+        workers = self.workers or governor.current().threads
+        segments = self.plan(duration, workers) if audio else []
+        if len(segments) < 2:
+            return await FFmpegHelper.run_command([
+                'ffmpeg', '-y', '-i', input_path, '-af', effect.build(0.0), output_path
+            ])
+
+        work_dir = tempfile.mkdtemp(prefix='segments_', dir=os.path.dirname(output_path) or None)
+        try:
+            rate = int(audio["sample_rate"])
+            paths = [os.path.join(work_dir, f'{i}.f32') for i in range(len(segments))]
+            limit = asyncio.Semaphore(workers)
+
+            async def render(i):
+                start, end = segments[i]
+                cmd = self.segment_command(input_path, paths[i], effect, start, end, rate,
+                                           last=i == len(segments) - 1)
+                async with limit:
+                    return await FFmpegHelper.run_command(cmd)
+
+            # Concurrent segments share the job's memory ceiling
+            with governor.split(min(workers, len(segments))):
+                results = await asyncio.gather(*(render(i) for i in range(len(segments))))
+            if not all(results):
+                return False
+            return await asyncio.to_thread(
+                self.stitch, paths, output_path, effect.tempo, rate, int(audio["channels"])
+            )
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+segmented_processor = SegmentedAudioProcessor()
@@ -0,0 +1,131 @@
+import subprocess
+from typing import Any, Dict, List, Tuple
+from utils.governor import governor
+from utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Audio codecs whose packets can be cut and joined without re-encoding,
+# with the container extension to write them into
+STREAM_COPY_EXTENSIONS = {
+    'mp3': 'mp3',
+    'aac': 'm4a',
+    'alac': 'm4a',
+    'flac': 'flac',
+    'vorbis': 'ogg',
+    'opus': 'ogg',
+    'pcm_s16le': 'wav',
+    'pcm_s24le': 'wav',
+    'pcm_f32le': 'wav',
+}
+
+
+class SilenceAnalyzer:
+    """Single-pass silence detection over streamed PCM.
+
+    ffmpeg decodes to mono float PCM at a low sample rate (energy detection
+    does not need the full band), and each block is reshaped into fixed
+    windows whose RMS and peak are computed with NumPy. Only the list of
+    silent runs is kept, so memory does not depend on input length.
+    """
+
+    def __init__(self, threshold_db: float = -50.0, min_silence: float = 0.5,
+                 window: float = 0.02, peak_margin_db: float = 12.0,
+                 sample_rate: int = 8000, block_seconds: float = 30.0):
+        self.threshold_db = threshold_db
+        self.min_silence = min_silence
+        self.peak_margin_db = peak_margin_db
+        self.sample_rate = sample_rate
+        self.window_frames = max(1, int(window * sample_rate))
+        self.block_frames = self.window_frames * max(1, int(block_seconds / window))
+
+    def decode_command(self, input_path: str) -> List[str]:
+        return [
+            'ffmpeg', '-v', 'error', '-i', input_path, '-vn',
+            '-f', 'f32le', '-ac', '1', '-ar', str(self.sample_rate),
+            'pipe:1'
+        ]
+
+    def analyze(self, input_path: str) -> Dict[str, Any]:
+        """Return the duration and every silent run as (start, end) seconds"""
+        rms_limit = 10 ** (self.threshold_db / 20)
+        peak_limit = 10 ** ((self.threshold_db + self.peak_margin_db) / 20)
+        window = self.window_frames
+        window_seconds = window / self.sample_rate
+
+        silences = []
+        run_start = None  # window index where the current silent run began
+        windows_seen = 0
+        frames = 0
+
+        process = governor.popen(self.decode_command(input_path), stdout=subprocess.PIPE)
+        try:
+            while True:
+                raw = process.stdout.read(self.block_frames * 4)
+                if not raw:
+                    break
+                block = np.frombuffer(raw[:len(raw) - len(raw) % 4], dtype='<f4')
+                frames += len(block)
+                usable = len(block) - len(block) % window
+                if usable < len(block):
+                    # Only the final block can be short; pad its last window
+                    block = np.concatenate((block, np.zeros(window - len(block) + usable, np.float32)))
+                windows = block.reshape(-1, window)
+                rms = np.sqrt(np.mean(np.square(windows, dtype=np.float64), axis=1))
+                peak = np.max(np.abs(windows), axis=1)
+                silent = (rms < rms_limit) & (peak < peak_limit)
+
+                # Run boundaries, seeded with whether a run is carried over
+                carried = run_start is not None
+                steps = np.diff(np.concatenate(([carried], silent)).astype(np.int8))
+                starts = list(windows_seen + np.flatnonzero(steps == 1))
+                ends = list(windows_seen + np.flatnonzero(steps == -1))
+                if carried and ends:
+                    silences.append((run_start, ends.pop(0)))
+                    run_start = None
+                silences.extend(zip(starts, ends))
+                if len(starts) > len(ends):
+                    run_start = starts[-1]
+                windows_seen += len(windows)
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            raise RuntimeError(f"Silence analysis failed to decode {input_path}")
+        if run_start is not None:
+            silences.append((run_start, windows_seen))
+
+        duration = frames / self.sample_rate
+        runs = [(float(start * window_seconds), float(min(end * window_seconds, duration)))
+                for start, end in silences]
+        return {"duration": duration, "silences": runs}
+
+    def keep_segments(self, analysis: Dict[str, Any], padding: float = 0.1,
+                      internal: bool = True) -> List[Tuple[float, float]]:
+        """Audible (start, end) segments once silences are cut.
+
+        Leading and trailing silence is trimmed to `padding`; internal runs
+        longer than `min_silence` are shortened to `padding` on each side.
+        """
+        duration = analysis["duration"]
+        segments = []
+        cursor = 0.0
+        for start, end in analysis["silences"]:
+            leading = start <= 0.0
+            trailing = end >= duration
+            if leading and trailing:
+                return []
+            if leading:
+                cursor = max(0.0, end - padding)
+            elif trailing:
+                segments.append((cursor, min(duration, start + padding)))
+                return segments
+            elif internal and end - start >= self.min_silence:
+                segments.append((cursor, start + padding))
+                cursor = end - padding
+        if cursor < duration:
+            segments.append((cursor, duration))
+        return segments
+
+
+silence_analyzer = SilenceAnalyzer()
@@ -0,0 +1,128 @@
+import asyncio
+import math
+import os
+from typing import AsyncIterator, List, Tuple
+from utils.ffmpeg import FFmpegHelper
+from utils.keyframes import KeyframeIndex, keyframe_indexer, SEEK_EPSILON
+
+BOT_API_LIMIT = 50 * 1024 * 1024
+CLIENT_LIMIT = 2 * 1024 * 1024 * 1024
+
+
+class SizeSplitter:
+    """Split media into playable parts that each fit a byte budget.
+
+    Cut points are keyframes chosen by packing whole GOPs, using the
+    per-GOP byte counts from the keyframe index, so every part is a stream
+    copy with its own complete container. Parts are rendered one ahead of
+    the consumer, so uploading part N overlaps with cutting part N + 1.
+    """
+
+    def __init__(self, margin: float = 0.03, overhead: int = 256 * 1024):
+        self.margin = margin  # share of the budget kept for container overhead
+        self.overhead = overhead
+
+    def usable(self, max_bytes: int) -> int:
+        return int(max_bytes * (1 - self.margin)) - self.overhead
+
+    def plan(self, index: KeyframeIndex, max_bytes: int, start: float = 0.0,
+             end: float = None) -> List[Tuple[float, float]]:
+        """Keyframe-aligned (start, end) parts of [start, end) that fit `max_bytes`"""
+        end = index.duration if end is None else end
+        budget = self.usable(max_bytes)
+        parts = []
+        part_start = None
+        part_bytes = 0
+        for gop_start, gop_end, size in index.gops():
+            if gop_end <= start + SEEK_EPSILON or gop_start >= end - SEEK_EPSILON:
+                continue
+            if part_start is None:
+                part_start = gop_start
+            elif part_bytes + size > budget:
+                # A single GOP over budget still becomes its own part
+                parts.append((part_start, gop_start))
+                part_start, part_bytes = gop_start, 0
+            part_bytes += size
+        if part_start is not None:
+            parts.append((part_start, end))
+        return parts
+
+    def plan_by_time(self, duration: float, size: int, max_bytes: int) -> List[Tuple[float, float]]:
+        """Equal-length parts for streams without keyframe structure (audio)"""
+        count = max(1, math.ceil(size / self.usable(max_bytes)))
+        bounds = [duration * i / count for i in range(count + 1)]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def part_command(self, input_path: str, output_path: str, start: float, end: float,
+                     index: KeyframeIndex) -> List[str]:
+        cmd = ['ffmpeg', '-v', 'error', '-y']
+        if start > 0:
+            cmd.extend(['-ss', f'{start + SEEK_EPSILON:.6f}'])
+        cmd.extend(['-i', input_path, '-map', '0:v?', '-map', '0:a?', '-map', '0:s?',
+                    '-c', 'copy', '-t', f'{end - start:.6f}'])
+        if index.times:
+            # A time limit lets the next keyframe through in decode order
+            cmd.extend(['-frames:v', str(index.frames_between(start, end))])
+        cmd.extend(FFmpegHelper.output(output_path))
+        return cmd
+
+    async def split(self, input_path: str, output_dir: str, max_bytes: int,
+                    extension: str = None) -> AsyncIterator[Tuple[str, int, int]]:
+        """Yield (path, part number, total parts) as each part is finished.
+
+        The caller owns the yielded files. A part that still comes out over
+        budget (container overhead beyond the margin) is re-planned with a
+        proportionally smaller budget, so the total can grow while parts
+        are being yielded. Closing the generator early cancels the part
+        being cut ahead and removes its file.
+        """
+        index = await asyncio.to_thread(keyframe_indexer.get, input_path)
+        if index.times:
+            parts = self.plan(index, max_bytes)
+        else:
+            duration = index.duration or FFmpegHelper.get_duration(input_path)
+            parts = self.plan_by_time(duration, os.path.getsize(input_path), max_bytes)
+
+        base, ext = os.path.splitext(os.path.basename(input_path))
+        ext = extension or ext or '.mp4'
+        os.makedirs(output_dir, exist_ok=True)
+
+        def render(i):
+            path = os.path.join(output_dir, f"{base}_part{i + 1}{ext}")
+            start, end = parts[i]
+            cmd = self.part_command(input_path, path, start, end, index)
+            return path, asyncio.ensure_future(FFmpegHelper.run_command(cmd))
+
+        pending = render(0)
+        i = 0
+        try:
+            while i < len(parts):
+                path, task = pending
+                if not await task:
+                    raise RuntimeError(f"Failed to cut part {i + 1} of {input_path}")
+                size = os.path.getsize(path)
+                if size > max_bytes and index.times:
+                    replanned = self.plan(index, int(max_bytes * max_bytes / size), *parts[i])
+                    if len(replanned) > 1:
+                        os.remove(path)
+                        parts[i:i + 1] = replanned
+                        pending = render(i)
+                        continue
+                pending = render(i + 1) if i + 1 < len(parts) else None
+                yield path, i + 1, len(parts)
+                i += 1
+        finally:
+            # The consumer stopped early or a cut failed: stop the part
+            # being cut ahead and drop its output
+            if pending is not None:
+                path, task = pending
+                if not task.done():
+                    task.cancel()
+                    try:
+                        await task
+                    except (asyncio.CancelledError, Exception):
+                        pass
+                if os.path.exists(path):
+                    os.remove(path)
+
+size_splitter = SizeSplitter()
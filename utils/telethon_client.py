@@ -1,5 +1,11 @@
 from telethon import TelegramClient
+from telethon.tl.types import DocumentAttributeVideo
 from config import Config
+from utils.faststart import faststart
+from utils.gateway import gateway
+from utils.metrics import metrics
+from utils.thumbnails import thumbnail_service
+import asyncio
 import os
 import logging
 
@@ -35,41 +41,50 @@ class TelethonClient:
             logger.warning("Telethon client not started - STRING_SESSION not configured")
     
     async def upload_large_file(self, chat_id: int, file_path: str, caption: str = "", 
-                              thumb: str = None, progress_callback=None):
-        """Upload large files using Telethon (for files > 2GB)"""
+                              thumb: str = None, progress_callback=None,
+                              custom_thumbnail: str = None):
+        """Upload large files using Telethon (for files > 2GB)
+
+        Videos always go out with a thumbnail and duration/size attributes;
+        `custom_thumbnail` (the user's setting) wins over the extracted frame.
+        """
         if not self.enabled:
             raise Exception("Telethon client not configured. Set STRING_SESSION environment variable.")
         
         try:
-            file = await self.client.upload_file(
-                file_path,
-                progress_callback=progress_callback
-            )
+            await asyncio.to_thread(faststart.finalize, file_path)
+            metrics.transfer("out", os.path.getsize(file_path))
+            with metrics.phase("upload"):
+                file = await self.client.upload_file(
+                    file_path,
+                    progress_callback=progress_callback
+                )
             
             # Determine file type
             if file_path.lower().endswith(('.mp4', '.mkv', '.avi', '.mov')):
-                await self.client.send_file(
-                    chat_id,
-                    file,
-                    caption=caption,
-                    thumb=thumb,
+                extracted, info = await thumbnail_service.for_upload(
+                    file_path, custom_thumbnail=custom_thumbnail
+                )
+                options = dict(
+                    thumb=thumb or extracted,
                     supports_streaming=True,
-                    attributes=None
+                    attributes=[DocumentAttributeVideo(
+                        duration=info["duration"],
+                        w=info["width"],
+                        h=info["height"],
+                        supports_streaming=True
+                    )]
                 )
             elif file_path.lower().endswith(('.mp3', '.wav', '.flac', '.m4a')):
-                await self.client.send_file(
-                    chat_id,
-                    file,
-                    caption=caption,
-                    thumb=thumb,
-                    attributes=None,
-                    voice_note=False
-                )
+                options = dict(thumb=thumb, attributes=None, voice_note=False)
             else:
-                await self.client.send_file(
-                    chat_id,
-                    file,
-                    caption=caption
+                options = {}
+            
+            # The file is already uploaded; only the message goes through the gateway
+            with gateway.priority("result"):
+                await gateway.call(
+                    lambda: self.client.send_file(chat_id, file, caption=caption, **options),
+                    chat_id, "SendMedia"
                 )
         except Exception as e:
             raise e
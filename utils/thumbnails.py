@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import os
+import subprocess
+import tempfile
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from config import Config
+from utils.ffmpeg import FFmpegHelper
+from utils.governor import governor
+from utils.lazy import lazy_import
+from utils.metrics import metrics
+
+Image = lazy_import('PIL.Image')
+
+# Share of the duration to seek to; skips black intros and title cards
+THUMBNAIL_POSITION = 0.1
+# Telegram rejects thumbnails over 200 KB
+THUMBNAIL_MAX_BYTES = 200 * 1024
+
+
+class ThumbnailService:
+    """Upload thumbnails and video attributes, computed once per input.
+
+    The frame comes from a keyframe-only decode after an input seek, so
+    only one frame is decoded. ffmpeg hands over a full-size JPEG, which
+    Pillow opens with `draft` (DCT-domain downscale while decoding) and
+    `reduce` (integer box filter) before the final resize. Results are
+    cached on disk keyed by the input's path, size and mtime; attributes
+    are cached in memory under the same key. Inputs are mostly temporary
+    files, so the disk cache keeps only the `max_cached` most recently
+    used thumbnails.
+    """
+
+    def __init__(self, cache_dir: str = os.path.join(Config.TEMP_DIR, 'thumbnails'),
+                 size: Tuple[int, int] = Config.THUMBNAIL_SIZE, max_cached: int = 256):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.max_cached = max_cached
+        self._attributes: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def cache_key(self, input_path: str) -> str:
+        stat = os.stat(input_path)
+        identity = f"{os.path.abspath(input_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    def attributes(self, input_path: str) -> Dict[str, Any]:
+        """Duration (whole seconds), width and height of the first video stream"""
+        key = self.cache_key(input_path)
+        metrics.cache_lookup("media_attributes", key in self._attributes)
+        if key in self._attributes:
+            self._attributes.move_to_end(key)
+            return self._attributes[key]
+
+        info = FFmpegHelper.get_media_info(input_path)
+        video = next((stream for stream in info.get("streams", [])
+                      if stream.get("codec_type") == "video"
+                      and not stream.get("disposition", {}).get("attached_pic")), {})
+        duration = float(info.get("format", {}).get("duration") or 0)
+        attributes = {
+            "duration": int(round(duration)),
+            "width": int(video.get("width") or 0),
+            "height": int(video.get("height") or 0),
+        }
+        self._attributes[key] = attributes
+        while len(self._attributes) > self.max_cached:
+            self._attributes.popitem(last=False)
+        return attributes
+
+    def resize(self, source_path: str, output_path: str):
+        """Shrink an image into the thumbnail box using Pillow's fast paths"""
+        with Image.open(source_path) as image:
+            # JPEG only: decode at 1/2, 1/4 or 1/8 scale, still >= the box
+            image.draft('RGB', self.size)
+            image = image.convert('RGB')
+            factor = min(image.width // self.size[0], image.height // self.size[1])
+            if factor > 1:
+                image = image.reduce(factor)
+            image.thumbnail(self.size, Image.Resampling.LANCZOS)
+            quality = 85
+            image.save(output_path, 'JPEG', quality=quality, optimize=True)
+            while os.path.getsize(output_path) > THUMBNAIL_MAX_BYTES and quality > 40:
+                quality -= 15
+                image.save(output_path, 'JPEG', quality=quality, optimize=True)
+
+    def extract(self, input_path: str) -> Optional[str]:
+        """Thumbnail of a video, from the cache when it has been made before"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        thumb_path = os.path.join(self.cache_dir, f"{self.cache_key(input_path)}.jpg")
+        metrics.cache_lookup("thumbnails", os.path.exists(thumb_path))
+        if os.path.exists(thumb_path):
+            os.utime(thumb_path)  # keep recently used thumbnails out of eviction
+            return thumb_path
+
+        duration = self.attributes(input_path)["duration"]
+        fd, frame_path = tempfile.mkstemp(suffix='.jpg', dir=self.cache_dir)
+        os.close(fd)
+        try:
+            result = governor.run([
+                'ffmpeg', '-v', 'error', '-y',
+                '-skip_frame', 'nokey', '-noaccurate_seek',
+                '-ss', f'{duration * THUMBNAIL_POSITION:.3f}',
+                '-i', input_path, '-map', '0:v:0', '-frames:v', '1',
+                '-q:v', '2', frame_path
+            ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if result.returncode != 0 or not os.path.getsize(frame_path):
+                return None
+            self.resize(frame_path, thumb_path)
+        finally:
+            os.remove(frame_path)
+        self._evict()
+        return thumb_path
+
+    def _evict(self):
+        entries = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                   if name.endswith('.jpg')]
+        if len(entries) <= self.max_cached:
+            return
+        entries.sort(key=os.path.getmtime)
+        for path in entries[:len(entries) - self.max_cached]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def custom(self, client, thumbnail: str) -> Optional[str]:
+        """The user's own thumbnail (local path or Telegram file_id), sized for upload"""
+        if not thumbnail:
+            return None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        source = thumbnail
+        if not os.path.exists(thumbnail):
+            source = os.path.join(self.cache_dir,
+                                  f"custom_{hashlib.sha1(thumbnail.encode()).hexdigest()}.jpg")
+            if not os.path.exists(source):
+                if client is None:
+                    return None
+                await client.download_media(thumbnail, file_name=source)
+        thumb_path = os.path.join(self.cache_dir, f"{self.cache_key(source)}.jpg")
+        if os.path.exists(thumb_path):
+            os.utime(thumb_path)
+        else:
+            await asyncio.to_thread(self.resize, source, thumb_path)
+            await asyncio.to_thread(self._evict)
+        return thumb_path
+
+    async def for_upload(self, input_path: str, client=None,
+                         custom_thumbnail: str = None) -> Tuple[Optional[str], Dict[str, Any]]:
+        """(thumbnail path, attributes) to attach when uploading a video"""
+        attributes = await asyncio.to_thread(self.attributes, input_path)
+        thumb = await self.custom(client, custom_thumbnail)
+        if thumb is None:
+            thumb = await asyncio.to_thread(self.extract, input_path)
+        return thumb, attributes
+
+
+thumbnail_service = ThumbnailService()
@@ -0,0 +1,124 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+_current: contextvars.ContextVar = contextvars.ContextVar('job_trace', default=None)
+
+PERCENTILES = (50, 95, 99)
+
+
+class JobTrace:
+    """Timeline of one job: when each phase ran, for how long and on how many bytes"""
+
+    def __init__(self, operation: str, media_duration: float = 0, queue_wait: float = 0.0):
+        self.operation = operation
+        self.media_duration = media_duration or 0
+        self.queue_wait = queue_wait
+        self.started = time.perf_counter()
+        # [phase, start offset ms, duration ms, bytes]
+        self.spans: List[list] = []
+        self.bytes = {"in": 0, "out": 0}
+        self._phase_bytes = {}
+
+    def span(self, phase: str, start: float, seconds: float):
+        """Add a phase that started at perf_counter() `start`"""
+        moved = self._phase_bytes.pop(phase, 0)
+        self.spans.append([phase, round((start - self.started) * 1000),
+                           round(seconds * 1000), moved])
+
+    def transfer(self, direction: str, amount: int, phase: str):
+        self.bytes[direction] += amount
+        self._phase_bytes[phase] = self._phase_bytes.get(phase, 0) + amount
+
+    def phases(self) -> Dict[str, float]:
+        """Seconds per phase, summed over repeated spans"""
+        totals: Dict[str, float] = {}
+        for phase, _, duration, _ in self.spans:
+            totals[phase] = totals.get(phase, 0) + duration / 1000
+        return totals
+
+    def document(self) -> Dict[str, Any]:
+        """Compact form stored on the job record"""
+        phases = self.phases()
+        process = phases.get("process")
+        return {
+            "wait": round(self.queue_wait, 3),
+            "total": round(time.perf_counter() - self.started, 3),
+            "phases": {phase: round(seconds, 3) for phase, seconds in phases.items()},
+            # Seconds of media processed per second of wall time
+            "speed": round(self.media_duration / process, 2) if process and self.media_duration else None,
+            "bytes_in": self.bytes["in"],
+            "bytes_out": self.bytes["out"],
+            "spans": self.spans,
+        }
+
+
+class Tracer:
+    """Per-job span tracing for the download, probe, process and upload phases.
+
+    The trace is bound to the running job with `job()` and found through a
+    context variable, so phases recorded from LazyMedia, ffprobe or a
+    to_thread pipeline land on the right job. Recording appends a short
+    list; nothing is written until the job's record is saved.
+    """
+
+    @contextmanager
+    def job(self, operation: str, media_duration: float = 0,
+            queue_wait: float = 0.0) -> Iterator[JobTrace]:
+        """Bind a trace to the job, or reuse the one a caller already bound"""
+        trace = _current.get()
+        if trace is not None and trace.operation == operation:
+            yield trace
+            return
+        trace = JobTrace(operation, media_duration, queue_wait)
+        token = _current.set(trace)
+        try:
+            yield trace
+        finally:
+            _current.reset(token)
+
+    def current(self) -> Optional[JobTrace]:
+        return _current.get()
+
+    def span(self, phase: str, start: float, seconds: float):
+        trace = _current.get()
+        if trace is not None:
+            trace.span(phase, start, seconds)
+
+    def transfer(self, direction: str, amount: int):
+        trace = _current.get()
+        if trace is not None:
+            trace.transfer(direction, amount, "download" if direction == "in" else "upload")
+
+    @staticmethod
+    def percentile(values: List[float], p: float) -> float:
+        """Nearest-rank percentile of sorted `values`"""
+        rank = max(1, -(-len(values) * p // 100))
+        return values[int(rank) - 1]
+
+    def summary(self, traces: List[Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """operation -> phase -> {"count", "p50", "p95", "p99"} over stored job records.
+
+        Besides the recorded phases, "wait" is the queue wait and "total"
+        the time from start to finish.
+        """
+        samples: Dict[str, Dict[str, List[float]]] = {}
+        for job in traces:
+            trace = job.get("trace") or {}
+            phases = samples.setdefault(job["job_type"], {})
+            values = dict(trace.get("phases", {}), wait=trace.get("wait", 0), total=trace.get("total", 0))
+            for phase, seconds in values.items():
+                phases.setdefault(phase, []).append(seconds)
+        result = {}
+        for operation, phases in samples.items():
+            result[operation] = {}
+            for phase, values in phases.items():
+                values.sort()
+                stats = {"count": len(values)}
+                stats.update({f"p{p}": self.percentile(values, p) for p in PERCENTILES})
+                result[operation][phase] = stats
+        return result
+
+
+tracer = Tracer()
@@ -0,0 +1,173 @@
+import os
+import sys
+import shutil
+import socket
+import asyncio
+import logging
+import argparse
+from contextlib import suppress
+from pyrogram import Client
+from config import Config
+from utils.admission import admission
+from utils.database import db
+from utils.gateway import gateway
+from utils.jobs import job_queue
+from utils.tracing import tracer
+from handlers.audio import run_audio_job
+from handlers.video import run_video_job
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Job type prefix -> coroutine that fetches, processes and uploads it
+RUNNERS = {
+    "video_": run_video_job,
+    "audio_": run_audio_job,
+}
+
+# Seconds between claim attempts while the queue is empty
+POLL_SECONDS = 2
+
+
+class Worker:
+    """A stateless processing node for jobs enqueued by main.py.
+
+    Each of `concurrency` slots claims one job at a time from the shared
+    queue, so running more workers, on this machine or others, adds
+    throughput without any coordination beyond MongoDB. While a job runs
+    its lease is renewed every third of the lease time; if a renewal
+    finds the job re-claimed (this worker was presumed dead) the local
+    run is cancelled.
+    """
+
+    def __init__(self, client: Client, worker_id: str = None,
+                 concurrency: int = Config.WORKER_CONCURRENCY):
+        self.client = client
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.concurrency = concurrency
+        self.active = 0
+
+    async def run(self):
+        await db.ensure_job_indexes()
+        logger.info(f"Worker {self.worker_id} started with {self.concurrency} slots")
+        await asyncio.gather(self.heartbeat(), job_queue.share_limits(),
+                             *(self.slot() for _ in range(self.concurrency)))
+
+    async def heartbeat(self):
+        while True:
+            await db.worker_heartbeat(self.worker_id, {
+                "host": socket.gethostname(),
+                "pid": os.getpid(),
+                "concurrency": self.concurrency,
+                "active": self.active,
+                **admission.snapshot(),
+            })
+            await asyncio.sleep(Config.JOB_LEASE_SECONDS / 3)
+
+    async def slot(self):
+        while True:
+            # Leave work for other nodes while this one is short of disk, memory or CPU
+            reason = admission.pressure()
+            if reason:
+                logger.debug(f"Not claiming jobs: {reason}")
+                await asyncio.sleep(POLL_SECONDS)
+                continue
+            try:
+                job = await job_queue.claim(self.worker_id)
+            except Exception as e:
+                # A scheduler or database error must not take the worker down
+                logger.error(f"Claiming a job failed: {e}")
+                await asyncio.sleep(POLL_SECONDS)
+                continue
+            if job is None:
+                await asyncio.sleep(POLL_SECONDS)
+                continue
+            self.active += 1
+            try:
+                await self.process(job)
+            finally:
+                self.active -= 1
+
+    async def process(self, job):
+        job_id = str(job["_id"])
+        runner = next((runner for prefix, runner in RUNNERS.items()
+                       if job["job_type"].startswith(prefix)), None)
+        temp_dir = os.path.join(Config.TEMP_DIR, "jobs", job_id)
+        status = None
+        trace = None
+        try:
+            if runner is None:
+                raise ValueError(f"Unknown job type: {job['job_type']}")
+            status = await job_queue.status(self.client, job)
+            media = job_queue.media(job)
+            queued_at = job.get("queued_at")
+            wait = (job["claimed_at"] - queued_at).total_seconds() if queued_at else 0.0
+            with tracer.job(job["job_type"], media.duration, wait) as trace, \
+                    admission.book(admission.estimate(job["job_type"], media.file_size)):
+                task = asyncio.create_task(runner(
+                    self.client, status, job["user_id"], media, job["job_type"], temp_dir
+                ))
+                while not task.done():
+                    await asyncio.wait({task}, timeout=Config.JOB_LEASE_SECONDS / 3)
+                    if not task.done() and not await db.renew_job_lease(job_id, self.worker_id):
+                        logger.warning(f"Lost lease on job {job_id}; another worker took it over")
+                        task.cancel()
+                        with suppress(asyncio.CancelledError):
+                            await task
+                        return
+                task.result()
+            await db.complete_job(job_id, trace.document())
+        except Exception as e:
+            logger.error(f"Job {job_id} ({job['job_type']}) failed: {e}")
+            await db.fail_job(job_id, self.worker_id, str(e), trace.document() if trace else None)
+            if status is not None and job.get("attempts", 0) >= Config.MAX_JOB_ATTEMPTS:
+                with suppress(Exception):
+                    await status.edit_text(f"❌ Error: {str(e)}")
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def build_client(worker_id: str) -> Client:
+    """Bot session for downloads and uploads only; updates go to main.py"""
+    return gateway.install(Client(
+        f"worker_{worker_id}",
+        api_id=Config.API_ID,
+        api_hash=Config.API_HASH,
+        bot_token=Config.BOT_TOKEN,
+        in_memory=True,
+        no_updates=True
+    ))
+
+async def main_async(args):
+    worker_id = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    client = build_client(worker_id)
+    if args.metrics_port:
+        from health import start_health_server
+        await start_health_server(args.metrics_port)
+    await client.start()
+    try:
+        await Worker(client, worker_id, args.concurrency).run()
+    finally:
+        await client.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Process queued media jobs")
+    parser.add_argument('--concurrency', type=int, default=Config.WORKER_CONCURRENCY)
+    parser.add_argument('--worker-id', help="defaults to <hostname>-<pid>")
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help="serve /health and /metrics on this port")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        logger.info("Worker stopped by user")
+    except Exception as e:
+        logger.error(f"Worker crashed with error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()